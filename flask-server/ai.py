@@ -0,0 +1,240 @@
+import atexit
+import math
+import random
+import time
+
+import beliefs
+import handstate
+import hearts
+import rollouts
+import solver
+
+
+def random_index(mask, rng):
+    return hearts.CardEngine.nth(mask, rng.randrange(mask.bit_count()))
+
+
+# What one player knows at a decision point, kept as plain ints and tuples so it can be sent to worker processes.
+# excluded holds, by seat, the cards that seat has been shown not to hold, and bonuses the cards worth less than zero
+# it has taken.
+class Position:
+
+    def __init__(self, _card_suits, _card_ranks, seat, hand, sizes, excluded, known, unseen, points, trick,
+                 hearts_broken=True, first_trick=False, rules=None, bonuses=None):
+        self.card_suits = list(_card_suits)
+        self.card_ranks = list(_card_ranks)
+        self.seat = seat
+        self.hand = hand
+        self.sizes = tuple(sizes)
+        self.excluded = tuple(excluded)
+        self.known = tuple(known)
+        self.unseen = unseen
+        self.points = tuple(points)
+        self.trick = tuple(trick)
+        self.hearts_broken = hearts_broken
+        self.first_trick = first_trick
+        self.rules = rules or hearts.Rules.of(_card_suits, _card_ranks)
+        self.bonuses = tuple(bonuses) if bonuses is not None else (0,) * len(self.sizes)
+        self.sampler = None
+
+    # The sampler's tables are rebuilt where they are used rather than sent to workers.
+    def __getstate__(self):
+        return {**self.__dict__, 'sampler': None}
+
+    @property
+    def engine(self):
+        return hearts.CardEngine.of(self.card_suits, self.card_ranks)
+
+    def player_count(self):
+        return len(self.sizes)
+
+    # Deals the unseen cards to the other players uniformly among the deals that respect what each has been shown not
+    # to hold. If no deal does, the exclusions are ignored rather than failing.
+    def sample(self, rng):
+        if self.sampler is None:
+            hands = list(self.known)
+            hands[self.seat] = self.hand
+            needs = [self.sizes[s] - hands[s].bit_count() if s != self.seat else 0 for s in range(self.player_count())]
+            sampler = beliefs.DealSampler(hands, needs, self.unseen, self.excluded)
+            if not sampler.total:
+                sampler = beliefs.DealSampler.fitting(hands, needs, self.unseen, [0] * self.player_count())
+            self.sampler = sampler
+        return self.sampler.sample(rng)
+
+    # The hand as it stands with the other hands filled in by hands, such as a sampled deal.
+    def state(self, hands):
+        leader = self.trick[0][0] if self.trick else self.seat
+        tricks = 0 if self.first_trick else max(1, self.rules.hand_size - max(self.sizes))
+        return handstate.HandState(self.engine, hands, leader, [i for _, i in self.trick], self.points,
+                                self.hearts_broken, tricks, 0, self.rules, self.bonuses)
+
+
+class Node:
+    __slots__ = ("children", "visits", "reward", "available")
+
+    def __init__(self):
+        self.children = {}
+        self.visits = 0
+        self.reward = 0.0
+        self.available = 1
+
+    def ucb(self, exploration):
+        return self.reward / self.visits + exploration * math.sqrt(math.log(self.available) / self.visits)
+
+
+# Single-observer information set MCTS: every iteration samples a deal consistent with what the player knows, descends
+# the shared tree over the moves legal in that deal, then finishes the hand with random play.
+def iterate(root, position, rng, exploration):
+    state = position.state(position.sample(rng))
+    total = state.rules.moon_points
+    node = root
+    path = []
+    while not state.over():
+        legal = state.legal()
+        if node is None:
+            state.apply_move(random_index(legal, rng))
+            continue
+        moves = list(hearts.CardEngine.indices(legal))
+        unexplored = [m for m in moves if m not in node.children]
+        for m in moves:
+            if m in node.children:
+                node.children[m].available += 1
+        if unexplored:
+            move = rng.choice(unexplored)
+            child = node.children[move] = Node()
+            node = None
+        else:
+            move = max(moves, key=lambda m: node.children[m].ucb(exploration))
+            child = node = node.children[move]
+        path.append((child, state.seat))
+        state.apply_move(move)
+    points = state.final_points()
+    for child, seat in path:
+        child.visits += 1
+        child.reward += 1 - points[seat] / total
+
+
+# Searches until the iterations or the time limit run out, or until stop() returns true.
+def search(position, iterations=None, time_limit=None, exploration=0.7, seed=None, stop=None):
+    rng = random.Random(seed)
+    root = Node()
+    deadline = time.perf_counter() + time_limit if time_limit is not None else None
+    i = 0
+    while i == 0 or ((iterations is None or i < iterations) and (deadline is None or time.perf_counter() < deadline)
+                     and (stop is None or not stop())):
+        iterate(root, position, rng, exploration)
+        i += 1
+    return {move: (child.visits, child.reward) for move, child in root.children.items()}
+
+
+# A card chosen without searching, for when there is no time to search: a follower plays its highest card that loses
+# the trick, or its lowest if every card wins it, a discard sheds the queen of spades, then the highest heart, then the
+# highest card, and a lead is the lowest card.
+def cheap_move(position):
+    engine = position.engine
+    state = position.state([position.hand if s == position.seat else 0 for s in range(position.player_count())])
+    legal = state.legal()
+    if not state.trick:
+        return min(hearts.CardEngine.indices(legal), key=lambda i: i % engine.rank_count)
+    following = legal & state.lead_mask
+    if following:
+        losing = following & ((1 << state.winning) - 1)
+        return hearts.CardEngine.highest(losing) if losing else (following & -following).bit_length() - 1
+    for mask in (engine.queen_of_spades_mask, engine.hearts_mask):
+        if legal & mask:
+            return hearts.CardEngine.highest(legal & mask)
+    return max(hearts.CardEngine.indices(legal), key=lambda i: i % engine.rank_count)
+
+
+def merge(stats, other):
+    for move, (visits, reward) in other.items():
+        v, r = stats.get(move, (0, 0.0))
+        stats[move] = (v + visits, r + reward)
+    return stats
+
+
+# Searches on a rollout executor shared with other players when one is given, and a search the executor cannot fit into
+# the time limit is replaced by cheap_move. Otherwise a strategy with more than one worker owns an executor with one
+# process fewer than its workers, searching in those processes and its own at once and merging the results. The owned
+# executor is started when a hand is dealt, so no move waits on processes starting, is rebuilt if the rules change, and
+# is shut down by close() or when the process exits.
+class ISMCTSStrategy(hearts.PassingStrategy):
+
+    def __init__(self, iterations=None, time_limit=0.05, workers=1, exploration=0.7, seed=None, endgame=0, samples=20,
+                 rollouts=None):
+        if iterations is None and time_limit is None:
+            raise ValueError("An iteration or time budget is required")
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.workers = workers
+        self.rollouts = rollouts
+        self.pool = None
+        self.exploration = exploration
+        self.rng = random.Random(seed) if seed is not None else None
+        self.endgame = endgame
+        self.samples = samples
+        self.solver = None
+
+    # Without a seed of its own, the strategy draws one from the player's generator, so seeded games replay exactly.
+    def new_hand(self, player, players):
+        if self.rng is None:
+            self.rng = random.Random(player.rng.getrandbits(64))
+        if self.solver is not None:
+            self.solver.clear()
+        rules = player.beliefs.rules if player.beliefs is not None else hearts.Rules.of()
+        if self.workers > 1 and self.rollouts is None and (self.pool is None or self.pool.rules is not rules):
+            self.close()
+            self.pool = rollouts.RolloutExecutor(self.workers - 1, rules)
+            self.pool.start()
+            atexit.register(self.close)
+
+    def close(self):
+        if self.pool is not None:
+            atexit.unregister(self.close)
+            self.pool.close()
+            self.pool = None
+
+    def position(self, player, trick):
+        beliefs = player.beliefs
+        engine = player.engine
+        sizes, known, unseen, excluded = beliefs.constraints(trick)
+        return Position(engine.card_suits, engine.card_ranks, beliefs.seat, player.mask, sizes, excluded, known, unseen,
+                        beliefs.points, beliefs.trick_cards(trick), trick.hearts_broken, trick.first(), beliefs.rules,
+                        beliefs.bonuses)
+
+    def choose_card(self, player, trick):
+        if player.beliefs is None:
+            return super().choose_card(player, trick)
+        position = self.position(player, trick)
+        legal = position.state([position.hand if s == position.seat else 0 for s in
+                                range(position.player_count())]).legal()
+        if legal.bit_count() == 1:
+            return player.engine.cards[hearts.CardEngine.highest(legal)]
+        if player.mask.bit_count() <= self.endgame and position.rules.standard_points:
+            return player.engine.cards[self.solve_endgame(position)]
+        if self.rollouts is not None:
+            stats = self.rollouts.submit(position, self.iterations, self.time_limit, self.exploration,
+                                         self.rng.getrandbits(64)).result()
+            return player.engine.cards[max(stats, key=lambda m: stats[m][0]) if stats else cheap_move(position)]
+        requests = [self.pool.submit(position, self.iterations, self.time_limit, self.exploration,
+                                     self.rng.getrandbits(64)) for _ in range(self.workers - 1)] if self.pool else []
+        stats = search(position, self.iterations, self.time_limit, self.exploration, self.rng.getrandbits(64))
+        [merge(stats, request.result() or {}) for request in requests]
+        move = max(stats, key=lambda m: stats[m][0])
+        return player.engine.cards[move]
+
+    # With few cards left, deals consistent with what the player knows are solved exactly and the card that takes the
+    # fewest points over all of them is played. The solver counts the standard card values, so rules that change them
+    # keep searching instead.
+    def solve_endgame(self, position):
+        if self.solver is None:
+            self.solver = solver.Solver(position.card_suits, position.card_ranks, position.player_count(), 1 << 16)
+        deadline = time.perf_counter() + self.time_limit if self.time_limit is not None else None
+        totals = {}
+        for i in range(self.samples):
+            if i and deadline is not None and time.perf_counter() > deadline:
+                break
+            for move, points in self.solver.move_values(position.sample(self.rng), position.seat, position.trick,
+                                                        position.hearts_broken).items():
+                totals[move] = totals.get(move, 0) + points
+        return min(totals, key=totals.get)
@@ -0,0 +1,176 @@
+import math
+from bisect import bisect_right
+
+import hearts
+
+
+# What one player knows about the other hands from the passes and tricks it has seen. Seats are in play order.
+class BeliefState:
+
+    def __init__(self, player, players, rules=None):
+        self.player = player
+        self.players = list(players)
+        self.engine = player.engine
+        self.rules = rules or hearts.Rules.of(self.engine.card_suits, self.engine.card_ranks)
+        self.bonus_mask = self.rules.bonus_mask
+        self.seats = {p: s for s, p in enumerate(players)}
+        self.seat = self.seats[player]
+        self.played = 0
+        self.passed = [0] * len(players)
+        self.points = [0] * len(players)
+        self.bonuses = [0] * len(players)
+        self.tricks = 0
+        self.last_sampler = (None, None)
+
+    def player_count(self):
+        return len(self.players)
+
+    def observe_pass(self, passer, receiver, cards):
+        if passer == self.player:
+            self.passed[self.seats[receiver]] |= sum(card.bit for card in cards)
+
+    def observe_trick(self, trick):
+        self.played |= trick.mask
+        seat = self.seats[trick.winning_player()]
+        self.points[seat] += trick.points()
+        if trick.point_mask & self.bonus_mask:
+            self.bonuses[seat] |= trick.point_mask & self.bonus_mask
+        self.tricks += 1
+
+    def trick_cards(self, trick):
+        return [(self.seats[player], card.index) for (_, player), card in trick.cards_by_player.items()]
+
+    # (hand sizes, known cards, unseen cards, excluded cards) by seat while trick is being played.
+    def constraints(self, trick=None):
+        trick_mask = trick.mask if trick is not None else 0
+        played_in_trick = {self.seats[p] for (_, p) in trick.cards_by_player} if trick is not None else ()
+        hand = self.player.mask
+        sizes = [self.rules.hand_size - self.tricks - (s in played_in_trick) for s in range(self.player_count())]
+        sizes[self.seat] = hand.bit_count()
+        known = [m & ~self.played & ~trick_mask for m in self.passed]
+        unseen = self.rules.deck_mask & ~hand & ~self.played & ~trick_mask & ~sum(known)
+        return sizes, known, unseen, [p.excluded for p in self.players]
+
+    # The sampler is rebuilt only when something has been observed since it was last asked for.
+    def sampler(self, trick=None):
+        constraints = self.constraints(trick)
+        key = tuple(map(tuple, constraints[:2])), constraints[2], tuple(constraints[3])
+        if self.last_sampler[0] != key:
+            sizes, known, unseen, excluded = constraints
+            hands = list(known)
+            hands[self.seat] = self.player.mask
+            self.last_sampler = key, DealSampler.fitting(hands, [s - h.bit_count() for s, h in zip(sizes, hands)],
+                                                         unseen, excluded)
+        return self.last_sampler[1]
+
+    # Hands for every seat drawn uniformly from the deals consistent with everything observed.
+    def sample(self, rng, trick=None):
+        return self.sampler(trick).sample(rng)
+
+    # For every seat, the probability that it holds each card, by card index.
+    def probabilities(self, trick=None):
+        return self.sampler(trick).probabilities(self.engine.card_count)
+
+
+# Deals unseen cards uniformly at random among the seats that still need them, never giving a seat a card it cannot
+# hold. Deals are counted up front, so a total of zero means none fits.
+class DealSampler:
+
+    def __init__(self, hands, needs, unseen, excluded):
+        self.hands = tuple(hands)
+        self.needs = tuple(needs)
+        seats = [s for s, n in enumerate(needs) if n > 0]
+        groups = {}
+        for i in hearts.CardEngine.indices(unseen):
+            groups.setdefault(tuple(s for s in seats if not excluded[s] >> i & 1), []).append(i)
+        self.groups = sorted(groups.items(), key=lambda group: len(group[1]))
+        self.splits = {}
+        self.total = self.count(0, self.needs) if sum(self.needs) == unseen.bit_count() else 0
+
+    @staticmethod
+    def fitting(hands, needs, unseen, excluded):
+        sampler = DealSampler(hands, needs, unseen, excluded)
+        if not sampler.total:
+            raise ValueError("Unseen cards do not fit the other players' hands")
+        return sampler
+
+    # The number of ways to deal groups level onwards to seats still needing remaining cards. Every way of splitting
+    # group level is kept with its cumulative count for sampling.
+    def count(self, level, remaining):
+        if level == len(self.groups):
+            return 0 if any(remaining) else 1
+        key = (level, remaining)
+        split = self.splits.get(key)
+        if split is not None:
+            return split[0]
+        seats, cards = self.groups[level]
+        size = len(cards)
+        ways = []
+        total = 0
+        for counts in self.counts(seats, size, remaining):
+            after = list(remaining)
+            for s, n in zip(seats, counts):
+                after[s] -= n
+            after = tuple(after)
+            rest = self.count(level + 1, after)
+            if rest:
+                multinomial = math.factorial(size)
+                for n in counts:
+                    multinomial //= math.factorial(n)
+                total += multinomial * rest
+                ways.append((total, counts, after, multinomial))
+        self.splits[key] = (total, [w[0] for w in ways], ways)
+        return total
+
+    # Every way to give size cards to seats without exceeding what each still needs.
+    @staticmethod
+    def counts(seats, size, remaining):
+        if not seats:
+            if size == 0:
+                yield ()
+            return
+        if len(seats) == 1:
+            if size <= remaining[seats[0]]:
+                yield size,
+            return
+        for n in range(min(size, remaining[seats[0]]) + 1):
+            for rest in DealSampler.counts(seats[1:], size - n, remaining):
+                yield (n,) + rest
+
+    def sample(self, rng):
+        hands = list(self.hands)
+        remaining = self.needs
+        for level, (seats, cards) in enumerate(self.groups):
+            total, cumulative, ways = self.splits[(level, remaining)]
+            _, counts, remaining, _ = ways[bisect_right(cumulative, rng.randrange(total))]
+            shuffled = rng.sample(cards, len(cards))
+            start = 0
+            for s, n in zip(seats, counts):
+                for i in shuffled[start:start + n]:
+                    hands[s] |= 1 << i
+                start += n
+        return hands
+
+    # Each card's chance of being in each hand over all consistent deals: the number of deals reaching every split is
+    # carried forward level by level and combined with the number completing it.
+    def probabilities(self, card_count):
+        probabilities = [[float(hand >> i & 1) for i in range(card_count)] for hand in self.hands]
+        reaching = {self.needs: 1}
+        for level, (seats, cards) in enumerate(self.groups):
+            expected = [0] * len(self.hands)
+            following = {}
+            for remaining, ways_to in reaching.items():
+                _, cumulative, ways = self.splits[(level, remaining)]
+                previous = 0
+                for total, counts, after, multinomial in ways:
+                    deals = ways_to * (total - previous)
+                    previous = total
+                    for s, n in zip(seats, counts):
+                        expected[s] += deals * n
+                    following[after] = following.get(after, 0) + ways_to * multinomial
+            reaching = following
+            for s in seats:
+                chance = expected[s] / (self.total * len(cards))
+                for i in cards:
+                    probabilities[s][i] = chance
+        return probabilities
@@ -0,0 +1,314 @@
+import argparse
+import atexit
+import io
+import json
+import os
+import platform
+import random
+import secrets
+import statistics
+import sys
+import tempfile
+import time
+
+import handstate
+import hearts
+import montecarlo
+import server
+import solver
+import storage
+
+benchmarks = {}
+
+
+# A benchmark times run(state) only; setup() builds a fresh state for every call so operations that consume their
+# input (dealing, passing, playing) can be measured on their own.
+class Benchmark:
+
+    def __init__(self, name, level, setup, run):
+        self.name = name
+        self.level = level
+        self.setup = setup
+        self.run = run
+
+    def time(self, number):
+        states = [self.setup() for _ in range(number)]
+        started = time.perf_counter()
+        [self.run(state) for state in states]
+        return (time.perf_counter() - started) / number
+
+    def measure(self, min_time=0.2, rounds=5):
+        number = 1
+        while (elapsed := self.time(number) * number) < min_time / rounds and number < 1 << 20:
+            number *= 2 if elapsed == 0 else max(2, min(10, int(min_time / rounds / elapsed) + 1))
+        timings = [self.time(number) for _ in range(rounds)]
+        return {'level': self.level, 'median': statistics.median(timings), 'min': min(timings), 'rounds': rounds,
+                'number': number}
+
+
+def benchmark(name, level, setup=lambda: None):
+    def register(run):
+        benchmarks[name] = Benchmark(name, level, setup, run)
+        return run
+
+    return register
+
+
+def new_game():
+    game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks)
+    game.add_players(hearts.player_names)
+    game.hand = 1
+    return game
+
+
+def dealt_game():
+    game = new_game()
+    game.deal_hand()
+    return game
+
+
+def passed_game():
+    game = dealt_game()
+    game.pass_hand()
+    return game
+
+
+def trick_in_progress():
+    game = passed_game()
+    first_player = game.get_first_player()
+    trick = first_player.play(hearts.Trick(1, game.starting_card, game.card_suits, game.card_ranks))
+    return game.players[(game.players.index(first_player) + 1) % game.player_count()], trick
+
+
+def completed_trick():
+    return next(passed_game().play_tricks())
+
+
+# Sampling does not change the beliefs, so every call draws from one sampler built a few tricks into a hand.
+belief_sampler_state = []
+
+
+def belief_sampler():
+    if not belief_sampler_state:
+        game = passed_game()
+        tricks = game.play_tricks()
+        [next(tricks) for _ in range(3)]
+        belief_sampler_state.append((game.players[0].beliefs.sampler(), random.Random(0)))
+    return belief_sampler_state[0]
+
+
+benchmark("deck_init", "micro")(lambda _: hearts.Deck(hearts.card_suits, hearts.card_ranks))
+benchmark("deck_shuffle", "micro", lambda: hearts.Deck(hearts.card_suits, hearts.card_ranks))(
+    lambda deck: deck.shuffle())
+benchmark("deal_cards", "micro", new_game)(lambda game: game.deal_cards())
+if montecarlo.np is not None:
+    benchmark("shuffle_batch_1000", "batch", lambda: montecarlo.spawn_generators(0, 1)[0])(
+        lambda rng: montecarlo.shuffle_batch(1000, 52, rng))
+benchmark("pass_three_cards", "micro", dealt_game)(lambda game: game.pass_three_cards(game.hand))
+benchmark("choose_pass", "micro",
+          lambda: (hearts.PassEvaluator.of(hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)),
+                   sum(1 << i for i in random.sample(range(52), 13))))(lambda state: state[0].choose(state[1]))
+benchmark("player_play", "micro", trick_in_progress)(lambda state: state[0].play(state[1]))
+benchmark("trick_winning_player", "micro", completed_trick)(lambda trick: trick.winning_player())
+benchmark("trick_str", "micro", completed_trick)(lambda trick: str(trick))
+benchmark("belief_sample", "micro", belief_sampler)(lambda state: state[0].sample(state[1]))
+
+
+# A game stepped to its first play of the first hand, or to the middle of a trick a few tricks in.
+def passed_stepped_game():
+    game = new_game()
+    steps = game.steps()
+    decision = next(steps)
+    while decision.kind != "play":
+        decision = steps.send(decision.choose())
+    return game, steps, decision
+
+
+def stepped_game():
+    game, steps, decision = passed_stepped_game()
+    while len(game.tricks_by_player) < 2 or not game.trick.mask:
+        decision = steps.send(decision.choose())
+    return game
+
+
+# A whole hand of random legal cards applied to one state and then taken back, 104 moves in all.
+@benchmark("hand_state_apply_undo", "hand",
+           lambda: (handstate.HandState.of(passed_stepped_game()[0]), random.Random(random.getrandbits(32))))
+def hand_state_apply_undo(state):
+    state, rng = state
+    while not state.over():
+        legal = state.legal()
+        state.apply_move(hearts.CardEngine.nth(legal, rng.randrange(legal.bit_count())))
+    while state.history:
+        state.undo_move()
+
+
+benchmark("game_snapshot", "micro", stepped_game)(lambda game: game.snapshot())
+benchmark("game_restore", "micro", lambda: (lambda game: (game, game.snapshot()))(stepped_game()))(
+    lambda state: state[0].restore(state[1]))
+
+
+@benchmark("play_hand", "hand", new_game)
+def play_hand(game):
+    game.deal_hand()
+    game.pass_hand()
+    for _ in game.play_tricks(): pass
+    game.score_hand()
+    game.end_hand()
+
+
+@benchmark("play_game", "game",
+           lambda: hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                               hearts.card_ranks))
+def play_game(game):
+    game.play(hearts.player_names)
+
+
+# A game with the jack of diamonds bonus and moon shots subtracted, for the cost of variant rules against play_game.
+@benchmark("play_game_variant", "game", lambda: hearts.Game.of(hearts.Rules.of(jack_of_diamonds=-10, moon="subtract")))
+def play_game_variant(game):
+    game.play(game.rules.player_names)
+
+
+# The same game rendered as console text into memory, for the cost of formatting on top of play_game.
+@benchmark("play_game_console", "game",
+           lambda: hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                               hearts.card_ranks))
+def play_game_console(game):
+    game.play(hearts.player_names, sink=hearts.ConsoleSink(io.StringIO()))
+
+
+def endgame_hands(cards_per_player=6):
+    cards = random.sample(range(52), 4 * cards_per_player)
+    return [sum(1 << i for i in cards[s::4]) for s in range(4)]
+
+
+benchmark("solve_endgame", "search", endgame_hands)(lambda hands: solver.Solver().solve(hands, 0))
+
+
+# A new seed per call measures rendering; route_home_page_cached measures a repeat visit answered with 304.
+@benchmark("route_home_page", "request", lambda: (server.app.test_client(), random.getrandbits(32)))
+def route_home_page(state):
+    client, seed = state
+    client.get(f'/?seed={seed}')
+
+
+def cached_home_page():
+    client = server.app.test_client()
+    return client, client.get('/?seed=0').headers['ETag']
+
+
+@benchmark("route_home_page_cached", "request", cached_home_page)
+def route_home_page_cached(state):
+    client, etag = state
+    client.get('/?seed=0', headers={'If-None-Match': etag})
+
+
+# Reading state does not change a table, so every call shares one table instead of filling the table store.
+table_client_state = []
+
+
+def table_client():
+    if not table_client_state:
+        client = server.app.test_client()
+        table_id = client.post('/tables', json={'bots': 3}).get_json()['id']
+        client.post(f'/tables/{table_id}/join', json={'name': 'Benchmark'})
+        table_client_state.append((client, table_id))
+    return table_client_state[0]
+
+
+@benchmark("route_table_state", "request", table_client)
+def route_table_state(state):
+    client, table_id = state
+    client.get(f'/tables/{table_id}?name=Benchmark')
+
+
+# One store in a temporary directory, shared by every call like a server's.
+game_store_state = []
+
+
+def game_store():
+    if not game_store_state:
+        directory = tempfile.TemporaryDirectory()
+        store = storage.GameStore(storage.SQLiteBackend(os.path.join(directory.name, "hearts.db")))
+        atexit.register(store.close)
+        game_store_state.append((store, directory))
+    return game_store_state[0][0]
+
+
+# 1000 moves queued and written, for the store's throughput.
+@benchmark("store_moves_1000", "batch", lambda: (game_store(), secrets.token_urlsafe(8)))
+def store_moves_1000(state):
+    store, table_id = state
+    [store.add("move", table_id, seq, "move", seq % 4, [seq % 52]) for seq in range(1, 1001)]
+    store.flush()
+
+
+# A table of four bots played to the end, with every move written, for the cost of a store against play_game.
+@benchmark("table_game_stored", "game", lambda: server.TableStore(store=game_store()).create())
+def table_game_stored(table):
+    [table.join(name, hearts.RandomStrategy()) for name in hearts.player_names]
+    table.store.flush()
+
+
+def run(names=None, min_time=0.2, rounds=5, seed=0):
+    random.seed(seed)
+    results = {}
+    for name, b in benchmarks.items():
+        if names and not any(n in name for n in names):
+            continue
+        results[name] = b.measure(min_time, rounds)
+    return {'python': platform.python_version(), 'platform': platform.platform(), 'timestamp': time.time(),
+            'benchmarks': results}
+
+
+# Returns (name, baseline median, current median, ratio, regressed) for every benchmark present in both runs.
+def compare(baseline, current, threshold=0.1):
+    rows = []
+    for name, result in current['benchmarks'].items():
+        if name not in baseline['benchmarks']:
+            continue
+        before = baseline['benchmarks'][name]['median']
+        ratio = result['median'] / before if before > 0 else float('inf')
+        rows.append((name, before, result['median'], ratio, ratio > 1 + threshold))
+    return rows
+
+
+def format_time(seconds):
+    for unit, scale in (("s", 1), ("ms", 1e-3), ("us", 1e-6)):
+        if seconds >= scale:
+            return f"{seconds / scale:.2f} {unit}"
+    return f"{seconds / 1e-9:.0f} ns"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the Hearts engine")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run")
+    run_parser.add_argument("names", nargs="*", help="only run benchmarks whose name contains one of these")
+    run_parser.add_argument("--output", help="save results as JSON")
+    run_parser.add_argument("--min-time", type=float, default=0.2)
+    run_parser.add_argument("--rounds", type=int, default=5)
+    compare_parser = commands.add_parser("compare")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=0.1,
+                                help="flag benchmarks whose median is this fraction slower than the baseline")
+    args = parser.parse_args(argv)
+    if args.command == "run":
+        results = run(args.names, args.min_time, args.rounds)
+        [print(f"{name:24} {r['level']:8} {format_time(r['median']):>10} (min {format_time(r['min'])})") for name, r in
+         results['benchmarks'].items()]
+        if args.output:
+            with open(args.output, "w") as file:
+                json.dump(results, file, indent=2)
+        return 0
+    with open(args.baseline) as baseline, open(args.current) as current:
+        rows = compare(json.load(baseline), json.load(current), args.threshold)
+    [print(f"{name:24} {format_time(before):>10} -> {format_time(after):>10} {ratio:6.2f}x"
+           f"{'  REGRESSION' if regressed else ''}") for name, before, after, ratio, regressed in rows]
+    return 1 if any(row[4] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+import threading
+from collections import OrderedDict
+
+
+# A process-wide cache for results that are expensive to compute and depend only on their key, such as solved
+# positions and chosen passes. Callers key results by a canonical form so equivalent states share an entry. Entries
+# from every namespace share one LRU bound, and hits and misses are counted per namespace.
+class ResultCache:
+
+    def __init__(self, max_entries=1 << 16):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    # The result stored for key in namespace, computing and storing it on a miss. Two threads missing the same key
+    # both compute it; the result is the same either way.
+    def get(self, namespace, key, compute):
+        entry_key = (namespace, key)
+        with self.lock:
+            if entry_key in self.entries:
+                self.entries.move_to_end(entry_key)
+                self.hits[namespace] = self.hits.get(namespace, 0) + 1
+                return self.entries[entry_key]
+        result = compute()
+        with self.lock:
+            self.misses[namespace] = self.misses.get(namespace, 0) + 1
+            self.entries[entry_key] = result
+            if len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+        return result
+
+    # {namespace: {'hits': ..., 'misses': ...}}
+    def stats(self):
+        with self.lock:
+            return {namespace: {'hits': self.hits.get(namespace, 0), 'misses': self.misses.get(namespace, 0)} for
+                    namespace in sorted(self.hits.keys() | self.misses.keys())}
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.hits.clear()
+            self.misses.clear()
+
+
+results = ResultCache()
@@ -0,0 +1,137 @@
+import asyncio
+import json
+import re
+import threading
+
+resync_event = json.dumps({'type': 'resync'})
+events_path = re.compile(r"^/tables/([\w-]+)/events$")
+
+
+class Subscription:
+
+    def __init__(self, channel, table_id, queue_size):
+        self.channel = channel
+        self.table_id = table_id
+        self.queue = asyncio.Queue(queue_size)
+
+    def put(self, data):
+        # A subscriber that falls a full queue behind loses its backlog and is told to re-read the table state, so a
+        # slow spectator never holds up the game or the other spectators.
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(resync_event)
+            self.channel.dropped += 1
+        self.queue.put_nowait(data)
+
+    async def get(self, timeout=None):
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        subscriptions = self.channel.subscriptions.get(self.table_id)
+        if subscriptions is not None:
+            subscriptions.discard(self)
+            if not subscriptions:
+                del self.channel.subscriptions[self.table_id]
+
+
+# Fans table events out to every spectator of the table as server-sent events. The channel runs its own asyncio loop on
+# a background thread; publish is safe to call from any thread and does nothing until the channel is started.
+class EventChannel:
+
+    def __init__(self, queue_size=64, keep_alive=15):
+        if queue_size < 2:
+            raise ValueError(f"Event queues must hold at least 2 events: {queue_size}")
+        self.queue_size = queue_size
+        self.keep_alive = keep_alive
+        self.loop = None
+        self.server = None
+        self.thread = None
+        self.subscriptions = {}
+        self.published = 0
+        self.dropped = 0
+
+    def start(self, host="127.0.0.1", port=5001):
+        ready = threading.Event()
+        failures = []
+
+        def run():
+            loop = asyncio.new_event_loop()
+            try:
+                self.server = loop.run_until_complete(asyncio.start_server(self.handle, host, port))
+            except OSError as e:
+                failures.append(e)
+                loop.close()
+                ready.set()
+                return
+            self.loop = loop
+            ready.set()
+            loop.run_forever()
+
+        self.thread = threading.Thread(target=run, name="events", daemon=True)
+        self.thread.start()
+        ready.wait()
+        if failures:
+            self.thread = None
+            raise failures[0]
+        return self.server.sockets[0].getsockname()[1]
+
+    def stop(self):
+        if self.loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self.shutdown(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.loop = None
+
+    async def shutdown(self):
+        self.server.close()
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        [t.cancel() for t in tasks]
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def publish(self, table_id, event):
+        if self.loop is not None:
+            self.loop.call_soon_threadsafe(self.fan_out, table_id, json.dumps(event, separators=(",", ":")))
+
+    def fan_out(self, table_id, data):
+        self.published += 1
+        [subscription.put(data) for subscription in self.subscriptions.get(table_id, ())]
+
+    def subscribe(self, table_id):
+        subscription = Subscription(self, table_id, self.queue_size)
+        self.subscriptions.setdefault(table_id, set()).add(subscription)
+        return subscription
+
+    def spectator_count(self):
+        return sum(len(s) for s in self.subscriptions.values())
+
+    async def handle(self, reader, writer):
+        try:
+            request_line = (await reader.readline()).decode("latin-1").split()
+            while (await reader.readline()) not in (b"\r\n", b"\n", b""): pass
+            match = events_path.match(request_line[1]) if len(request_line) == 3 and request_line[0] == "GET" else None
+            if match is None:
+                writer.write(b"HTTP/1.1 404 Not Found\r\nContent-Length: 0\r\nConnection: close\r\n\r\n")
+                await writer.drain()
+                return
+            writer.write(b"HTTP/1.1 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n"
+                         b"Access-Control-Allow-Origin: *\r\nConnection: keep-alive\r\n\r\n")
+            await writer.drain()
+            await self.stream(self.subscribe(match.group(1)), writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def stream(self, subscription, writer):
+        try:
+            while True:
+                try:
+                    writer.write(f"data: {await subscription.get(self.keep_alive)}\n\n".encode())
+                except asyncio.TimeoutError:
+                    writer.write(b": keep-alive\n\n")
+                await writer.drain()
+        finally:
+            subscription.close()
@@ -0,0 +1,119 @@
+import hearts
+
+
+# A hand in play as plain ints for search, which makes and unmakes moves with apply_move and undo_move. bonuses holds by
+# seat the cards worth less than zero taken before the state.
+class HandState:
+    __slots__ = ("engine", "rules", "card_points", "hands", "trick", "leader", "seat", "points", "bonuses",
+                 "hearts_broken", "tricks", "starting_bit", "lead_mask", "winning", "winner", "trick_points", "history",
+                 "finished", "base")
+
+    def __init__(self, engine, hands, leader, trick=(), points=None, hearts_broken=False, tricks=0, starting_bit=0,
+                 rules=None, bonuses=None):
+        self.engine = engine
+        self.rules = rules or hearts.Rules.of(engine.card_suits, engine.card_ranks)
+        self.card_points = self.rules.card_points
+        self.hands = list(hands)
+        self.trick = list(trick)
+        self.leader = leader
+        self.seat = (leader + len(self.trick)) % len(self.hands)
+        self.points = list(points) if points is not None else [0] * len(self.hands)
+        self.bonuses = tuple(bonuses) if bonuses is not None else (0,) * len(self.hands)
+        self.hearts_broken = hearts_broken
+        self.tricks = tricks
+        self.starting_bit = starting_bit
+        self.lead_mask = engine.card_suit_masks[self.trick[0]] if self.trick else 0
+        self.winning = max((i for i in self.trick if self.lead_mask >> i & 1), default=-1)
+        self.winner = (leader + self.trick.index(self.winning)) % len(self.hands) if self.trick else -1
+        self.trick_points = sum(self.card_points[i] for i in self.trick)
+        self.history = []
+        self.finished = []
+        self.base = None
+
+    # The state of a game whose players are playing a trick, with seats in the game's play order. The game's snapshot is
+    # kept so resume() can put the game where the state stands.
+    @staticmethod
+    def of(game):
+        if game.phase != "play":
+            raise ValueError("A hand state can only be taken while tricks are being played")
+        engine = hearts.CardEngine.of(game.card_suits, game.card_ranks)
+        seats = {p: s for s, p in enumerate(game.players)}
+        points = [0] * game.player_count()
+        bonuses = [0] * game.player_count()
+        for player, tricks in game.tricks_by_player.items():
+            points[seats[player]] = sum(t.points() for t in tricks)
+            bonuses[seats[player]] = sum(t.point_mask for t in tricks) & game.rules.bonus_mask
+        state = HandState(engine, [p.mask for p in game.players], seats[game.leader],
+                          [c.index for c in game.trick.cards_by_player.values()], points, game.trick.hearts_broken,
+                          game.trick.index - 1, game.starting_card.bit, game.rules, bonuses)
+        state.base = game.snapshot()
+        return state
+
+    def legal(self):
+        return self.engine.legal(self.hands[self.seat], self.lead_mask, self.tricks == 0, self.hearts_broken,
+                                 self.starting_bit)
+
+    def over(self):
+        return not self.trick and not self.hands[self.seat]
+
+    def apply_move(self, index):
+        bit = 1 << index
+        seat = self.seat
+        self.history.append((index, seat, self.lead_mask, self.winning, self.winner, self.trick_points,
+                             self.hearts_broken))
+        self.hands[seat] ^= bit
+        self.trick.append(index)
+        self.trick_points += self.card_points[index]
+        if bit & self.engine.hearts_mask:
+            self.hearts_broken = True
+        if not self.lead_mask:
+            self.lead_mask = self.engine.card_suit_masks[index]
+            self.winning, self.winner = index, seat
+        elif bit & self.lead_mask and index > self.winning:
+            self.winning, self.winner = index, seat
+        if len(self.trick) < len(self.hands):
+            self.seat = (seat + 1) % len(self.hands)
+            return
+        self.points[self.winner] += self.trick_points
+        self.finished.append((self.trick, self.leader))
+        self.trick = []
+        self.leader = self.seat = self.winner
+        self.tricks += 1
+        self.lead_mask, self.winning, self.winner, self.trick_points = 0, -1, -1, 0
+
+    def undo_move(self):
+        index, seat, self.lead_mask, self.winning, self.winner, self.trick_points, self.hearts_broken = \
+            self.history.pop()
+        if not self.trick:
+            self.points[self.leader] -= self.trick_points + self.card_points[index]
+            self.trick, self.leader = self.finished.pop()
+            self.tricks -= 1
+        self.trick.pop()
+        self.hands[seat] |= 1 << index
+        self.seat = seat
+
+    # Points by seat at the end of the hand, with a moon shot scored by the rules.
+    def final_points(self):
+        rules = self.rules
+        if not rules.bonus_mask:
+            return rules.score(self.points, rules.shooter(self.points))
+        bonuses = list(self.bonuses)
+        winners = [leader for _, leader in self.finished[1:]] + [self.leader]
+        for (trick, _), winner in zip(self.finished, winners):
+            bonuses[winner] |= sum(1 << i for i in trick) & rules.bonus_mask
+        return rules.score(self.points, rules.shooter([p - rules.points(b) for p, b in zip(self.points, bonuses)]))
+
+    # Puts the game this state was taken from where the state stands. Returns a step generator and its decision, or
+    # None if the game ended.
+    def resume(self, game):
+        if self.base is None:
+            raise ValueError("Only a hand state taken from a game can resume it")
+        game.restore(self.base)
+        steps = game.steps()
+        try:
+            decision = next(steps)
+            for index, *_ in self.history:
+                decision = steps.send(self.engine.cards[index])
+        except StopIteration:
+            decision = None
+        return steps, decision
@@ -1,6 +1,12 @@
+import json
+import math
 import random
-from itertools import cycle
-from flask import Flask, render_template
+import sys
+import time
+from itertools import combinations, cycle
+import beliefs
+import cache
+from metrics import metrics
 
 clubs_suit = "\033[38;2;0;128;0m\N{Black Club Suit}\033[0m"
 diamonds_suit = "\033[38;2;255;0;255m\N{Black Diamond Suit}\033[0m"
@@ -10,40 +16,164 @@ card_suits = [clubs_suit, diamonds_suit, spades_suit, hearts_suit]
 card_ranks = ["2", "3", "4", "5", "6", "7", "8", "9", "10", "J", "Q", "K", "A"]
 starting_card_rank = "2"
 starting_card_suit = clubs_suit
-player_names = ["Bob", "Alice", "John", "Sandy"]
-ordinals = ["1st", "2nd", "3rd", "4th"]
+seat_names = ["Bob", "Alice", "John", "Sandy", "Maria", "Omar"]
+player_names = seat_names[:4]
+ordinals = ["1st", "2nd", "3rd", "4th", "5th", "6th"]
 max_points = 100
 
 
+# Cards of a (suits, ranks) configuration map to bit positions suit_index * rank_count + rank_index, so any set of
+# cards (a hand, the deck, a trick) is an int mask, a suit is a contiguous run of bits and higher ranks are higher bits.
+class CardEngine:
+    engines = {}
+
+    def __init__(self, _card_suits, _card_ranks):
+        self.card_suits = list(_card_suits)
+        self.card_ranks = list(_card_ranks)
+        self.rank_count = len(self.card_ranks)
+        self.card_count = len(self.card_suits) * self.rank_count
+        self.suit_indices = {s: i for i, s in enumerate(self.card_suits)}
+        self.rank_indices = {r: i for i, r in enumerate(self.card_ranks)}
+        self.full_mask = (1 << self.card_count) - 1
+        self.suit_masks = {s: ((1 << self.rank_count) - 1) << (i * self.rank_count) for i, s in
+                           enumerate(self.card_suits)}
+        self.hearts_mask = self.suit_mask(hearts_suit)
+        self.queen_of_spades_mask = self.bit("Q", spades_suit)
+        self.point_mask = self.hearts_mask | self.queen_of_spades_mask
+        self.card_points = [self.points(1 << i) for i in range(self.card_count)]
+        self.card_suit_masks = [self.suit_masks[s] for s in self.card_suits for _ in self.card_ranks]
+        self.cards = [Card.create(r, s, self) for s in self.card_suits for r in self.card_ranks]
+        self.rank_mask = (1 << self.rank_count) - 1
+        self.plain_suits = [i for i, s in enumerate(self.card_suits) if s not in (hearts_suit, spades_suit)]
+
+    @staticmethod
+    def of(_card_suits, _card_ranks):
+        key = (tuple(_card_suits), tuple(_card_ranks))
+        engine = CardEngine.engines.get(key)
+        if engine is None:
+            engine = CardEngine.engines[key] = CardEngine(_card_suits, _card_ranks)
+        return engine
+
+    def index(self, rank, suit):
+        return self.suit_indices[suit] * self.rank_count + self.rank_indices[rank]
+
+    def bit(self, rank, suit):
+        return 1 << self.index(rank, suit) if suit in self.suit_indices and rank in self.rank_indices else 0
+
+    def suit_mask(self, suit):
+        return self.suit_masks.get(suit, 0)
+
+    def points(self, mask):
+        return (mask & self.hearts_mask).bit_count() + (13 if mask & self.queen_of_spades_mask else 0)
+
+    # The cards of hand that may be played. lead_mask is the led suit's mask, or 0 for the lead.
+    def legal(self, hand, lead_mask, first_trick, hearts_broken, starting_bit):
+        if not lead_mask:
+            if first_trick and hand & starting_bit:
+                return starting_bit
+            return hand if hearts_broken else hand & ~self.hearts_mask or hand
+        return hand & lead_mask or (hand & ~self.point_mask or hand if first_trick else hand)
+
+    # Reorders the suits other than hearts and spades, which play alike, and returns the masks with the mapping used.
+    def canonical(self, masks):
+        rank_count, rank_mask = self.rank_count, self.rank_mask
+        ordered = sorted((tuple(m >> (s * rank_count) & rank_mask for m in masks), s) for s in self.plain_suits)
+        if all(s == t for (_, s), t in zip(ordered, self.plain_suits)):
+            return tuple(masks), None
+        mapping = list(range(len(self.card_suits)))
+        for (_, s), t in zip(ordered, self.plain_suits):
+            mapping[s] = t
+        return tuple(self.permute(m, mapping) for m in masks), mapping
+
+    def permute(self, mask, mapping):
+        if mapping is None:
+            return mask
+        rank_count, rank_mask = self.rank_count, self.rank_mask
+        return sum((mask >> (s * rank_count) & rank_mask) << (t * rank_count) for s, t in enumerate(mapping))
+
+    def permute_index(self, index, mapping):
+        if mapping is None:
+            return index
+        return mapping[index // self.rank_count] * self.rank_count + index % self.rank_count
+
+    @staticmethod
+    def inverse(mapping):
+        if mapping is None:
+            return None
+        inverse = [0] * len(mapping)
+        for s, t in enumerate(mapping):
+            inverse[t] = s
+        return inverse
+
+    def indices_by_suit_descending_rank(self, mask):
+        return [i for suit_mask in self.suit_masks.values() for i in reversed(list(self.indices(mask & suit_mask)))]
+
+    @staticmethod
+    def indices(mask):
+        while mask:
+            low = mask & -mask
+            yield low.bit_length() - 1
+            mask ^= low
+
+    @staticmethod
+    def highest(mask):
+        return mask.bit_length() - 1
+
+    @staticmethod
+    def nth(mask, n):
+        for _ in range(n):
+            mask &= mask - 1
+        return (mask & -mask).bit_length() - 1
+
+
+# Cards are flyweights: each engine builds its cards once and Card(...) hands out the shared instance, so cards compare
+# and hash by identity.
 class Card:
+    __slots__ = ("rank", "suit", "engine", "index", "bit", "suit_symbol_html", "suit_color_html")
 
-    def __init__(self, rank, suit, _card_suits, _card_ranks):
-        if not (suit in _card_suits):
+    def __new__(cls, rank, suit, _card_suits, _card_ranks):
+        engine = CardEngine.of(_card_suits, _card_ranks)
+        if suit not in engine.suit_indices:
             raise ValueError(f"Invalid card suit {suit}")
-        if not (rank in _card_ranks):
+        if rank not in engine.rank_indices:
             raise ValueError(f"Invalid card rank: {rank}")
-        self.rank = rank
-        self.suit = suit
-        self.suit_symbol_html = \
-            "&#9830;" if self.suit == diamonds_suit else \
-                "&#9824;" if self.suit == spades_suit else \
-                    "&#9827;" if self.suit == clubs_suit else \
-                        "&#9829;" if self.suit == hearts_suit else ""
-        self.suit_color_html = \
-            "#00ff00" if self.rank == "2" and self.suit == clubs_suit else \
-                "#ffff00" if self.rank == "Q" and self.suit == spades_suit else \
-                    "#ff00ff" if self.suit == diamonds_suit else \
-                        "#8080ff" if self.suit == spades_suit else \
-                            "#006500" if self.suit == clubs_suit else \
-                                "#ff0000" if self.suit == hearts_suit else "#000000"
+        return engine.cards[engine.index(rank, suit)]
 
-    def __eq__(self, other):
-        if isinstance(other, Card):
-            return self.rank == other.rank and self.suit == other.suit
-        return NotImplemented
+    @staticmethod
+    def create(rank, suit, engine):
+        card = object.__new__(Card)
+        set_slot = object.__setattr__
+        set_slot(card, "rank", rank)
+        set_slot(card, "suit", suit)
+        set_slot(card, "engine", engine)
+        set_slot(card, "index", engine.index(rank, suit))
+        set_slot(card, "bit", 1 << card.index)
+        set_slot(card, "suit_symbol_html",
+                 "&#9830;" if suit == diamonds_suit else
+                 "&#9824;" if suit == spades_suit else
+                 "&#9827;" if suit == clubs_suit else
+                 "&#9829;" if suit == hearts_suit else "")
+        set_slot(card, "suit_color_html",
+                 "#00ff00" if rank == "2" and suit == clubs_suit else
+                 "#ffff00" if rank == "Q" and suit == spades_suit else
+                 "#ff00ff" if suit == diamonds_suit else
+                 "#8080ff" if suit == spades_suit else
+                 "#006500" if suit == clubs_suit else
+                 "#ff0000" if suit == hearts_suit else "#000000")
+        return card
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"Card is immutable: cannot set {name}")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"Card is immutable: cannot delete {name}")
+
+    def __reduce__(self):
+        return Card, (self.rank, self.suit, self.engine.card_suits, self.engine.card_ranks)
 
     def encode(self):
-        return {'rank': self.rank, 'suit_html': self.suit_symbol_html, 'suit_color': self.suit_color_html}
+        return {'index': self.index, 'rank': self.rank, 'suit_html': self.suit_symbol_html,
+                'suit_color': self.suit_color_html}
 
     def __str__(self):
         return "[Q\033[38;2;255;255;0m\N{Black Spade Suit}\033[0m]" if self.rank == "Q" and self.suit == spades_suit \
@@ -51,22 +181,25 @@ class Card:
                   else f"[{self.rank}{self.suit}]")
 
 
+# A deck of every card of the configuration, or of the cards of mask only.
 class Deck:
 
-    def __init__(self, _card_suits, _card_ranks):
-        self.cards = []
-        for s in _card_suits:
-            for r in _card_ranks:
-                self.cards.append(Card(r, s, _card_suits, _card_ranks))
+    def __init__(self, _card_suits, _card_ranks, mask=None):
+        engine = CardEngine.of(_card_suits, _card_ranks)
+        self.mask = engine.full_mask if mask is None else mask
+        self.cards = list(engine.cards) if self.mask == engine.full_mask else [engine.cards[i] for i in
+                                                                               CardEngine.indices(self.mask)]
 
     def count(self):
         return len(self.cards)
 
-    def shuffle(self):
-        random.shuffle(self.cards)
+    def shuffle(self, rng=random):
+        rng.shuffle(self.cards)
 
     def take(self):
-        return self.cards.pop()
+        card = self.cards.pop()
+        self.mask ^= card.bit
+        return card
 
     def encode(self):
         return [card.encode() for card in self.cards]
@@ -80,23 +213,208 @@ class Deck:
         return '\n'.join([str(c) for c in self.cards])
 
 
+# A variant of the rules for 3 to 6 players, compiled once into the tables play looks up. Pass offsets are seats to the
+# left, so 1 passes left, -1 right and 0 keeps.
+class Rules:
+    compiled = {}
+    max_end_score = 1000
+    # A backstop for scores that drift without ending the game: it ends after this many hands all the same.
+    max_hands = 1000
+    moon_scorings = ("add", "subtract", "choose", "none")
+    options = ("player_count", "queen_of_spades", "jack_of_diamonds", "pass_schedule", "end_score", "moon")
+
+    def __init__(self, _card_suits=card_suits, _card_ranks=card_ranks, player_count=4, queen_of_spades=13,
+                 jack_of_diamonds=0, pass_schedule=None, end_score=max_points, moon="add"):
+        if not 3 <= player_count <= 6:
+            raise ValueError(f"Games are for 3 to 6 players: {player_count}")
+        if not 0 < end_score <= Rules.max_end_score:
+            raise ValueError(f"The end score must be from 1 to {Rules.max_end_score}: {end_score}")
+        if moon not in Rules.moon_scorings:
+            raise ValueError(f"Unknown moon scoring {moon}; choose from {', '.join(Rules.moon_scorings)}")
+        engine = self.engine = CardEngine.of(_card_suits, _card_ranks)
+        self.card_suits = engine.card_suits
+        self.card_ranks = engine.card_ranks
+        self.player_count = player_count
+        self.queen_of_spades = queen_of_spades
+        self.jack_of_diamonds = jack_of_diamonds
+        self.end_score = end_score
+        self.moon = moon
+        plain_suits = [i for i in reversed(range(len(engine.card_suits))) if i in engine.plain_suits]
+        lowest = [s * engine.rank_count + r for r in range(engine.rank_count) for s in plain_suits]
+        extra = engine.card_count % player_count
+        if extra > len(lowest):
+            raise ValueError(f"The deck cannot be dealt out evenly to {player_count} players")
+        self.removed_mask = sum(1 << i for i in lowest[:extra])
+        self.deck_mask = engine.full_mask & ~self.removed_mask
+        self.hand_size = self.deck_mask.bit_count() // player_count
+        first_suit = self.deck_mask & engine.suit_masks[engine.card_suits[0]]
+        self.starting_card = engine.cards[(first_suit & -first_suit).bit_length() - 1]
+        self.card_points = [0] * engine.card_count
+        for i in CardEngine.indices(self.deck_mask & engine.hearts_mask):
+            self.card_points[i] = 1
+        for mask, points in ((engine.queen_of_spades_mask, queen_of_spades),
+                             (engine.bit("J", diamonds_suit), jack_of_diamonds)):
+            if mask & self.deck_mask:
+                self.card_points[CardEngine.highest(mask)] = points
+        self.scoring_mask = sum(1 << i for i, p in enumerate(self.card_points) if p)
+        self.moon_mask = sum(1 << i for i, p in enumerate(self.card_points) if p > 0)
+        self.bonus_mask = self.scoring_mask & ~self.moon_mask
+        self.moon_points = self.points(self.moon_mask)
+        if self.scoring_mask and self.points(self.deck_mask) <= 0:
+            raise ValueError(f"The points of a hand must add up to more than zero: {self.points(self.deck_mask)}")
+        self.standard_points = self.card_points == engine.card_points
+        if pass_schedule is None:
+            pass_schedule = [o for k in range(1, player_count // 2 + 1) for o in ((k,) if 2 * k == player_count else
+                                                                                  (k, -k))] + [0]
+        self.pass_schedule = tuple(pass_schedule)
+        if not self.pass_schedule or any(not -player_count < o < player_count for o in self.pass_schedule):
+            raise ValueError(f"Pass offsets must be seats away from the passer: {list(self.pass_schedule)}")
+        self.pass_seats = [tuple(((i * (-1 if o < 0 else 1)) % player_count,
+                                  (i * (-1 if o < 0 else 1) + o) % player_count) for i in range(player_count)) if o
+                           else () for o in self.pass_schedule]
+        self.pass_descriptions = [Rules.describe_pass(o, player_count) for o in self.pass_schedule]
+        self.player_names = seat_names[:player_count]
+        self.key = (tuple(self.card_suits), tuple(self.card_ranks), player_count, queen_of_spades, jack_of_diamonds,
+                    self.pass_schedule, end_score, moon)
+
+    @staticmethod
+    def of(_card_suits=card_suits, _card_ranks=card_ranks, player_count=4, queen_of_spades=13, jack_of_diamonds=0,
+           pass_schedule=None, end_score=max_points, moon="add"):
+        key = (tuple(_card_suits), tuple(_card_ranks), player_count, queen_of_spades, jack_of_diamonds,
+               tuple(pass_schedule) if pass_schedule is not None else None, end_score, moon)
+        rules = Rules.compiled.get(key)
+        if rules is None:
+            rules = Rules(_card_suits, _card_ranks, player_count, queen_of_spades, jack_of_diamonds, pass_schedule,
+                          end_score, moon)
+            rules = Rules.compiled[key] = Rules.compiled.setdefault(rules.key, rules)
+        return rules
+
+    # Rules for the standard deck from a JSON object of options, such as a request body. Rules made from outside input
+    # are not kept in Rules.compiled, unless they are the same as rules already there.
+    @staticmethod
+    def parse(config):
+        if not isinstance(config, dict):
+            raise ValueError(f"Rules must be an object of options: {config}")
+        unknown = [k for k in config if k not in Rules.options]
+        if unknown:
+            raise ValueError(f"Unknown rules {', '.join(map(str, unknown))}; choose from {', '.join(Rules.options)}")
+        schedule = config.get('pass_schedule')
+        numbers = [config[k] for k in Rules.options if k in config and k not in ("pass_schedule", "moon")]
+        if not isinstance(schedule, (list, type(None))) or not isinstance(config.get('moon', ""), str) or any(
+                not isinstance(n, int) or isinstance(n, bool) for n in numbers + (schedule or [])):
+            raise ValueError(f"Rules take whole numbers, a list of them for pass_schedule and a name for moon: "
+                             f"{config}")
+        rules = Rules(**config)
+        return Rules.compiled.get(rules.key, rules)
+
+    def encode(self):
+        return {'player_count': self.player_count, 'queen_of_spades': self.queen_of_spades,
+                'jack_of_diamonds': self.jack_of_diamonds, 'pass_schedule': list(self.pass_schedule),
+                'end_score': self.end_score, 'moon': self.moon}
+
+    def __reduce__(self):
+        return Rules.of, self.key
+
+    @staticmethod
+    def describe_pass(offset, player_count):
+        seats = offset % player_count
+        if seats == 0:
+            return "None / Keep"
+        if 2 * seats == player_count:
+            return "Across"
+        direction = "Left / Clockwise" if seats < player_count - seats else "Right / Counter-Clockwise"
+        seats = min(seats, player_count - seats)
+        return direction if seats == 1 else f"{seats} Seats {direction}"
+
+    # The (passer seat, receiver seat) pairs of a hand, numbered from 1.
+    def passes(self, hand):
+        return self.pass_seats[(hand - 1) % len(self.pass_seats)]
+
+    def pass_description(self, hand):
+        return self.pass_descriptions[(hand - 1) % len(self.pass_descriptions)]
+
+    def points(self, mask):
+        return sum(self.card_points[i] for i in CardEngine.indices(mask & self.scoring_mask))
+
+    # The seat that shot the moon, given the points each seat took from cards worth more than zero, or None.
+    def shooter(self, penalties):
+        if self.moon == "none" or not self.moon_points:
+            return None
+        return next((s for s, p in enumerate(penalties) if p == self.moon_points), None)
+
+    # Points by seat for a hand from the points each seat took. totals, the game totals before the hand, let "choose"
+    # see whether adding would end the game with the shooter behind; without them it adds.
+    def score(self, points, shooter=None, totals=None):
+        if shooter is None:
+            return list(points)
+        moon = self.moon_points
+        added = [p - moon if s == shooter else p + moon for s, p in enumerate(points)]
+        subtracted = [p - 2 * moon if s == shooter else p for s, p in enumerate(points)]
+        if self.moon == "subtract":
+            return subtracted
+        if self.moon == "choose" and totals is not None:
+            after = [t + p for t, p in zip(totals, added)]
+            if max(after) >= self.end_score and after[shooter] > min(after):
+                return subtracted
+        return added
+
+
+# The winner, point total and point cards of a trick are kept up to date as cards are added, so a finished trick can be
+# resolved and rendered without rescanning or sorting its cards. Points are looked up in the rules' table by card index.
 class Trick:
-    def __init__(self, index, starting_card, _card_suits, _card_ranks):
+    def __init__(self, index, starting_card, _card_suits, _card_ranks, hearts_broken=False, rules=None):
         self.index = index
         self.starting_card = starting_card
         self.card_suits = _card_suits
         self.card_ranks = _card_ranks
+        self.engine = CardEngine.of(_card_suits, _card_ranks)
+        self.rules = rules or Rules.of(_card_suits, _card_ranks)
         self.cards_by_player = {}
+        self.players_by_index = {}
+        self.orders_by_index = {}
+        self.mask = 0
         self.suit = ""
+        self.suit_mask = 0
         self.card_index = 0
+        self.winning_index = -1
+        self.points_total = 0
+        self.point_mask = 0
+        self.point_card_list = []
+        self.hearts_broken = hearts_broken
 
+    # A play also shows which cards the player cannot be holding under CardEngine.legal.
     def add(self, player, card):
-        if self.empty():
+        engine = self.engine
+        if not self.cards_by_player:
             self.suit = card.suit
+            self.suit_mask = engine.card_suit_masks[card.index]
+            self.winning_index = card.index
+            if card.bit & engine.hearts_mask and not self.hearts_broken and self.index != 1:
+                player.excluded |= engine.full_mask & ~engine.hearts_mask
+        elif card.bit & self.suit_mask:
+            if card.index > self.winning_index:
+                self.winning_index = card.index
+        else:
+            player.excluded |= self.suit_mask
+            if card.bit & engine.point_mask and self.index == 1:
+                player.excluded |= engine.full_mask & ~engine.point_mask
         self.card_index += 1
         self.cards_by_player[(self.card_index, player)] = card
+        self.players_by_index[card.index] = player
+        self.orders_by_index[card.index] = self.card_index
+        self.mask |= card.bit
+        if card.bit & self.rules.scoring_mask:
+            self.points_total += self.rules.card_points[card.index]
+            self.point_mask |= card.bit
+            self.point_card_list = None
+            if card.bit & engine.hearts_mask:
+                self.hearts_broken = True
         return self
 
+    # Legal cards are found with a few mask operations, so checking a move never copies or scans the hand.
+    def legal_mask(self, hand):
+        return self.engine.legal(hand, self.suit_mask, self.index == 1, self.hearts_broken, self.starting_card.bit)
+
     def first(self):
         return self.index == 1
 
@@ -104,29 +422,25 @@ class Trick:
         return len(self.cards_by_player) == 0
 
     def point_cards(self):
-        return sorted([card for card in self.cards_by_player.values() if
-                       card.suit == hearts_suit or (card.rank == "Q" and card.suit == spades_suit)], key=lambda x: (
-            Utils.card_sort_by_suit(x, self.card_suits, reverse=True),
-            Utils.card_sort_by_rank(x, self.card_ranks)), reverse=True)
+        if self.point_card_list is None:
+            self.point_card_list = [self.engine.cards[i] for i in
+                                    self.engine.indices_by_suit_descending_rank(self.point_mask)]
+        return self.point_card_list
 
     def points(self):
-        return sum(1 if x.suit == hearts_suit else 13 for x in self.point_cards())
+        return self.points_total
 
     def suit(self):
         return self.suit
 
     def winning_card(self):
-        return next((c for c in self.cards_by_player.values() if c.suit == self.suit and c.rank == self.card_ranks[
-            max(list(
-                self.card_ranks.index(x.rank) for x in self.cards_by_player.values() if x.suit == self.suit))]),
-                    None)
+        return self.engine.cards[self.winning_index] if self.winning_index >= 0 else None
 
     def winning_player(self):
-        winning_card = self.winning_card()
-        return next((player for (i, player), card in self.cards_by_player.items() if card == winning_card), None)
+        return self.players_by_index.get(self.winning_index)
 
     def card_action_word(self, card):
-        index = next(i for (i, _), c in self.cards_by_player.items() if c == card)
+        index = self.orders_by_index[card.index]
         queen = card.rank == "Q" and card.suit == spades_suit
         leading = index == 1
         if leading and queen:
@@ -143,27 +457,154 @@ class Trick:
             return " followed."
 
     def __str__(self):
-        return f"Trick {self.index}:\n\n{chr(10).join([str(card) + ' ' + player.name + self.card_action_word(card) for (i, player), card in self.cards_by_player.items()])}\nTrick winner: {next((player.name for (i, player), card in self.cards_by_player.items() if card == self.winning_card()), None)}{' (+' + str(self.points()) + ')' if self.points() > 0 else ''} {' '.join(list(map(str, self.point_cards())))}"
+        return f"Trick {self.index}:\n\n{chr(10).join([str(card) + ' ' + player.name + self.card_action_word(card) for (i, player), card in self.cards_by_player.items()])}\nTrick winner: {self.winning_player().name if self.winning_player() else None}{' (+' + str(self.points()) + ')' if self.points() > 0 else ''} {' '.join(list(map(str, self.point_cards())))}"
+
+
+# Decides a player's passes and plays. Strategies are told about each new hand, the passes the player takes part in and
+# every completed trick, so they can track what has been seen.
+class Strategy:
+
+    def new_hand(self, player, players):
+        pass
+
+    def observe_pass(self, player, passer, receiver, cards):
+        pass
+
+    def observe_trick(self, player, trick):
+        pass
+
+    def choose_pass(self, player):
+        raise NotImplementedError
+
+    def choose_card(self, player, trick):
+        raise NotImplementedError
+
+    # Releases what the strategy holds beyond its game, such as worker processes.
+    def close(self):
+        pass
+
+
+class RandomStrategy(Strategy):
+
+    def choose_pass(self, player):
+        return player.rng.sample(player.cards, 3)
+
+    # Play a random legal card.
+    def choose_card(self, player, trick):
+        legal = player.legal_mask(trick)
+        return player.engine.cards[CardEngine.nth(legal, player.rng.randrange(legal.bit_count()))]
+
+
+# Plays random legal cards but passes the three cards the pass evaluator scores best.
+class PassingStrategy(RandomStrategy):
+
+    def choose_pass(self, player):
+        passed = PassEvaluator.of(player.engine).choose(player.mask)
+        return [player.engine.cards[i] for i in CardEngine.indices(passed)]
+
+
+# Passes the three cards that leave the least risk of taking points, scored suit by suit.
+class PassEvaluator:
+    evaluators = {}
+
+    def __init__(self, engine, results=cache.results):
+        self.engine = engine
+        self.results = results
+        self.kinds = [2 if s == hearts_suit else 1 if s == spades_suit else 0 for s in engine.card_suits]
+        self.suit_scores = {}
+
+    @staticmethod
+    def of(engine):
+        evaluator = PassEvaluator.evaluators.get(engine)
+        if evaluator is None:
+            evaluator = PassEvaluator.evaluators.setdefault(engine, PassEvaluator(engine))
+        return evaluator
+
+    # The mask of the three cards to pass from hand.
+    def choose(self, hand):
+        engine = self.engine
+        (canonical,), mapping = engine.canonical((hand,))
+        passed = self.results.get("pass", (engine, canonical), lambda: self.best(canonical))
+        return engine.permute(passed, engine.inverse(mapping))
+
+    # The three cards of hand whose removal leaves the lowest score.
+    def best(self, hand):
+        rank_count, rank_mask = self.engine.rank_count, self.engine.rank_mask
+        kinds = self.kinds
+        suits = range(len(kinds))
+        ranks = [hand >> (s * rank_count) & rank_mask for s in suits]
+        best, best_score = None, math.inf
+        for passed in combinations(CardEngine.indices(hand), 3):
+            kept = list(ranks)
+            for i in passed:
+                kept[i // rank_count] ^= 1 << (i % rank_count)
+            score = sum(self.suit_score(kinds[s], kept[s]) for s in suits)
+            if score < best_score:
+                best, best_score = passed, score
+        return sum(1 << i for i in best)
+
+    def suit_score(self, kind, ranks):
+        score = self.suit_scores.get((kind, ranks))
+        if score is None:
+            score = self.suit_scores[(kind, ranks)] = self.score(kind, ranks)
+        return score
+
+    # Ranks are bits of the suit's rank indices. High means one of the top five ranks (ten to ace in a standard deck)
+    # and low one of the bottom five.
+    def score(self, kind, ranks):
+        rank_count = self.engine.rank_count
+        count = ranks.bit_count()
+        low = (ranks & ((1 << 5) - 1)).bit_count()
+        danger = sum(r - (rank_count - 6) for r in CardEngine.indices(ranks) if r > rank_count - 6)
+        if kind == 2:
+            return danger / (1 + low) if count else -1.0
+        if kind == 1:
+            queen, king, ace = 1 << (rank_count - 3), 1 << (rank_count - 2), 1 << (rank_count - 1)
+            if ranks & queen:
+                return 13 * (0.7 if count <= 3 else 0.35 if count == 4 else 0.15)
+            return sum(4.0 if count <= 3 else 1.5 for high in (king, ace) if ranks & high) - (1.0 if not count else 0)
+        return danger / (1 + low) + (0.5 if count == 1 else 0) if count else -3.0
+
+
+# Marks a seat played by a person. Their moves come from requests to the table rather than from the strategy.
+class HumanStrategy(Strategy):
+    pass
 
 
 class Player:
 
-    def __init__(self, name):
+    def __init__(self, name, strategy=None, rng=random):
         self.name = name
-        self.cards = []
+        self.strategy = strategy or RandomStrategy()
+        self.rng = rng
+        self.engine = None
+        self.mask = 0
+        self.excluded = 0
+        self.beliefs = None
         self.hand_points = {}
 
+    # The cards come from the hand mask, so they are a tuple: changing them fails instead of doing nothing.
+    @property
+    def cards(self):
+        return tuple(self.engine.cards[i] for i in CardEngine.indices(self.mask))
+
     def receive_card(self, card):
-        self.cards.append(card)
+        self.engine = card.engine
+        self.mask |= card.bit
+
+    def remove_card(self, card):
+        if not self.mask & card.bit:
+            raise ValueError(f"{self.name} does not have card {card}")
+        self.mask ^= card.bit
 
     def receive_cards(self, cards):
         [self.receive_card(card) for card in cards]
 
     def has_cards(self):
-        return len(self.cards) > 0
+        return self.mask != 0
 
     def has_card(self, card):
-        return self.has_card_with(card.rank, card.suit)
+        return bool(self.mask & card.bit)
 
     def has_all_cards_of(self, cards):
         return all(self.has_card(card) for card in cards)
@@ -172,24 +613,44 @@ class Player:
         return any(self.has_card(card) for card in cards)
 
     def has_card_with(self, card_rank, card_suit):
-        return any(c.rank == card_rank and c.suit == card_suit for c in self.cards)
+        return self.engine is not None and bool(self.mask & self.engine.bit(card_rank, card_suit))
 
     def has_card_with_suit(self, card_suit):
-        return any(c.suit == card_suit for c in self.cards)
+        return self.engine is not None and bool(self.mask & self.engine.suit_mask(card_suit))
+
+    def suit_count(self, card_suit):
+        return (self.mask & self.engine.suit_mask(card_suit)).bit_count() if self.engine is not None else 0
+
+    def legal_mask(self, trick):
+        return trick.legal_mask(self.mask)
+
+    def legal_cards(self, trick):
+        return [self.engine.cards[i] for i in CardEngine.indices(self.legal_mask(trick))]
+
+    def can_play(self, card, trick):
+        return bool(self.legal_mask(trick) & card.bit)
 
     def get_card_with(self, card_rank, card_suit):
-        return next(c for c in self.cards if c.rank == card_rank and c.suit == card_suit)
+        card = self.engine.cards[self.engine.index(card_rank, card_suit)]
+        if not self.has_card(card):
+            raise ValueError(f"{self.name} does not have card {card}")
+        return card
+
+    def choose_three_cards(self):
+        return self.decide("pass", self.strategy.choose_pass)
 
-    def pass_three_cards_to(self, player):
-        passed_cards = []
-        [passed_cards.append(self.cards.pop(random.randint(0, len(self.cards) - 1))) for _ in range(3)]
+    def choose_card(self, trick):
+        return self.decide("play", self.strategy.choose_card, trick)
+
+    def pass_three_cards_to(self, player, passed_cards=None):
+        passed_cards = self.choose_three_cards() if passed_cards is None else passed_cards
+        [self.remove_card(card) for card in passed_cards]
         player.receive_cards(passed_cards)
         return passed_cards
 
+    # Cards are always held in suit and rank order by the hand mask.
     def sort_cards(self, _card_suits, _card_ranks):
-        self.cards = sorted(self.cards,
-                            key=lambda x: (
-                                Utils.card_sort_by_suit(x, _card_suits), Utils.card_sort_by_rank(x, _card_ranks)))
+        pass
 
     def add_points(self, points, hand):
         self.hand_points[hand] = points
@@ -205,17 +666,17 @@ class Player:
     def should_shoot_the_moon():
         return False
 
-    def play(self, trick):
+    # Plays card, or the card the strategy chooses when none is given. The starting card leads the first trick.
+    def play(self, trick, card=None):
         if trick.first() and trick.empty():
-            index = self.cards.index(trick.starting_card)
-            card = self.cards[index]
-            self.cards.remove(card)
+            card = trick.starting_card
+            self.remove_card(card)
             trick.add(self, card)
             return trick
-        # Play a random card following suit, if possible; otherwise play a random card.
-        card = next((c for c in random.sample(self.cards, len(self.cards)) if c.suit == trick.suit),
-                    self.cards[random.randint(0, len(self.cards) - 1)])
-        self.cards.remove(card)
+        card = self.choose_card(trick) if card is None else card
+        if not self.can_play(card, trick):
+            raise ValueError(f"{self.name} cannot play {card} now")
+        self.remove_card(card)
         trick.add(self, card)
         return trick
 
@@ -231,6 +692,28 @@ class Player:
         # If player does not have non-point suit, paint the trick with highest ranked point card
         # If is not first trick, paint the trick with highest ranked point card
 
+    def decide(self, kind, choose, *args):
+        if not metrics.enabled:
+            return choose(self, *args)
+        started = time.perf_counter()
+        try:
+            return choose(self, *args)
+        finally:
+            metrics.observe("decision", time.perf_counter() - started, kind=kind, strategy=type(self.strategy).__name__)
+
+    def new_hand(self, players, rules=None):
+        self.excluded = 0
+        self.beliefs = beliefs.BeliefState(self, players, rules)
+        self.strategy.new_hand(self, players)
+
+    def observe_pass(self, passer, receiver, cards):
+        self.beliefs.observe_pass(passer, receiver, cards)
+        self.strategy.observe_pass(self, passer, receiver, cards)
+
+    def observe_trick(self, trick):
+        self.beliefs.observe_trick(trick)
+        self.strategy.observe_trick(self, trick)
+
     def __eq__(self, other):
         if isinstance(other, Player):
             return self.name == other.name
@@ -244,6 +727,25 @@ class Player:
 
 
 class Utils:
+    card_html_fragments = {}
+
+    @staticmethod
+    def card_html(card):
+        fragment = Utils.card_html_fragments.get(card)
+        if fragment is None:
+            fragment = Utils.card_html_fragments[card] = (
+                f'<li style="display: inline-block; width: 2.3%;">'
+                f'<ul style="display: inline-block; list-style: none; padding-left: 0;">'
+                f'<li style="display: inline-block;">{card.rank}</li>'
+                f'<li style="display: inline-block; color: {card.suit_color_html};">{card.suit_symbol_html}</li>'
+                f'</ul></li>')
+        return fragment
+
+    @staticmethod
+    def cards_html(cards, row_length=0):
+        return ''.join(Utils.card_html(card) + ('<li></li>' if row_length and i % row_length == 0 else '') for i, card
+                       in enumerate(cards, start=1))
+
     @staticmethod
     def sort_player_cards(players, _card_suits, _card_ranks):
         [p.sort_cards(_card_suits, _card_ranks) for p in players]
@@ -261,19 +763,25 @@ class Utils:
         while (player := next(rotation)) != _first_player: pass
         return player
 
+    # Card indices ascend by suit, then rank, so the point cards come out of the combined mask already in order.
     @staticmethod
     def get_point_cards_for(tricks, _card_suits, _card_ranks):
-        return sorted([card for trick in tricks for card in trick.point_cards()], key=lambda x: (
-            Utils.card_sort_by_suit(x, _card_suits), Utils.card_sort_by_rank(x, _card_ranks)))
+        engine = CardEngine.of(_card_suits, _card_ranks)
+        mask = 0
+        for trick in tricks: mask |= trick.point_mask
+        return [engine.cards[i] for i in CardEngine.indices(mask)]
 
+    # Scoring under the standard rules, for callers that predate Rules; games under other rules score with Game.rules.
     @staticmethod
     def get_points_for(tricks, shot_the_moon):
+        moon_points = Rules.of().moon_points
         points = sum(trick.points() for trick in tricks)
-        return points if not shot_the_moon else points + 26 if points < 26 else 0
+        return points if not shot_the_moon else points + moon_points if points < moon_points else 0
 
     @staticmethod
     def shot_the_moon(tricks_by_player):
-        return any(sum(trick.points() for trick in tricks) == 26 for player, tricks in tricks_by_player.items())
+        return any(sum(trick.points() for trick in tricks) == Rules.of().moon_points for tricks in
+                   tricks_by_player.values())
 
     @staticmethod
     def get_hand_winner(players, hand, shot_the_moon):
@@ -290,62 +798,257 @@ class Utils:
 
     @staticmethod
     def get_three_card_pass_type_description(hand):
-        pass_type = hand % 4
-        if pass_type == 1:
-            return "Left / Clockwise"
-        elif pass_type == 2:
-            return "Right / Counter-Clockwise"
-        elif pass_type == 3:
-            return "Across"
-        else:
-            return "None / Keep"
+        return Rules.of().pass_description(hand)
 
     @staticmethod
     def ordinal(n):
-        if n not in range(1, 5):
+        if n not in range(1, len(ordinals) + 1):
             raise ValueError(f"Ordinal is out of range: {n}")
         return ordinals[n - 1]
 
 
+# What happened in one hand, by seat: the cards dealt, the cards each seat passed and every card in play order.
+class HandRecord:
+    __slots__ = ("hand", "dealt", "passed", "plays")
+
+    def __init__(self, hand, dealt, passed, plays):
+        self.hand = hand
+        self.dealt = tuple(dealt)
+        self.passed = tuple(passed)
+        self.plays = tuple(plays)
+
+    def __eq__(self, other):
+        if isinstance(other, HandRecord):
+            return (self.hand, self.dealt, self.passed, self.plays) == (
+                other.hand, other.dealt, other.passed, other.plays)
+        return NotImplemented
+
+
+# A point in a game where a player has to choose: three cards to pass, or a card to play to trick.
+class Decision:
+    __slots__ = ("kind", "player", "trick")
+
+    def __init__(self, kind, player, trick=None):
+        self.kind = kind
+        self.player = player
+        self.trick = trick
+
+    # The cards the player may choose from.
+    def legal_mask(self):
+        return self.player.mask if self.kind == "pass" else self.player.legal_mask(self.trick)
+
+    # Returns move if the player may make it, raising ValueError otherwise. A pass is a list of three cards.
+    def check(self, move):
+        player = self.player
+        if self.kind == "pass":
+            if len(set(move)) != 3 or not player.has_all_cards_of(move):
+                raise ValueError(f"{player.name} must pass three of their own cards")
+            return move
+        if not player.has_card(move):
+            raise ValueError(f"{player.name} does not have card {move.rank}")
+        if not player.can_play(move, self.trick):
+            raise ValueError(f"{player.name} must follow suit" if player.mask & self.trick.suit_mask else
+                             "Hearts cannot be led until they are broken" if self.trick.empty() else
+                             "Points cannot be played on the first trick")
+        return move
+
+    # The move the player's own strategy makes.
+    def choose(self):
+        player = self.player
+        if self.trick is None:
+            return player.decide("pass", player.strategy.choose_pass)
+        return player.decide("play", player.strategy.choose_card, self.trick)
+
+
+# Receives what happens in a game as it is played. Events carry the game objects themselves and formatting is left to
+# each sink, so the base sink, which ignores every event, serves as the null sink and costs a headless game nothing.
+class Sink:
+
+    def game_started(self, game):
+        pass
+
+    def hand_dealt(self, game):
+        pass
+
+    def hand_passed(self, game, passes):
+        pass
+
+    def tricks_started(self, game, first_player):
+        pass
+
+    def card_played(self, game, trick, player, card):
+        pass
+
+    def trick_played(self, game, trick):
+        pass
+
+    def hand_scored(self, game, shot_the_moon):
+        pass
+
+    def game_over(self, game, winner):
+        pass
+
+
+# Renders the game as text for a terminal. Lines are collected for the whole hand and written in one call when the hand
+# is scored.
+class ConsoleSink(Sink):
+
+    def __init__(self, stream=None):
+        self.stream = stream or sys.stdout
+        self.lines = []
+
+    def write(self, line=""):
+        self.lines.append(line)
+
+    def flush(self):
+        self.lines.append("")
+        self.stream.write("\n".join(self.lines))
+        self.stream.flush()
+        self.lines = []
+
+    def game_started(self, game):
+        self.write("\nWelcome to Hearts!")
+
+    def hand_dealt(self, game):
+        self.write(f"\nHand {game.hand}")
+        self.write("\nInitial deal:\n")
+        [self.write(f"{p}") for p in game.players]
+
+    def hand_passed(self, game, passes):
+        self.write(f"\n3 Card Pass ({game.rules.pass_description(game.hand)}):\n")
+        [self.write(f"{p1.name} => {p2.name}: {' '.join(map(str, cards))}") for (p1, p2), cards in passes.items()]
+        if len(passes) > 0: self.write()
+
+    def tricks_started(self, game, first_player):
+        self.write(f"{first_player.name} has the {game.starting_card}.\n\nOrder of play (Clockwise):\n")
+        first = game.players.index(first_player)
+        [self.write(f"{Utils.ordinal(i)} - {player.name}") for i, player in
+         enumerate(game.players[first:] + game.players[:first], start=1)]
+
+    def trick_played(self, game, trick):
+        self.write(f"\n{trick}")
+
+    def hand_scored(self, game, shot_the_moon):
+        self.write(f"\nHand {game.hand} Score:")
+        self.write(f"\n{game.moon_shots[-1][1].name} shot the moon!!!\n" if shot_the_moon else "")
+        for i, player in enumerate(Utils.get_players_sorted_by_total_points(game.players), start=1):
+            point_cards = Utils.get_point_cards_for(game.tricks_by_player.get(player, ''), game.card_suits,
+                                                    game.card_ranks)
+            self.write(f"{Utils.ordinal(i)} - {player.name}: {player.total_points()} ({player.points(game.hand):+}) "
+                       f"{' '.join(map(str, point_cards))}")
+        self.flush()
+
+    def game_over(self, game, winner):
+        self.write(f"\n{winner.name} won the game!")
+        self.flush()
+
+
+# Logs every event as one JSON object per line, with cards as CardEngine indices and players by name.
+class JsonLinesSink(Sink):
+
+    def __init__(self, file):
+        self.file = file
+
+    def write(self, event, game, **fields):
+        self.file.write(json.dumps({'event': event, 'hand': game.hand, **fields}) + "\n")
+
+    def game_started(self, game):
+        self.write('game_started', game, seed=game.seed, players=[p.name for p in game.players])
+
+    def hand_dealt(self, game):
+        self.write('hand_dealt', game, hands={p.name: list(CardEngine.indices(p.mask)) for p in game.players})
+
+    def hand_passed(self, game, passes):
+        self.write('hand_passed', game, passes=[{'from': p1.name, 'to': p2.name, 'cards': [c.index for c in cards]}
+                                               for (p1, p2), cards in passes.items()])
+
+    def tricks_started(self, game, first_player):
+        self.write('tricks_started', game, leader=first_player.name)
+
+    def trick_played(self, game, trick):
+        self.write('trick_played', game, trick=trick.index,
+                   cards=[[player.name, card.index] for (_, player), card in trick.cards_by_player.items()],
+                   winner=trick.winning_player().name, points=trick.points())
+
+    def hand_scored(self, game, shot_the_moon):
+        self.write('hand_scored', game, shot_the_moon=shot_the_moon,
+                   points={p.name: p.points(game.hand) for p in game.players},
+                   totals={p.name: p.total_points() for p in game.players})
+
+    def game_over(self, game, winner):
+        self.write('game_over', game, winner=winner.name)
+        self.file.flush()
+
+
+# A game draws every random choice from its own rng, so the same seed plays out the same way. Game.of starts a game by
+# any rules.
 class Game:
 
-    def __init__(self, _starting_card_rank, _starting_card_suit, _card_suits, _card_ranks):
+    def __init__(self, _starting_card_rank, _starting_card_suit, _card_suits, _card_ranks, seed=None, rules=None):
+        self.seed = seed
+        self.rng = random.Random(seed)
         self.starting_card = Card(_starting_card_rank, _starting_card_suit, _card_suits, _card_ranks)
+        self.rules = rules or Rules.of(_card_suits, _card_ranks)
+        if rules is not None and rules.starting_card is not self.starting_card:
+            raise ValueError(f"These rules start with {rules.starting_card}, not {self.starting_card}")
         self.players = []
         self.card_suits = _card_suits
         self.card_ranks = _card_ranks
-        self.deck = Deck(_card_suits, _card_ranks)
+        self.deck = Deck(_card_suits, _card_ranks, self.rules.deck_mask)
         self.hand = 0
         self.card_passes = {}
+        self.tricks_by_player = {}
+        self.moon_shots = []
+        self.dealt = ()
+        self.history = []
         self.player_rotation = cycle(self.players)
+        self.phase = "new"
+        self.pass_choices = {}
+        self.trick = None
+        self.leader = None
 
-    def add_players(self, _player_names):
-        [self.players.append(Player(p)) for p in _player_names]
+    @staticmethod
+    def of(rules, seed=None):
+        return Game(rules.starting_card.rank, rules.starting_card.suit, rules.card_suits, rules.card_ranks, seed, rules)
+
+    def add_players(self, _player_names, _strategies=()):
+        [self.players.append(Player(p, _strategies[i] if i < len(_strategies) else None, self.rng)) for i, p in
+         enumerate(_player_names)]
+
+    # Independent generators derived from this game's, for work that should not disturb the game's own sequence.
+    def spawn(self, count):
+        return [random.Random(self.rng.getrandbits(64)) for _ in range(count)]
 
     def shuffle_players(self):
-        random.shuffle(self.players)
+        self.rng.shuffle(self.players)
 
     def player_count(self):
         return len(self.players)
 
     def shuffle_deck(self):
-        self.deck.shuffle()
+        self.deck.shuffle(self.rng)
 
     def deal_cards(self):
         [self.players[i % len(self.players)].receive_card(self.deck.take()) for i in range(self.deck.count())]
 
+    # (passer, receiver) for every pass of the hand in the order passers choose, as the rules' pass schedule has it.
+    def pass_pairs(self, hand):
+        players = self.players
+        return [(players[s1], players[s2]) for s1, s2 in self.rules.passes(hand)]
+
+    # Every player chooses from the hand they were dealt before any cards change hands, so passed cards are never
+    # passed on.
     def pass_three_cards(self, hand):
-        passes = {}
-        pass_type = hand % 4
-        if pass_type == 0: return passes
-        player_rotation = cycle(reversed(self.players) if pass_type == 2 else self.players)
-        p1 = self.players[0]
-        for i in range(self.player_count()):
-            while next(player_rotation) != p1: pass
-            p2 = next(player_rotation)
-            p3 = next(player_rotation) if pass_type == 3 else p2
-            passes[(p1, p3)] = p1.pass_three_cards_to(p3)
-            p1 = p2
+        return self.exchange_passes({(p1, p2): p1.choose_three_cards() for p1, p2 in self.pass_pairs(hand)})
+
+    # The pass and trick phase timers cover the engine's work once every move is in, never the time spent waiting on
+    # players between decisions.
+    @metrics.timed("phase", phase="pass")
+    def exchange_choices(self, pairs):
+        return self.observe_passes(self.exchange_passes({(p1, p2): self.pass_choices[p1] for p1, p2 in pairs}))
+
+    def exchange_passes(self, passes):
+        [p1.pass_three_cards_to(p2, cards) for (p1, p2), cards in passes.items()]
         return passes
 
     def get_first_player(self):
@@ -357,68 +1060,214 @@ class Game:
     def get_next_player(self):
         return next(self.player_rotation)
 
-    def start(self):
-        self.hand = 1
-        self.add_players(player_names)
+    def is_over(self):
+        return self.hand > Rules.max_hands or any(p.total_points() >= self.rules.end_score for p in self.players)
+
+    @metrics.timed("phase", phase="deal")
+    def deal_hand(self):
+        self.shuffle_deck()
+        self.deal_cards()
+        Utils.sort_player_cards(self.players, self.card_suits, self.card_ranks)
+        self.dealt = tuple(p.mask for p in self.players)
+        [p.new_hand(self.players, self.rules) for p in self.players]
+
+    # Plays the passes of the hand dealt, every pass chosen by the player's strategy.
+    def pass_hand(self, sink=None):
+        self.pass_choices = {}
+        return Game.drive(self.pass_steps(sink or Sink()))
+
+    def observe_passes(self, passes):
+        self.card_passes = passes
+        Utils.sort_player_cards(self.players, self.card_suits, self.card_ranks)
+        for (p1, p2), cards in self.card_passes.items():
+            p1.observe_pass(p1, p2, cards)
+            p2.observe_pass(p1, p2, cards)
+        return self.card_passes
+
+    # Plays the tricks of the hand after the passes, every card chosen by the player's strategy, and yields each trick
+    # as it is finished. The hand is left for score_hand.
+    def play_tricks(self, sink=None):
+        sink = sink or Sink()
+        while self.trick is not None:
+            yield Game.drive(self.trick_steps(sink))
+
+    @metrics.timed("phase", phase="trick")
+    def finish_trick(self, trick):
+        [p.observe_trick(trick) for p in self.players]
+        winner = trick.winning_player()
+        self.tricks_by_player[winner] = self.tricks_by_player.get(winner, []) + [trick]
+        return trick
+
+    # Scores the hand by the rules and returns whether someone shot the moon.
+    @metrics.timed("phase", phase="score")
+    def score_hand(self):
+        rules = self.rules
+        taken = [self.tricks_by_player.get(p, ()) for p in self.players]
+        points = [sum(t.points() for t in tricks) for tricks in taken]
+        shooter = rules.shooter([rules.points(sum(t.point_mask for t in tricks) & rules.moon_mask) for tricks in
+                                 taken] if rules.bonus_mask else points)
+        [p.add_points(hand_points, self.hand) for p, hand_points in
+         zip(self.players, rules.score(points, shooter, [p.total_points() for p in self.players]))]
+        metrics.count("hands")
+        if shooter is not None:
+            metrics.count("moon_shots")
+            self.moon_shots.append((self.hand, self.players[shooter]))
+        self.history.append(self.hand_record())
+        return shooter is not None
+
+    def hand_record(self):
+        passed = [0] * self.player_count()
+        for (p1, _), cards in self.card_passes.items():
+            passed[self.players.index(p1)] = sum(card.bit for card in cards)
+        tricks = sorted((t for tricks in self.tricks_by_player.values() for t in tricks), key=lambda t: t.index)
+        return HandRecord(self.hand, self.dealt, passed, [c.index for t in tricks for c in t.cards_by_player.values()])
+
+    def end_hand(self):
+        self.hand += 1
+        self.deck = Deck(self.card_suits, self.card_ranks, self.rules.deck_mask)
+
+    def play(self, _player_names, _strategies=(), sink=None):
+        self.add_players(_player_names, _strategies)
         self.shuffle_players()
-        print("\nWelcome to Hearts!")
-        while not any(p.total_points() >= max_points for p in self.players):
-            print(f"\nHand {self.hand}")
-            self.shuffle_deck()
-            print("\nInitial deal:\n")
-            self.deal_cards()
-            Utils.sort_player_cards(self.players, self.card_suits, self.card_ranks)
-            [print(f"{p}") for p in self.players]
-            print(f"\n3 Card Pass ({Utils.get_three_card_pass_type_description(self.hand)}):\n")
-            self.card_passes = self.pass_three_cards(self.hand)
-            Utils.sort_player_cards(self.players, self.card_suits, self.card_ranks)
-            [print(f"{p1.name} => {p2.name}: {' '.join(map(str, cards))}") for (p1, p2), cards in
-             self.card_passes.items()]
-            if len(self.card_passes) > 0: print()
-            self.set_player_rotation()
-            first_player = Utils.cycle_players_to(self.get_first_player(), self.player_rotation)
-            print(f"{first_player.name} has the {self.starting_card}.\n\nOrder of play (Clockwise):\n")
-            i = 1
-            print(f"{Utils.ordinal(i)} - {first_player.name}")
-            while (player := next(self.player_rotation)) != first_player:
-                i += 1
-                print(f"{Utils.ordinal(i)} - {player.name}")
-            trick_index = 1
-            tricks_by_player = {}
-            while (Utils.cycle_players_to(first_player, self.player_rotation)).has_cards():
-                trick = first_player.play(Trick(trick_index, self.starting_card, self.card_suits, self.card_ranks))
-                while (player := next(self.player_rotation)) != first_player: trick = player.play(trick)
-                print(f"\n{trick}")
-                first_player = trick.winning_player()
-                tricks_by_player[first_player] = tricks_by_player.get(first_player, []) + [trick]
-                trick_index += 1
-            shot_the_moon = Utils.shot_the_moon(tricks_by_player)
-            [p.add_points(Utils.get_points_for(tricks_by_player.get(p, ''), shot_the_moon), self.hand) for p in
-             self.players]
-            print(f"\nHand {self.hand} Score:")
-            hand_winner = Utils.get_hand_winner(self.players, self.hand, shot_the_moon)
-            print(f"\n{hand_winner.name} shot the moon!!!\n" if shot_the_moon else "")
-            [print(
-                f"{Utils.ordinal(i)} - {player.name}: {player.total_points()} (+{player.points(self.hand)}) {' '.join(list(map(str, Utils.get_point_cards_for(tricks_by_player.get(player, ''), card_suits, card_ranks))))}")
-                for
-                i, player in enumerate(Utils.get_players_sorted_by_total_points(self.players), start=1)]
-            self.hand += 1
-            self.deck = Deck(self.card_suits, self.card_ranks)
-        print(f"\n{Utils.get_game_winner(self.players).name} won the game!")
-
-
-app = Flask(__name__, template_folder="../templates")
-
-
-@app.route('/')
-def home_page():
-    game = Game(starting_card_rank, starting_card_suit, card_suits, card_ranks)
-    game.hand = 1
-    return render_template('index.html', game=game, player_names=player_names, utils=Utils)
+        return self.play_seated(sink)
+
+    # Plays a whole game with the players already seated in play order, every move made by the player's strategy.
+    def play_seated(self, sink=None):
+        return Game.drive(self.steps(sink))
+
+    # Runs a generator of decisions to its end with every move made by the player's strategy and returns its value.
+    @staticmethod
+    def drive(steps):
+        try:
+            decision = next(steps)
+            while True:
+                decision = steps.send(decision.choose())
+        except StopIteration as stop:
+            return stop.value
+
+    # The game as a generator of the decisions players face; the move for each Decision yielded is sent back. Returns
+    # the winner.
+    def steps(self, sink=None):
+        sink = sink or Sink()
+        if self.phase == "new":
+            if self.player_count() != self.rules.player_count:
+                raise ValueError(f"These rules are for {self.rules.player_count} players, not {self.player_count()}")
+            self.hand = 1
+            self.phase = "deal"
+            sink.game_started(self)
+        while self.phase != "over":
+            if self.phase == "deal":
+                if self.is_over():
+                    self.phase = "over"
+                    metrics.count("games")
+                    sink.game_over(self, Utils.get_game_winner(self.players))
+                    break
+                self.deal_hand()
+                sink.hand_dealt(self)
+                self.pass_choices = {}
+                self.phase = "pass"
+            if self.phase == "pass":
+                yield from self.pass_steps(sink)
+            while self.phase == "play":
+                yield from self.trick_steps(sink)
+                if self.trick is None:
+                    sink.hand_scored(self, self.score_hand())
+                    self.end_hand()
+                    self.phase = "deal"
+        return Utils.get_game_winner(self.players)
+
+    # The passes still to be chosen this hand, as decisions, then the exchange. Leaves the game at its first trick and
+    # returns the passes.
+    def pass_steps(self, sink):
+        pairs = self.pass_pairs(self.hand)
+        for decision in [Decision("pass", p1) for p1, _ in pairs if p1 not in self.pass_choices]:
+            self.pass_choices[decision.player] = decision.check((yield decision))
+        passes = self.exchange_choices(pairs)
+        sink.hand_passed(self, passes)
+        self.tricks_by_player = {}
+        self.leader = self.get_first_player()
+        self.trick = Trick(1, self.starting_card, self.card_suits, self.card_ranks, rules=self.rules)
+        self.phase = "play"
+        sink.tricks_started(self, self.leader)
+        return passes
+
+    # The cards still to be played to the trick in progress, as decisions. Leaves the game at the next trick, or with no
+    # trick once the hand's cards are all played, and returns the finished trick.
+    def trick_steps(self, sink):
+        trick = self.trick
+        count = self.player_count()
+        first = self.players.index(self.leader)
+        for seat in range(first + len(trick.cards_by_player), first + count):
+            player = self.players[seat % count]
+            card = trick.starting_card if trick.first() and trick.empty() else (yield Decision("play", player, trick))
+            player.play(trick, card)
+            sink.card_played(self, trick, player, card)
+        self.finish_trick(trick)
+        sink.trick_played(self, trick)
+        self.leader = trick.winning_player()
+        if self.leader.has_cards():
+            self.trick = Trick(trick.index + 1, self.starting_card, self.card_suits, self.card_ranks,
+                               trick.hearts_broken, self.rules)
+        else:
+            self.trick = self.leader = None
+        return trick
+
+    # Where the game stands, as tuples of ints and of objects that are never changed. Strategies are not included.
+    def snapshot(self):
+        seats = {p: s for s, p in enumerate(self.players)}
+        trick = (self.trick.index, self.trick.hearts_broken,
+                 tuple((seats[p], c.index) for (_, p), c in self.trick.cards_by_player.items())) if self.trick else None
+        return (self.phase, self.hand, self.rng.getstate(),
+                tuple(p.rng.getstate() if p.rng is not self.rng else None for p in self.players),
+                tuple(card.index for card in self.deck.cards), self.dealt,
+                tuple(((seats[p1], seats[p2]), tuple(cards)) for (p1, p2), cards in self.card_passes.items()),
+                tuple((seats[p], tuple(cards)) for p, cards in self.pass_choices.items()),
+                tuple((p.mask, p.excluded, tuple(p.hand_points.items()), p.beliefs and (
+                    p.beliefs.played, tuple(p.beliefs.passed), tuple(p.beliefs.points), tuple(p.beliefs.bonuses),
+                    p.beliefs.tricks)) for p in self.players),
+                trick, seats.get(self.leader), tuple((seats[p], tuple(ts)) for p, ts in self.tricks_by_player.items()),
+                tuple((hand, seats[p]) for hand, p in self.moon_shots), tuple(self.history))
+
+    # Puts the game back where it stood when snapshot was taken. A generator from steps() that was running at the time
+    # must not be resumed; start a new one.
+    def restore(self, snapshot):
+        (self.phase, self.hand, rng_state, player_rng_states, deck, self.dealt, card_passes, pass_choices, players,
+         trick, leader, tricks_by_player, moon_shots, history) = snapshot
+        engine = CardEngine.of(self.card_suits, self.card_ranks)
+        self.rng.setstate(rng_state)
+        [p.rng.setstate(state) for p, state in zip(self.players, player_rng_states) if state is not None]
+        self.deck.cards = [engine.cards[i] for i in deck]
+        self.deck.mask = sum(card.bit for card in self.deck.cards)
+        self.card_passes = {(self.players[s1], self.players[s2]): list(cards) for (s1, s2), cards in card_passes}
+        self.pass_choices = {self.players[s]: list(cards) for s, cards in pass_choices}
+        self.trick = None
+        if trick is not None:
+            index, hearts_broken, cards = trick
+            self.trick = Trick(index, self.starting_card, self.card_suits, self.card_ranks, hearts_broken, self.rules)
+            [self.trick.add(self.players[s], engine.cards[i]) for s, i in cards]
+        self.leader = self.players[leader] if leader is not None else None
+        self.tricks_by_player = {self.players[s]: list(tricks) for s, tricks in tricks_by_player}
+        self.moon_shots = [(hand, self.players[s]) for hand, s in moon_shots]
+        self.history = list(history)
+        for p, (mask, excluded, hand_points, observed) in zip(self.players, players):
+            p.mask, p.excluded, p.hand_points = mask, excluded, dict(hand_points)
+            if observed is None:
+                p.beliefs = None
+                continue
+            belief = p.beliefs = p.beliefs or beliefs.BeliefState(p, self.players, self.rules)
+            played, passed, points, bonuses, belief.tricks = observed
+            belief.played, belief.passed, belief.points, belief.bonuses = played, list(passed), list(points), list(
+                bonuses)
+            belief.last_sampler = (None, None)
+        self.set_player_rotation()
+
+    def start(self, sink=None):
+        return self.play(self.rules.player_names, sink=sink or ConsoleSink())
 
 
 if __name__ == "__main__":
     # Run Flask app
-    app.run(debug=True)
+    import server
+    server.app.run(debug=True)
     # Run console app
     # Game(starting_card_rank, starting_card_suit, card_suits, card_ranks).start()
@@ -0,0 +1,126 @@
+import cProfile
+import io
+import os
+import pstats
+import threading
+import time
+from functools import wraps
+
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in labels)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(labels, escaped)) + "}"
+
+
+# Timers and counters for the game loop and the server, rendered in the Prometheus text format. Nothing is recorded
+# until enable() is called, and every hook checks that flag first, so a run without metrics pays one attribute read per
+# hook. Gauges are read from their callables when the metrics are rendered.
+class Metrics:
+
+    def __init__(self, prefix="hearts"):
+        self.prefix = prefix
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.timers = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def enable(self):
+        self.enabled = True
+
+    def disable(self):
+        self.enabled = False
+
+    def reset(self):
+        with self.lock:
+            self.timers.clear()
+            self.counters.clear()
+
+    def count(self, name, amount=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    # Each timer keeps its count, total and longest time.
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            timer = self.timers.get(key)
+            if timer is None:
+                timer = self.timers[key] = [0, 0.0, 0.0]
+            timer[0] += 1
+            timer[1] += seconds
+            timer[2] = max(timer[2], seconds)
+
+    def timed(self, name, **labels):
+        def decorate(function):
+            @wraps(function)
+            def timed_function(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - started, **labels)
+
+            return timed_function
+
+        return decorate
+
+    def gauge(self, name, read):
+        self.gauges[name] = read
+
+    def render(self):
+        with self.lock:
+            timers = sorted(self.timers.items())
+            counters = sorted(self.counters.items())
+        lines = []
+        typed = set()
+
+        def declare(metric, metric_type):
+            if metric not in typed:
+                typed.add(metric)
+                lines.append(f"# TYPE {metric} {metric_type}")
+
+        for (name, labels), (count, total, longest) in timers:
+            metric = f"{self.prefix}_{name}_seconds"
+            declare(metric, "summary")
+            lines.append(f"{metric}_count{format_labels(labels)} {count}")
+            lines.append(f"{metric}_sum{format_labels(labels)} {total:.9f}")
+        for (name, labels), (_, _, longest) in timers:
+            metric = f"{self.prefix}_{name}_seconds_max"
+            declare(metric, "gauge")
+            lines.append(f"{metric}{format_labels(labels)} {longest:.9f}")
+        for (name, labels), value in counters:
+            metric = f"{self.prefix}_{name}_total"
+            declare(metric, "counter")
+            lines.append(f"{metric}{format_labels(labels)} {value}")
+        for name, read in sorted(self.gauges.items()):
+            metric = f"{self.prefix}_{name}"
+            declare(metric, "gauge")
+            lines.append(f"{metric} {read()}")
+        return "\n".join(lines) + "\n"
+
+
+metrics = Metrics()
+if os.environ.get("HEARTS_METRICS") == "1":
+    metrics.enable()
+
+
+# Runs function under cProfile. The raw stats are saved to path for pstats or snakeviz when a path is given, and the
+# functions with the most cumulative time are returned as text alongside the result.
+def profile(function, *args, path=None, sort="cumulative", limit=30):
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args)
+    if path is not None:
+        profiler.dump_stats(path)
+    report = io.StringIO()
+    pstats.Stats(profiler, stream=report).sort_stats(sort).print_stats(limit)
+    return result, report.getvalue()
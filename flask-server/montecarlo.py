@@ -0,0 +1,139 @@
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+import hearts
+
+def require_numpy():
+    if np is None:
+        raise ImportError("Monte Carlo mode requires numpy")
+
+
+# Shuffled card index orders for count deals in one call; row i is the order cards are taken from the deck in deal i.
+def shuffle_batch(count, card_count, rng):
+    return rng.permuted(np.broadcast_to(np.arange(card_count, dtype=np.int16), (count, card_count)), axis=1)
+
+
+# Independent PCG64 generators derived from one seed, one per worker, so a split run replays from that seed.
+def spawn_generators(seed, count):
+    require_numpy()
+    return [np.random.Generator(np.random.PCG64(s)) for s in np.random.SeedSequence(seed).spawn(count)]
+
+
+# Deals, passes and plays batches of hands under rules: only the cards of rules.deck_mask are dealt, passes follow
+# rules.pass_schedule and cards score rules.card_points.
+class HandBatch:
+
+    def __init__(self, n_hands, hand=1, seed=None, rules=None):
+        require_numpy()
+        self.rules = rules or hearts.Rules.of()
+        self.engine = self.rules.engine
+        self.n_hands = n_hands
+        self.hand = hand
+        self.player_count = self.rules.player_count
+        self.rng = np.random.default_rng(seed)
+        self.rows = np.arange(n_hands)
+        self.deck = np.array(list(hearts.CardEngine.indices(self.rules.deck_mask)))
+        self.suits = np.arange(self.engine.card_count) // self.engine.rank_count
+        self.point_values = np.array(self.rules.card_points)
+        self.moon_values = np.maximum(self.point_values, 0)
+        self.point_cards = np.array([bool(self.engine.point_mask >> i & 1) for i in range(self.engine.card_count)])
+        self.hearts = np.array([bool(self.engine.hearts_mask >> i & 1) for i in range(self.engine.card_count)])
+        self.starting_index = self.rules.starting_card.index
+        self.permutations = self.deal()
+        self.dealt_hands = self.hands_of(self.permutations)
+        self.hands = self.pass_three_cards(self.dealt_hands)
+        self.first_players = self.holders(self.starting_index)
+        self.points = None
+
+    # The j-th card taken from the deck goes to player j % player_count.
+    def deal(self):
+        return self.deck[shuffle_batch(self.n_hands, len(self.deck), self.rng)]
+
+    def hands_of(self, permutations):
+        hands = np.zeros((self.n_hands, self.player_count, self.engine.card_count), dtype=bool)
+        hands[self.rows[:, None], np.arange(len(self.deck)) % self.player_count, permutations] = True
+        return hands
+
+    # A positive offset passes to the seat that many places after the passer, as in Rules.pass_seats.
+    def pass_three_cards(self, hands):
+        offset = self.rules.pass_schedule[(self.hand - 1) % len(self.rules.pass_schedule)]
+        if offset == 0:
+            return hands.copy()
+        keys = np.where(hands, self.rng.random(hands.shape), -1.0)
+        chosen = np.argpartition(-keys, 2, axis=2)[:, :, :3]
+        passed = np.zeros_like(hands)
+        np.put_along_axis(passed, chosen, True, axis=2)
+        return (hands & ~passed) | np.roll(passed, offset, axis=1)
+
+    def holders(self, card_index):
+        return self.hands[:, :, card_index].argmax(axis=1)
+
+    def random_card(self, legal):
+        return np.where(legal, self.rng.random(legal.shape), -1.0).argmax(axis=1)
+
+    # Plays every hand out with the random policy of RandomStrategy under CardEngine.legal: the starting card leads the
+    # first trick, hearts are not led until broken, followers follow suit when they can and nobody discards points on
+    # the first trick unless they hold nothing else.
+    def play(self):
+        hands = self.hands.copy()
+        points = np.zeros((self.n_hands, self.player_count), dtype=np.int32)
+        penalties = np.zeros_like(points)
+        leaders = self.first_players.copy()
+        hearts_broken = np.zeros(self.n_hands, dtype=bool)
+        for trick in range(self.rules.hand_size):
+            trick_points = np.zeros(self.n_hands, dtype=np.int32)
+            trick_penalties = np.zeros_like(trick_points)
+            for k in range(self.player_count):
+                seats = (leaders + k) % self.player_count
+                held = hands[self.rows, seats]
+                if trick == 0 and k == 0:
+                    cards = np.full(self.n_hands, self.starting_index)
+                elif k == 0:
+                    cards = self.random_card(self.unless_empty(held & ~(self.hearts & ~hearts_broken[:, None]), held))
+                else:
+                    following = held & (self.suits == lead_suits[:, None])
+                    discards = self.unless_empty(held & ~self.point_cards, held) if trick == 0 else held
+                    cards = self.random_card(self.unless_empty(following, discards))
+                hands[self.rows, seats, cards] = False
+                hearts_broken |= self.hearts[cards]
+                trick_points += self.point_values[cards]
+                trick_penalties += self.moon_values[cards]
+                if k == 0:
+                    lead_suits = self.suits[cards]
+                    best_cards = cards
+                    winners = seats
+                else:
+                    better = (self.suits[cards] == lead_suits) & (cards > best_cards)
+                    best_cards = np.where(better, cards, best_cards)
+                    winners = np.where(better, seats, winners)
+            points[self.rows, winners] += trick_points
+            penalties[self.rows, winners] += trick_penalties
+            leaders = winners
+        self.points = self.score(points, penalties)
+        return self.points
+
+    # Rules.score for every hand at once, with "choose" adding as it does without game totals.
+    def score(self, points, penalties):
+        moon = self.rules.moon_points
+        if self.rules.moon == "none" or not moon:
+            return points
+        shooters = penalties == moon
+        shot = shooters.any(axis=1)[:, None]
+        if self.rules.moon == "subtract":
+            return np.where(shooters, points - 2 * moon, points)
+        return np.where(shot, np.where(shooters, points - moon, points + moon), points)
+
+    @staticmethod
+    def unless_empty(cards, fallback):
+        return np.where(cards.any(axis=1)[:, None], cards, fallback)
+
+    def holder_points(self, card_index):
+        if self.points is None:
+            self.play()
+        return self.points[self.rows, self.holders(card_index)]
+
+    def queen_of_spades_holder_rate(self, threshold=13):
+        queen = hearts.CardEngine.highest(self.engine.queen_of_spades_mask)
+        return float((self.holder_points(queen) >= threshold).mean())
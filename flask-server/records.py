@@ -0,0 +1,156 @@
+import mmap
+import os
+import struct
+
+import hearts
+
+# File layout: the magic header, then one record per game, each prefixed with its length as a little-endian u32.
+# A game record holds the seed and player names as length-prefixed UTF-8, the hand count as a u16, then for every hand
+# each seat's dealt cards (13 bytes per seat, ascending), each seat's passed cards (3 bytes per seat, passing hands
+# only) and every card in play order. Cards are stored as one byte holding their CardEngine index. Records hold games
+# of the standard rules only, whose deal, pass schedule and scoring they assume.
+magic = b"HRTS\x01"
+length_format = struct.Struct("<I")
+hand_count_format = struct.Struct("<H")
+
+
+def engine():
+    return hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+
+
+def pass_offset(hand):
+    schedule = hearts.Rules.of().pass_schedule
+    return schedule[(hand - 1) % len(schedule)]
+
+
+def encode_text(text):
+    data = str(text).encode()
+    if len(data) > 255:
+        raise ValueError(f"Text is too long to record: {text}")
+    return bytes([len(data)]) + data
+
+
+def encode_game(game, seed=""):
+    if game.rules is not hearts.Rules.of():
+        raise ValueError(f"Only games of the standard rules can be recorded: {game.rules.encode()}")
+    body = bytearray(encode_text(seed))
+    body.append(game.player_count())
+    [body.extend(encode_text(p.name)) for p in game.players]
+    body.extend(hand_count_format.pack(len(game.history)))
+    for record in game.history:
+        [body.extend(hearts.CardEngine.indices(mask)) for mask in record.dealt]
+        if pass_offset(record.hand):
+            [body.extend(hearts.CardEngine.indices(mask)) for mask in record.passed]
+        body.extend(record.plays)
+    return length_format.pack(len(body)) + bytes(body)
+
+
+class GameRecord:
+
+    def __init__(self, seed, names, hands):
+        self.seed = seed
+        self.names = names
+        self.hands = hands
+
+    @staticmethod
+    def decode(buffer):
+        position = 0
+
+        def take(count):
+            nonlocal position
+            data = buffer[position:position + count]
+            position += count
+            return data
+
+        def text():
+            return bytes(take(take(1)[0])).decode()
+
+        seed = text()
+        names = [text() for _ in range(take(1)[0])]
+        seats = len(names)
+        per_seat = engine().card_count // seats
+        hands = []
+        for hand in range(1, hand_count_format.unpack(take(hand_count_format.size))[0] + 1):
+            dealt = [sum(1 << i for i in take(per_seat)) for _ in range(seats)]
+            passed = [sum(1 << i for i in take(3)) for _ in range(seats)] if pass_offset(hand) else [0] * seats
+            hands.append(hearts.HandRecord(hand, dealt, passed, bytes(take(per_seat * seats))))
+        return GameRecord(seed, names, hands)
+
+    # Yields (hand, leader seat, cards in play order, winner seat, points) for every trick of the game.
+    def tricks(self):
+        e = engine()
+        seats = len(self.names)
+        starting_card = hearts.Card(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                                    hearts.card_ranks)
+        for record in self.hands:
+            offset = pass_offset(record.hand)
+            hands = [record.dealt[s] & ~record.passed[s] | record.passed[(s - offset) % seats] for s in range(seats)]
+            leader = next(s for s in range(seats) if hands[s] & starting_card.bit)
+            for i in range(0, len(record.plays), seats):
+                cards = record.plays[i:i + seats]
+                mask = sum(1 << c for c in cards)
+                winner = (leader + cards.index(hearts.CardEngine.highest(mask & e.card_suit_masks[cards[0]]))) % seats
+                yield record.hand, leader, cards, winner, sum(e.card_points[c] for c in cards)
+                leader = winner
+
+    def hand_points(self):
+        total = engine().points(engine().full_mask)
+        points = {}
+        for hand, _, _, winner, trick_points in self.tricks():
+            points.setdefault(hand, [0] * len(self.names))[winner] += trick_points
+        return [[0 if p == total else total for p in hand] if total in hand else hand for hand in points.values()]
+
+    def scores(self):
+        hand_points = self.hand_points()
+        return {name: sum(hand[seat] for hand in hand_points) for seat, name in enumerate(self.names)}
+
+
+# Appends games to a record file. Each game is written with a single write call once it is complete.
+class GameRecordWriter:
+
+    def __init__(self, path):
+        self.file = open(path, "ab")
+        if self.file.tell() == 0:
+            self.file.write(magic)
+
+    def write(self, game, seed=""):
+        self.write_encoded(encode_game(game, seed))
+
+    def write_encoded(self, data):
+        self.file.write(data)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+
+# Yields the games of a record file one at a time from a memory map, so files larger than memory can be replayed.
+def read_records(path):
+    if os.path.getsize(path) == 0:
+        return
+    with open(path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        if buffer[:len(magic)] != magic:
+            raise ValueError(f"Not a game record file: {path}")
+        view = memoryview(buffer)
+        position = len(magic)
+        try:
+            while position < len(buffer):
+                length = length_format.unpack_from(buffer, position)[0]
+                position += length_format.size
+                yield GameRecord.decode(view[position:position + length])
+                position += length
+        finally:
+            view.release()
+
+
+def rescore(path):
+    for record in read_records(path):
+        yield record.seed, record.scores()
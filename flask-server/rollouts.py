@@ -0,0 +1,283 @@
+import atexit
+import multiprocessing
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor, wait
+
+import ai
+import hearts
+from metrics import metrics
+
+max_seats = 6
+# A position is written to its slot as int64s: seat count, seat to move, hand, unseen cards, hearts broken, first trick
+# and trick length, then sizes, excluded, known cards, points and bonuses by seat, then (seat, card index) for the
+# trick. Its rules are the executor's.
+header = 7
+seat_fields = 5
+slot_width = header + seat_fields * max_seats + 2 * (max_seats - 1)
+# Time allowed on top of a request's deadline for its result to come back from the worker.
+grace = 0.02
+
+
+def write_position(states, slot, position):
+    seats = position.player_count()
+    if seats > max_seats:
+        raise ValueError(f"Positions have at most {max_seats} seats: {seats}")
+    base = slot * slot_width
+    states[base:base + header] = [seats, position.seat, position.hand, position.unseen, position.hearts_broken,
+                                  position.first_trick, len(position.trick)]
+    for field, values in enumerate((position.sizes, position.excluded, position.known, position.points,
+                                    position.bonuses)):
+        start = base + header + field * max_seats
+        states[start:start + seats] = list(values)
+    start = base + header + seat_fields * max_seats
+    states[start:start + 2 * len(position.trick)] = [n for pair in position.trick for n in pair]
+
+
+def read_position(states, slot, rules):
+    base = slot * slot_width
+    seats, seat, hand, unseen, hearts_broken, first_trick, trick_length = states[base:base + header]
+    fields = [states[base + header + f * max_seats:base + header + f * max_seats + seats] for f in range(seat_fields)]
+    start = base + header + seat_fields * max_seats
+    trick = states[start:start + 2 * trick_length]
+    sizes, excluded, known, points, bonuses = fields
+    return ai.Position(rules.card_suits, rules.card_ranks, seat, hand, sizes, excluded, known, unseen, points,
+                       list(zip(trick[::2], trick[1::2])), bool(hearts_broken), bool(first_trick), rules, bonuses)
+
+
+# What a worker process keeps between batches: the rules, with their tables and card engine built once when the worker
+# starts, and the shared arrays of positions and cancellation flags.
+worker = {}
+
+
+def start_worker(rules, states, flags):
+    worker.update(rules=rules, states=states, flags=flags)
+
+
+# Runs a batch of searches one after another. Each request is (slot, iterations, time limit, seconds left before its
+# deadline when the batch was sent, exploration, seed), and a search with a deadline gets no more than an even share of
+# the time left to it and the searches after it, so the last in a batch is not starved. A request whose deadline has
+# passed or that was cancelled gets None. Returns the results and the time the batch kept the worker busy.
+def run_batch(requests):
+    started = time.perf_counter()
+    flags = worker['flags']
+    results = []
+    for i, (slot, iterations, time_limit, remaining, exploration, seed) in enumerate(requests):
+        left = started + remaining - time.perf_counter() if remaining is not None else None
+        if flags[slot] or (left is not None and left <= 0):
+            results.append(None)
+            continue
+        position = read_position(worker['states'], slot, worker['rules'])
+        share = left / (len(requests) - i) if left is not None else None
+        limit = share if time_limit is None else time_limit if share is None else min(time_limit, share)
+        results.append(ai.search(position, iterations, limit, exploration, seed, lambda: flags[slot]))
+    return results, time.perf_counter() - started
+
+
+# One search submitted to a RolloutExecutor. result() waits for it, for no longer than its deadline allows, and
+# returns the search's {move: (visits, reward)} or None if it was degraded, expired or cancelled.
+class Rollout:
+
+    def __init__(self, executor, iterations, time_limit, exploration, seed):
+        self.executor = executor
+        self.iterations = iterations
+        self.time_limit = time_limit
+        self.exploration = exploration
+        self.seed = seed
+        self.deadline = time.monotonic() + time_limit if time_limit is not None else None
+        self.slot = None
+        self.status = None
+        self.stats = None
+        self.finished = threading.Event()
+
+    def result(self, timeout=None):
+        if self.deadline is not None:
+            left = self.deadline + grace - time.monotonic()
+            timeout = left if timeout is None else min(timeout, left)
+        if not self.finished.wait(max(0.0, timeout) if timeout is not None else None):
+            self.cancel()
+        return self.stats
+
+    def cancel(self):
+        self.executor.cancel(self)
+
+    def done(self):
+        return self.finished.is_set()
+
+
+# Searches for every AI player of a server on one persistent pool of worker processes, so that search does not compete
+# for the GIL with requests. Positions are written to a shared array of slots and workers read them from there, and
+# only small tuples of request parameters and the move statistics cross the process boundary. A dispatcher thread keeps
+# at most one batch per worker in flight and sends the queued requests in batches sized to spread them over the free
+# workers. Requests are degraded, resolving at once to None so the player falls back to a cheaper policy, when every
+# slot is taken or the queue ahead is expected to outlast their deadline. Expired requests are dropped before they are
+# sent, and cancelling a running request stops its search at the next iteration. Every position is played by the
+# executor's rules.
+class RolloutExecutor:
+
+    def __init__(self, workers=None, rules=None, max_pending=256, max_batch=8, window=10.0):
+        self.workers = workers or os.cpu_count() or 1
+        self.rules = rules or hearts.Rules.of()
+        self.max_batch = max_batch
+        self.window = window
+        self.states = multiprocessing.RawArray('q', max_pending * slot_width)
+        self.flags = multiprocessing.RawArray('b', max_pending)
+        self.free = list(range(max_pending))
+        self.pool = ProcessPoolExecutor(self.workers, initializer=start_worker,
+                                        initargs=(self.rules, self.states, self.flags))
+        self.queue = deque()
+        self.in_flight = 0
+        self.running = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.counts = dict.fromkeys(("completed", "expired", "cancelled", "degraded", "failed"), 0)
+        self.request_seconds = None
+        self.busy = deque()
+        self.started = time.monotonic()
+        self.thread = threading.Thread(target=self.dispatch, name="rollouts", daemon=True)
+        self.thread.start()
+
+    # Starts every worker process and waits for them, so the first searches are not held up by processes starting.
+    def start(self):
+        wait([self.pool.submit(os.getpid) for _ in range(self.workers)])
+
+    def submit(self, position, iterations=None, time_limit=None, exploration=0.7, seed=None):
+        if iterations is None and time_limit is None:
+            raise ValueError("An iteration or time budget is required")
+        if position.rules is not self.rules:
+            raise ValueError("The position is not played by this executor's rules")
+        rollout = Rollout(self, iterations, time_limit, exploration, seed)
+        with self.condition:
+            if self.closed or not self.free or (time_limit is not None and self.expected_wait() > time_limit):
+                self.finish(rollout, None, "degraded")
+                return rollout
+            rollout.slot = self.free.pop()
+            self.flags[rollout.slot] = 0
+            write_position(self.states, rollout.slot, position)
+            self.queue.append(rollout)
+            self.condition.notify_all()
+        return rollout
+
+    # Seconds before a request submitted now would start, from the recent time per request.
+    def expected_wait(self):
+        if self.request_seconds is None:
+            return 0.0
+        return (len(self.queue) + self.running) * self.request_seconds / self.workers
+
+    def cancel(self, rollout):
+        with self.condition:
+            if rollout.done():
+                return
+            if rollout in self.queue:
+                self.queue.remove(rollout)
+                self.finish(rollout, None, "cancelled")
+            elif rollout.slot is not None:
+                self.flags[rollout.slot] = 1
+
+    def dispatch(self):
+        while True:
+            with self.condition:
+                while not self.closed and (not self.queue or self.in_flight >= self.workers):
+                    self.condition.wait()
+                if self.closed:
+                    return
+                now = time.monotonic()
+                size = min(self.max_batch, -(-len(self.queue) // (self.workers - self.in_flight)))
+                batch = []
+                while self.queue and len(batch) < size:
+                    rollout = self.queue.popleft()
+                    if rollout.deadline is not None and rollout.deadline <= now:
+                        self.finish(rollout, None, "expired")
+                    else:
+                        batch.append(rollout)
+                if not batch:
+                    continue
+                self.in_flight += 1
+                self.running += len(batch)
+            try:
+                future = self.pool.submit(run_batch, [
+                    (r.slot, r.iterations, r.time_limit, r.deadline - now if r.deadline is not None else None,
+                     r.exploration, r.seed) for r in batch])
+            except RuntimeError as error:
+                future = Future()
+                future.set_exception(error)
+            future.add_done_callback(lambda f, batch=batch: self.batch_done(batch, f))
+
+    def batch_done(self, batch, future):
+        try:
+            results, busy = future.result()
+            statuses = ["cancelled" if self.flags[r.slot] else "expired" if stats is None else "completed" for
+                        r, stats in zip(batch, results)]
+        except Exception:
+            results, busy, statuses = [None] * len(batch), 0.0, ["failed"] * len(batch)
+        with self.condition:
+            self.in_flight -= 1
+            self.running -= len(batch)
+            self.busy.append((time.monotonic(), busy))
+            seconds = busy / len(batch)
+            self.request_seconds = seconds if self.request_seconds is None else \
+                0.8 * self.request_seconds + 0.2 * seconds
+            [self.finish(r, stats if status == "completed" else None, status) for r, stats, status in
+             zip(batch, results, statuses)]
+            self.condition.notify_all()
+
+    # Callers hold the condition.
+    def finish(self, rollout, stats, status):
+        if rollout.slot is not None:
+            self.free.append(rollout.slot)
+            rollout.slot = None
+        rollout.stats = stats
+        rollout.status = status
+        self.counts[status] += 1
+        metrics.count("rollouts", status=status)
+        rollout.finished.set()
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    # The share of the workers' time spent searching over the last window seconds.
+    def utilization(self):
+        with self.condition:
+            now = time.monotonic()
+            while self.busy and self.busy[0][0] < now - self.window:
+                self.busy.popleft()
+            elapsed = min(self.window, now - self.started)
+            return sum(b for _, b in self.busy) / (self.workers * elapsed) if elapsed > 0 else 0.0
+
+    def stats(self):
+        utilization = self.utilization()
+        with self.condition:
+            return {'workers': self.workers, 'queue_depth': len(self.queue), 'running': self.running,
+                    'utilization': utilization, 'request_seconds': self.request_seconds, **self.counts}
+
+    # Cancels every request still queued, stops running searches and shuts the workers down.
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            while self.queue:
+                self.finish(self.queue.popleft(), None, "cancelled")
+            self.flags[:] = [1] * len(self.flags)
+            self.condition.notify_all()
+        self.thread.join()
+        self.pool.shutdown(wait=True, cancel_futures=True)
+
+
+service = None
+service_lock = threading.Lock()
+
+
+# The executor shared by every player in this process playing the standard rules, started on first use with its queue
+# depth and utilization reported as metrics.
+def shared(workers=None):
+    global service
+    with service_lock:
+        if service is None:
+            service = RolloutExecutor(workers)
+            metrics.gauge("rollout_queue_depth", service.queue_depth)
+            metrics.gauge("rollout_utilization", service.utilization)
+            atexit.register(service.close)
+        return service
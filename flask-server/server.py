@@ -0,0 +1,508 @@
+import atexit
+import hashlib
+import os
+import random
+import secrets
+import threading
+import time
+from collections import OrderedDict
+
+from flask import Flask, render_template, request, jsonify, redirect, url_for, make_response, g
+
+import cache
+import hearts
+from events import EventChannel
+from metrics import metrics
+from storage import GameStore, SQLiteBackend
+
+class StoreFullError(Exception):
+    pass
+
+
+# Strategies a restored table can seat again, by class name. Bots of any other strategy play on with PassingStrategy.
+table_strategies = {s.__name__: s for s in (hearts.HumanStrategy, hearts.RandomStrategy, hearts.PassingStrategy)}
+
+
+# One game hosted by the server. Bots move as soon as it is their turn and people's moves come from requests. Callers
+# must hold the lock while using a table. With a store, a table logs every move so replaying them rebuilds it.
+class Table(hearts.Sink):
+
+    def __init__(self, table_id, rules=None, publish=None, seed=None, store=None):
+        self.id = table_id
+        self.publish = publish
+        self.store = store
+        self.lock = threading.RLock()
+        self.last_access = time.monotonic()
+        self.seed = secrets.randbits(64) if seed is None else seed
+        self.game = hearts.Game.of(rules or hearts.Rules.of(), self.seed)
+        self.seat_count = self.game.rules.player_count
+        self.steps = None
+        self.decision = None
+        self.pass_choices = {}
+        self.version = 0
+        self.moves = 0
+        if store is not None:
+            store.add("table", table_id, self.game.rules.encode(), self.seed, time.time())
+
+    @property
+    def phase(self):
+        if self.steps is None:
+            return "waiting"
+        if self.decision is None:
+            return "over"
+        return "passing" if self.decision.kind == "pass" else "playing"
+
+    def player(self, name):
+        player = next((p for p in self.game.players if p.name == name), None)
+        if player is None:
+            raise ValueError(f"No player named {name} at table {self.id}")
+        return player
+
+    def human(self, name):
+        player = self.player(name)
+        if not isinstance(player.strategy, hearts.HumanStrategy):
+            raise ValueError(f"{name} is not played by a person")
+        return player
+
+    def join(self, name, strategy=None):
+        if self.phase != "waiting":
+            raise ValueError(f"Table {self.id} is full")
+        if any(p.name == name for p in self.game.players):
+            raise ValueError(f"{name} is already seated at table {self.id}")
+        self.seat(name, strategy or hearts.HumanStrategy())
+        self.play_bots()
+        return self.player(name)
+
+    # Every seat draws from a generator of its own, so the game's generator only shuffles and a replayed table, whose
+    # bots do not choose their logged moves again, is dealt the same cards.
+    def seat(self, name, strategy):
+        player = hearts.Player(name, strategy, self.game.spawn(1)[0])
+        self.game.players.append(player)
+        self.version += 1
+        self.log("join", player, [name, type(strategy).__name__])
+        self.emit('joined', player=name)
+        if self.game.player_count() == self.seat_count:
+            self.steps = self.game.steps(self)
+            self.send(None)
+
+    # People may pass in any order; a pass is held until the game asks for it.
+    def pending_passes(self):
+        return [p for p in self.game.players if isinstance(p.strategy, hearts.HumanStrategy) and
+                p not in self.pass_choices and p not in self.game.pass_choices]
+
+    def pass_cards(self, name, card_indices):
+        player = self.human(name)
+        if self.phase != "passing":
+            raise ValueError("Cards can only be passed before the first trick")
+        if player not in self.pending_passes():
+            raise ValueError(f"{name} has already passed")
+        self.hold(player, set(card_indices))
+        self.play_bots()
+
+    def hold(self, player, card_indices):
+        self.pass_choices[player] = hearts.Decision("pass", player).check([self.card(i) for i in card_indices])
+        self.version += 1
+        self.log("hold", player, [c.index for c in self.pass_choices[player]])
+
+    def next_player(self):
+        return self.decision.player if self.phase == "playing" else None
+
+    def play_card(self, name, card_index):
+        player = self.human(name)
+        if player != self.next_player():
+            raise ValueError(f"It is not {name}'s turn")
+        self.send(self.decision.check(self.card(card_index)))
+        self.play_bots()
+
+    # Makes the moves of bots and the passes people have already chosen until a person has to move or the game is over.
+    def play_bots(self):
+        while (decision := self.decision) is not None:
+            if not isinstance(decision.player.strategy, hearts.HumanStrategy):
+                self.send(decision.choose())
+            elif decision.player in self.pass_choices:
+                self.send(self.pass_choices.pop(decision.player))
+            else:
+                return
+
+    def send(self, move):
+        if move is not None:
+            self.log("move", self.decision.player, [c.index for c in move] if self.decision.kind == "pass" else
+                     [move.index])
+        try:
+            self.decision = self.steps.send(move)
+        except StopIteration:
+            self.decision = None
+
+    # Moves are numbered whether or not there is a store, so a replayed table numbers its next move where it left off.
+    def log(self, kind, player, value):
+        self.moves += 1
+        if self.store is not None:
+            self.store.add("move", self.id, self.moves, kind, self.game.players.index(player), value)
+
+    # Rebuilds the table from its logged moves, (kind, seat, value) in order, on a new table without a store. Raises
+    # ValueError if a move is not legal.
+    def replay(self, moves):
+        for kind, seat, value in moves:
+            if kind == "join":
+                self.seat(value[0], table_strategies.get(value[1], hearts.PassingStrategy)())
+                continue
+            if not 0 <= seat < self.game.player_count():
+                raise ValueError(f"No seat {seat} at table {self.id}")
+            player = self.game.players[seat]
+            if kind == "hold":
+                self.hold(player, value)
+            elif self.decision is None or self.decision.player is not player:
+                raise ValueError(f"It is not {player.name}'s turn at table {self.id}")
+            else:
+                self.pass_choices.pop(player, None)
+                self.send(self.decision.check([self.card(i) for i in value] if self.decision.kind == "pass" else
+                                              self.card(value[0])))
+
+    def hand_passed(self, game, passes):
+        if passes:
+            self.emit('passed')
+
+    def card_played(self, game, trick, player, card):
+        self.version += 1
+        self.emit('played', player=player.name, trick=trick.index, card=card.index)
+
+    def trick_played(self, game, trick):
+        self.emit('trick_won', player=trick.winning_player().name, trick=trick.index, points=trick.points())
+
+    def hand_scored(self, game, shot_the_moon):
+        if self.store is not None:
+            self.store.add("hand", self.id, game.hand, [p.points(game.hand) for p in game.players])
+        self.emit('hand_scored', points={p.name: p.points(game.hand) for p in game.players})
+
+    def game_over(self, game, winner):
+        if self.store is not None:
+            self.store.add("status", self.id, "over")
+        self.emit('game_over', winner=winner.name)
+
+    # Events are only built when someone listens, and carry card indices rather than rendered cards.
+    def emit(self, event_type, **data):
+        if self.publish is not None:
+            self.publish(self.id, {'type': event_type, 'table': self.id, 'hand': self.game.hand,
+                                   'version': self.version, **data})
+
+    def card(self, card_index):
+        engine = hearts.CardEngine.of(self.game.card_suits, self.game.card_ranks)
+        if not isinstance(card_index, int) or not 0 <= card_index < engine.card_count:
+            raise ValueError(f"Invalid card index: {card_index}")
+        return engine.cards[card_index]
+
+    def encode(self, name=None):
+        state = {'id': self.id, 'phase': self.phase, 'hand': self.game.hand, 'version': self.version,
+                 'rules': self.game.rules.encode(),
+                 'players': [{'name': p.name, 'card_count': p.mask.bit_count(), 'total_points': p.total_points(),
+                              'human': isinstance(p.strategy, hearts.HumanStrategy)} for p in self.game.players]}
+        if self.phase == "passing":
+            state['pass_type'] = self.game.rules.pass_description(self.game.hand)
+            state['pending_passes'] = [p.name for p in self.pending_passes()]
+        if self.phase == "playing":
+            state['trick'] = [{'player': p.name, 'card': c.encode()} for (_, p), c in
+                              self.game.trick.cards_by_player.items()]
+            state['next_player'] = self.next_player().name
+        if self.phase == "over":
+            state['winner'] = hearts.Utils.get_game_winner(self.game.players).name
+        if name is not None:
+            player = self.player(name)
+            state['cards'] = [c.encode() for c in player.cards]
+            if self.phase == "playing" and player == self.next_player():
+                state['legal'] = list(hearts.CardEngine.indices(self.decision.legal_mask()))
+        return state
+
+
+# Holds the tables of one server process, evicting those idle for longer than idle_timeout seconds. With a game store,
+# restore brings back the tables still open when the server stopped.
+class TableStore:
+
+    def __init__(self, max_tables=10000, idle_timeout=1800, publish=None, store=None):
+        self.max_tables = max_tables
+        self.idle_timeout = idle_timeout
+        self.publish = publish
+        self.store = store
+        self.tables = OrderedDict()
+        self.lock = threading.Lock()
+
+    def evict_idle(self, now):
+        while self.tables and now - next(iter(self.tables.values())).last_access > self.idle_timeout:
+            table_id, table = self.tables.popitem(last=False)
+            if self.store is not None and table.phase != "over":
+                self.store.add("status", table_id, "evicted")
+
+    def create(self, rules=None, seed=None):
+        now = time.monotonic()
+        with self.lock:
+            self.evict_idle(now)
+            if len(self.tables) >= self.max_tables:
+                raise StoreFullError(f"No more than {self.max_tables} tables can be hosted")
+            table = Table(secrets.token_urlsafe(8), rules, self.publish, seed, self.store)
+            self.tables[table.id] = table
+            return table
+
+    # Replays the open tables of the game store and lets their bots make any moves that were due. A table whose moves
+    # no longer replay is left out. Returns the number of tables restored.
+    def restore(self):
+        restored = 0
+        for table_id, rules, seed, moves in self.store.unfinished():
+            table = Table(table_id, hearts.Rules.parse(rules), seed=seed)
+            try:
+                table.replay(moves)
+            except ValueError:
+                metrics.count("tables_restored", status="failed")
+                continue
+            table.publish, table.store = self.publish, self.store
+            with table.lock:
+                table.play_bots()
+            with self.lock:
+                self.tables[table_id] = table
+            metrics.count("tables_restored", status="restored")
+            restored += 1
+        return restored
+
+    def get(self, table_id):
+        now = time.monotonic()
+        with self.lock:
+            self.evict_idle(now)
+            table = self.tables.get(table_id)
+            if table is not None:
+                table.last_access = now
+                self.tables.move_to_end(table_id)
+            return table
+
+    def count(self):
+        return len(self.tables)
+
+
+# Everything the index page shows, computed once in Python; the template only places these prebuilt HTML fragments.
+class IndexView:
+    deck_fragments = {}
+
+    def __init__(self, game, _player_names):
+        rank_count = len(game.card_ranks)
+        self.deck = IndexView.deck_html(game)
+        game.shuffle_deck()
+        self.shuffled_deck = hearts.Utils.cards_html(game.deck.cards, rank_count)
+        game.add_players(_player_names)
+        game.shuffle_players()
+        self.players = [p.name for p in game.players]
+        game.deal_cards()
+        hearts.Utils.sort_player_cards(game.players, game.card_suits, game.card_ranks)
+        self.initial_deal = [(p.name, hearts.Utils.cards_html(p.cards)) for p in game.players]
+        self.pass_type = game.rules.pass_description(game.hand)
+        self.passes = [(f"{p1.name} => {p2.name}", hearts.Utils.cards_html(cards)) for (p1, p2), cards in
+                       game.pass_three_cards(game.hand).items()]
+        game.set_player_rotation()
+        self.first_player = hearts.Utils.cycle_players_to(game.get_first_player(), game.player_rotation).name
+        self.starting_card = game.starting_card
+        self.order_of_play = [game.get_next_player().name for _ in range(game.player_count())]
+
+    # The unshuffled deck is the same on every page.
+    @staticmethod
+    def deck_html(game):
+        key = (tuple(game.card_suits), tuple(game.card_ranks))
+        if key not in IndexView.deck_fragments:
+            IndexView.deck_fragments[key] = hearts.Utils.cards_html(
+                hearts.Deck(game.card_suits, game.card_ranks).cards, len(game.card_ranks))
+        return IndexView.deck_fragments[key]
+
+
+# Rendered pages by key, least recently used first, with an ETag for each so repeat requests can be answered with 304.
+class PageCache:
+
+    def __init__(self, max_pages=1024):
+        self.max_pages = max_pages
+        self.pages = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, render):
+        with self.lock:
+            page = self.pages.get(key)
+            if page is not None:
+                self.pages.move_to_end(key)
+                self.hits += 1
+                return page
+        body = render()
+        page = (body, hashlib.sha1(body.encode()).hexdigest())
+        with self.lock:
+            self.misses += 1
+            self.pages[key] = page
+            while len(self.pages) > self.max_pages:
+                self.pages.popitem(last=False)
+        return page
+
+
+app = Flask(__name__, template_folder="../templates")
+pages = PageCache()
+table_events = EventChannel()
+events_lock = threading.Lock()
+events_started = False
+# Tables are kept in the SQLite database named by HEARTS_DATABASE, if set, and those still open are restored on start.
+game_store = GameStore(SQLiteBackend(os.environ["HEARTS_DATABASE"])) if os.environ.get("HEARTS_DATABASE") else None
+tables = TableStore(publish=table_events.publish, store=game_store)
+if game_store is not None:
+    atexit.register(game_store.close)
+    metrics.gauge("store_queue_depth", game_store.queue_depth)
+    tables.restore()
+metrics.gauge("tables", tables.count)
+metrics.gauge("spectators", table_events.spectator_count)
+metrics.gauge("page_cache_hits", lambda: pages.hits)
+metrics.gauge("page_cache_misses", lambda: pages.misses)
+metrics.gauge("result_cache_hits", lambda: sum(s['hits'] for s in cache.results.stats().values()))
+metrics.gauge("result_cache_misses", lambda: sum(s['misses'] for s in cache.results.stats().values()))
+
+
+# Table events (GET /tables/<id>/events on port HEARTS_EVENTS_PORT, 5001 by default) start with the first request, so
+# whatever process serves requests serves them, under a WSGI server or app.run, and the reloader's parent never does.
+@app.before_request
+def start_table_events():
+    global events_started
+    if not events_started:
+        with events_lock:
+            if not events_started:
+                events_started = True
+                try:
+                    table_events.start(port=int(os.environ.get("HEARTS_EVENTS_PORT", 5001)))
+                except OSError:
+                    app.logger.exception("Table events could not be served")
+
+
+@app.before_request
+def start_timer():
+    if metrics.enabled:
+        g.started = time.perf_counter()
+
+
+@app.after_request
+def record_request(response):
+    if metrics.enabled and 'started' in g:
+        metrics.observe("request", time.perf_counter() - g.started, endpoint=request.endpoint or "none")
+        metrics.count("responses", status=response.status_code)
+    return response
+
+
+@app.get('/metrics')
+def metrics_page():
+    return metrics.render(), 200, {'Content-Type': 'text/plain; version=0.0.4; charset=utf-8'}
+
+
+def render_home_page(seed):
+    game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks,
+                       seed)
+    game.hand = 1
+    return render_template('index.html', view=IndexView(game, hearts.player_names))
+
+
+# Each page is a game identified by its seed in the URL, so a page can be cached here and by any proxy in front.
+@app.route('/')
+def home_page():
+    seed = request.args.get('seed', type=int)
+    if seed is None:
+        return redirect(url_for('home_page', seed=random.getrandbits(32)))
+    body, etag = pages.get(seed, lambda: render_home_page(seed))
+    response = make_response(body)
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = 3600
+    return response.make_conditional(request)
+
+
+def table_or_404(table_id):
+    table = tables.get(table_id)
+    if table is None:
+        return None, (jsonify({'error': f"No table {table_id}"}), 404)
+    return table, None
+
+
+@app.errorhandler(ValueError)
+def bad_request(error):
+    return jsonify({'error': str(error)}), 400
+
+
+@app.errorhandler(StoreFullError)
+def store_full(error):
+    return jsonify({'error': str(error)}), 503
+
+
+# The request's JSON body, which must be an object. A body is optional only where optional is set.
+def json_body(optional=False):
+    body = request.get_json(force=True, silent=optional)
+    if body is None and optional:
+        return {}
+    if not isinstance(body, dict):
+        raise ValueError("The request body must be a JSON object")
+    return body
+
+
+def card_index_list(body):
+    cards = body.get('cards', [])
+    if not isinstance(cards, list) or not all(isinstance(c, int) for c in cards):
+        raise ValueError(f"Cards must be a list of card indices: {cards}")
+    return cards
+
+
+@app.post('/tables')
+def create_table():
+    body = json_body(optional=True)
+    rules = hearts.Rules.parse(body.get('rules') or {})
+    bots = body.get('bots', 0)
+    # A table of bots only would play its whole game inside this request, so one seat is always left for a person.
+    if not isinstance(bots, int) or not 0 <= bots < rules.player_count:
+        raise ValueError(f"A table can have 0 to {rules.player_count - 1} bots: {bots}")
+    seed = body.get('seed')
+    if seed is not None and not isinstance(seed, int):
+        raise ValueError(f"Invalid seed: {seed}")
+    table = tables.create(rules, seed)
+    with table.lock:
+        [table.join(name, hearts.PassingStrategy()) for name in rules.player_names[:bots]]
+        return jsonify(table.encode()), 201
+
+
+@app.post('/tables/<table_id>/join')
+def join_table(table_id):
+    table, error = table_or_404(table_id)
+    if error: return error
+    name = json_body().get('name')
+    if not name or not isinstance(name, str):
+        raise ValueError("A player name is required")
+    with table.lock:
+        table.join(name)
+        return jsonify(table.encode(name))
+
+
+@app.post('/tables/<table_id>/pass')
+def pass_cards(table_id):
+    table, error = table_or_404(table_id)
+    if error: return error
+    body = json_body()
+    cards = card_index_list(body)
+    with table.lock:
+        table.pass_cards(body.get('name'), cards)
+        return jsonify(table.encode(body.get('name')))
+
+
+@app.post('/tables/<table_id>/play')
+def play_card(table_id):
+    table, error = table_or_404(table_id)
+    if error: return error
+    body = json_body()
+    if not isinstance(body.get('card'), int):
+        raise ValueError(f"Invalid card index: {body.get('card')}")
+    with table.lock:
+        table.play_card(body.get('name'), body.get('card'))
+        return jsonify(table.encode(body.get('name')))
+
+
+@app.get('/tables/<table_id>')
+def table_state(table_id):
+    table, error = table_or_404(table_id)
+    if error: return error
+    with table.lock:
+        return jsonify(table.encode(request.args.get('name')))
+
+
+if __name__ == "__main__":
+    app.run(debug=True)
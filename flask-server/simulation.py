@@ -0,0 +1,144 @@
+import argparse
+import functools
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import hearts
+import records
+from metrics import metrics, profile
+
+
+class SimulationStats:
+
+    def __init__(self):
+        self.games = 0
+        self.hands = 0
+        self.moon_shots = 0
+        self.wins = {}
+        self.points = {}
+
+    def add_game(self, game):
+        self.games += 1
+        self.hands += game.hand - 1
+        self.moon_shots += len(game.moon_shots)
+        winner = hearts.Utils.get_game_winner(game.players)
+        self.wins[winner.name] = self.wins.get(winner.name, 0) + 1
+        for p in game.players:
+            self.points[p.name] = self.points.get(p.name, 0) + p.total_points()
+        return self
+
+    def merge(self, other):
+        self.games += other.games
+        self.hands += other.hands
+        self.moon_shots += other.moon_shots
+        [self.wins.__setitem__(name, self.wins.get(name, 0) + wins) for name, wins in other.wins.items()]
+        [self.points.__setitem__(name, self.points.get(name, 0) + points) for name, points in other.points.items()]
+        return self
+
+    def win_rates(self):
+        return {name: self.wins.get(name, 0) / self.games for name in self.points}
+
+    def average_points(self):
+        return {name: points / self.games for name, points in self.points.items()}
+
+    def moon_shot_frequency(self):
+        return self.moon_shots / self.hands if self.hands > 0 else 0.0
+
+    def average_hands(self):
+        return self.hands / self.games if self.games > 0 else 0.0
+
+    def encode(self):
+        return {'games': self.games, 'hands': self.hands, 'moon_shots': self.moon_shots,
+                'win_rates': self.win_rates() if self.games > 0 else {},
+                'average_points': self.average_points() if self.games > 0 else {},
+                'moon_shot_frequency': self.moon_shot_frequency(), 'average_hands': self.average_hands()}
+
+
+# Each game is seeded from (seed, game number), so results do not depend on how games are split across workers.
+def game_seed(seed, game_number):
+    return f"{seed}:{game_number}"
+
+
+def run_games(first_game, game_count, seed, _player_names=tuple(hearts.player_names), record=False):
+    stats = SimulationStats()
+    encoded = bytearray()
+    for game_number in range(first_game, first_game + game_count):
+        game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks,
+                           game_seed(seed, game_number))
+        game.play(_player_names)
+        stats.add_game(game)
+        if record:
+            encoded += records.encode_game(game, game.seed)
+    return stats, bytes(encoded)
+
+
+def chunk(n_games, chunk_count):
+    size, extra = divmod(n_games, chunk_count)
+    first_game = 0
+    for i in range(chunk_count):
+        count = size + (1 if i < extra else 0)
+        if count > 0:
+            yield first_game, count
+        first_game += count
+
+
+def run_chunks(n_games, seed, workers, _player_names, record):
+    if workers == 1:
+        yield run_games(0, n_games, seed, _player_names, record)
+        return
+    # A few chunks per worker keeps the pool busy when games vary in length.
+    chunks = list(chunk(n_games, workers * 4))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(run_games, first_game, count, seed, _player_names, record) for first_game, count in
+                   chunks]
+        for future in futures:
+            yield future.result()
+
+
+# With a record_path, every game is also appended to that game record file, in game number order.
+def simulate(n_games, seed=0, workers=None, _player_names=tuple(hearts.player_names), record_path=None):
+    stats = SimulationStats()
+    writer = records.GameRecordWriter(record_path) if record_path else None
+    try:
+        for chunk_stats, encoded in run_chunks(n_games, seed, workers or os.cpu_count() or 1, _player_names,
+                                               writer is not None):
+            stats.merge(chunk_stats)
+            if writer is not None:
+                writer.write_encoded(encoded)
+    finally:
+        if writer is not None:
+            writer.close()
+    return stats
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Simulate Hearts games between random players")
+    parser.add_argument("games", type=int, nargs="?", default=1000)
+    parser.add_argument("--seed", default=0)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--record", help="append every game to this game record file")
+    parser.add_argument("--profile", metavar="PATH",
+                        help="run in this process under cProfile, save the stats here and print the top functions")
+    parser.add_argument("--metrics", action="store_true",
+                        help="run in this process and print phase timings and counters after the run")
+    args = parser.parse_args(argv)
+    # Metrics and profiles only see the process they run in, so either one keeps the games in this process.
+    workers = 1 if args.metrics or args.profile else args.workers
+    if args.metrics:
+        metrics.enable()
+    run = functools.partial(simulate, args.games, args.seed, workers, record_path=args.record)
+    if args.profile:
+        stats, report = profile(run, path=args.profile)
+        print(report, file=sys.stderr)
+    else:
+        stats = run()
+    print(json.dumps(stats.encode(), indent=2))
+    if args.metrics:
+        print(metrics.render(), file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,248 @@
+import math
+import random
+from collections import OrderedDict
+from functools import reduce
+from operator import or_
+
+import cache
+import hearts
+
+exact, lower, upper = 0, 1, 2
+
+
+# Double-dummy search over the rest of a hand with every hand known. A position is worth the points one target seat
+# takes from it on, with the target playing to take as few as possible and every other seat playing to give it as many
+# as possible, so plain alpha-beta applies. Hearts cannot be led until broken; the first trick's rules and shooting the
+# moon are not considered.
+#
+# Hands are masks of the cards each seat still holds and a trick is a list of (seat, card index) in play order.
+# Positions at the start of a trick are stored in a transposition table keyed by a Zobrist hash of who holds which card,
+# the leader and the target, and the least recently used entries are dropped once the table is full. Finished solves are
+# also kept in the shared result cache under the position's canonical form, so any solver meeting an equivalent position
+# reuses them; pass results=None to search every time.
+class Solver:
+
+    def __init__(self, _card_suits=hearts.card_suits, _card_ranks=hearts.card_ranks, player_count=4,
+                 max_entries=1 << 20, seed=0, results=cache.results):
+        engine = self.engine = hearts.CardEngine.of(_card_suits, _card_ranks)
+        self.player_count = player_count
+        self.results = results
+        self.max_entries = max_entries
+        self.suit_masks = list(engine.suit_masks.values())
+        self.card_points = engine.card_points
+        self.card_suit_masks = engine.card_suit_masks
+        self.lead_order = [i % engine.rank_count for i in range(engine.card_count)]
+        self.discard_order = [-engine.card_points[i] * engine.rank_count - i % engine.rank_count for i in
+                              range(engine.card_count)]
+        rng = random.Random(seed)
+        self.card_keys = [[rng.getrandbits(64) for _ in range(engine.card_count)] for _ in range(player_count)]
+        self.leader_keys = [rng.getrandbits(64) for _ in range(player_count)]
+        self.target_keys = [rng.getrandbits(64) for _ in range(player_count)]
+        self.unbroken_key = rng.getrandbits(64)
+        self.queen_keys = [rng.getrandbits(64) for _ in range(engine.rank_count)]
+        self.suit_bases = [i - i % engine.rank_count for i in range(engine.card_count)]
+        self.queen_mask = engine.queen_of_spades_mask
+        self.queen_suit_mask = engine.suit_mask(hearts.spades_suit)
+        self.table = OrderedDict()
+        self.nodes = 0
+        self.hits = 0
+
+    # Cards are hashed by seat, suit and rank among the cards of their suit still in play, so positions that differ
+    # only in which low cards are gone share an entry. The queen of spades is hashed by that rank too.
+    def key(self, hands, in_play):
+        card_keys = self.card_keys
+        suit_masks = self.card_suit_masks
+        bases = self.suit_bases
+        key = 0
+        for seat, hand in enumerate(hands):
+            seat_keys = card_keys[seat]
+            while hand:
+                low = hand & -hand
+                i = low.bit_length() - 1
+                hand ^= low
+                key ^= seat_keys[bases[i] + (in_play & suit_masks[i] & -low).bit_count() - 1]
+        if in_play & self.queen_mask:
+            key ^= self.queen_keys[(in_play & self.queen_suit_mask & -self.queen_mask).bit_count() - 1]
+        return key
+
+    # The points target takes from here to the end of the hand when seat is next to play.
+    def solve(self, hands, seat, trick=(), target=None, hearts_broken=True):
+        target = seat if target is None else target
+
+        def solve():
+            state = self.trick_state(hands, trick, hearts_broken)
+            return self.search(list(hands), seat, target, -math.inf, math.inf, *state)
+
+        if self.results is None:
+            return solve()
+        key, _ = self.canonical(hands, seat, trick, hearts_broken)
+        return self.results.get("solve", key + (target,), solve)
+
+    # The value of every legal card for the seat to play, counted as the points that seat goes on to take.
+    def move_values(self, hands, seat, trick=(), hearts_broken=True):
+        def move_values():
+            state = self.trick_state(hands, trick, hearts_broken)
+            return {move: self.play(list(hands), seat, move, seat, -math.inf, math.inf, *state) for move in
+                    hearts.CardEngine.indices(self.engine.legal(hands[seat], state[2], False, state[6], 0))}
+
+        if self.results is None:
+            return move_values()
+        engine = self.engine
+        key, mapping = self.canonical(hands, seat, trick, hearts_broken)
+        values = self.results.get("move_values", key, lambda: {engine.permute_index(move, mapping): value for
+                                                               move, value in move_values().items()})
+        inverse = engine.inverse(mapping)
+        return {engine.permute_index(move, inverse): value for move, value in values.items()}
+
+    # A result cache key shared by every position equivalent to this one, and the suit mapping that produced it.
+    def canonical(self, hands, seat, trick, hearts_broken):
+        masks, mapping = self.engine.canonical(list(hands) + [1 << i for _, i in trick])
+        return (self.engine, self.player_count, masks, tuple(s for s, _ in trick), seat, hearts_broken), mapping
+
+    def best_move(self, hands, seat, trick=(), hearts_broken=True):
+        values = self.move_values(hands, seat, trick, hearts_broken)
+        move = min(values, key=values.get)
+        return move, values[move]
+
+    # (cards in play, cards in the trick, lead suit mask, winning card, winning seat, trick points, hearts broken) for a
+    # trick given as (seat, card index) in play order.
+    def trick_state(self, hands, trick, hearts_broken):
+        in_play = reduce(or_, hands, sum(1 << i for _, i in trick))
+        hearts_broken = hearts_broken or any(self.engine.hearts_mask >> i & 1 for _, i in trick)
+        if not trick:
+            return in_play, 0, 0, -1, -1, 0, hearts_broken
+        lead_mask = self.card_suit_masks[trick[0][1]]
+        winner, winning = max((c for c in trick if lead_mask >> c[1] & 1), key=lambda c: c[1])
+        trick_points = sum(self.card_points[i] for _, i in trick)
+        return in_play, len(trick), lead_mask, winning, winner, trick_points, hearts_broken
+
+    def play(self, hands, seat, move, target, alpha, beta, in_play, count, lead_mask, winning, winner, trick_points,
+             hearts_broken):
+        bit = 1 << move
+        hands[seat] ^= bit
+        trick_points += self.card_points[move]
+        hearts_broken = hearts_broken or bool(bit & self.engine.hearts_mask)
+        if count == 0:
+            lead_mask = self.card_suit_masks[move]
+        if lead_mask & bit and move > winning:
+            winning, winner = move, seat
+        try:
+            if count + 1 < self.player_count:
+                return self.search(hands, (seat + 1) % self.player_count, target, alpha, beta, in_play,
+                                   count + 1, lead_mask, winning, winner, trick_points, hearts_broken)
+            points = trick_points if winner == target else 0
+            return points + self.search(hands, winner, target, alpha - points, beta - points, reduce(or_, hands), 0,
+                                        0, -1, -1, 0, hearts_broken)
+        finally:
+            hands[seat] ^= bit
+
+    def search(self, hands, seat, target, alpha, beta, in_play, count, lead_mask, winning, winner, trick_points,
+               hearts_broken):
+        self.nodes += 1
+        entry_key = None
+        hint = -1
+        if count == 0:
+            if not hands[seat]:
+                return 0
+            remaining = self.engine.points(in_play)
+            if remaining == 0 or beta <= 0:
+                return 0
+            if alpha >= remaining:
+                return remaining
+            entry_key = self.key(hands, in_play) ^ self.leader_keys[seat] ^ self.target_keys[target]
+            if not hearts_broken:
+                entry_key ^= self.unbroken_key
+            entry = self.table.get(entry_key)
+            if entry is not None:
+                self.table.move_to_end(entry_key)
+                self.hits += 1
+                value, flag, hint = entry
+                if flag == exact or (flag == lower and value >= beta) or (flag == upper and value <= alpha):
+                    return value
+                if flag == lower:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+        original_alpha, original_beta = alpha, beta
+        minimizing = seat == target
+        best = math.inf if minimizing else -math.inf
+        moves = self.moves(hands[seat], in_play, lead_mask, winning, hearts_broken)
+        if hint in moves:
+            moves.remove(hint)
+            moves.insert(0, hint)
+        best_move = moves[0]
+        for move in moves:
+            value = self.play(hands, seat, move, target, alpha, beta, in_play, count, lead_mask, winning, winner,
+                              trick_points, hearts_broken)
+            if minimizing:
+                if value < best:
+                    best, best_move = value, move
+                    beta = min(beta, value)
+            elif value > best:
+                best, best_move = value, move
+                alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+        if entry_key is not None:
+            flag = upper if best <= original_alpha else lower if best >= original_beta else exact
+            self.table[entry_key] = (best, flag, best_move)
+            if len(self.table) > self.max_entries:
+                self.table.popitem(last=False)
+        return best
+
+    # One card from every run of equivalent cards, best first. Cards of a suit are equivalent when no card still in play
+    # sits between them and they are worth the same points. Followers try cards that lose to the trick from the highest
+    # down before cards that win it, discards shed the most points first and leads start low.
+    def moves(self, hand, in_play, lead_mask, winning, hearts_broken):
+        card_points = self.card_points
+        following = hand & lead_mask
+        legal = self.engine.legal(hand, lead_mask, False, hearts_broken, 0)
+        moves = []
+        for suit_mask in self.suit_masks:
+            suit = in_play & suit_mask
+            if not legal & suit:
+                continue
+            held = False
+            points = -1
+            while suit:
+                i = suit.bit_length() - 1
+                suit ^= 1 << i
+                if hand >> i & 1:
+                    if not held or card_points[i] != points:
+                        moves.append(i)
+                    held = True
+                    points = card_points[i]
+                else:
+                    held = False
+        if following:
+            winners = sum(1 for i in moves if i > winning)
+            return moves[winners:] + moves[winners - 1::-1] if winners else moves
+        moves.sort(key=self.discard_order.__getitem__ if lead_mask else self.lead_order.__getitem__)
+        return moves
+
+    def clear(self):
+        self.table.clear()
+        self.nodes = 0
+        self.hits = 0
+
+
+# Compares the points every seat took in the last tricks of each hand with the points it could have held itself to
+# against the other seats' best play. Yields (hand, seat, optimal, actual).
+def endgame_analysis(record, tricks=6, solver=None):
+    solver = solver or Solver(player_count=len(record.names))
+    seats = len(record.names)
+    hand_tricks = {}
+    for hand, leader, cards, winner, points in record.tricks():
+        hand_tricks.setdefault(hand, []).append((leader, cards, winner, points))
+    for hand, played in hand_tricks.items():
+        endgame = played[-tricks:]
+        hands = [0] * seats
+        for leader, cards, _, _ in endgame:
+            for j, i in enumerate(cards):
+                hands[(leader + j) % seats] |= 1 << i
+        actual = [0] * seats
+        for _, _, winner, points in endgame:
+            actual[winner] += points
+        leader = endgame[0][0]
+        for seat in range(seats):
+            yield hand, seat, solver.solve(hands, leader, target=seat), actual[seat]
@@ -0,0 +1,196 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import deque
+
+from metrics import metrics
+
+# Tables by id with their encoded rules, seed and status (open, over or evicted), every table's log of moves in order,
+# and every seat's points for each hand played.
+schema = """
+CREATE TABLE IF NOT EXISTS tables (id TEXT PRIMARY KEY, rules TEXT NOT NULL, seed TEXT NOT NULL, created REAL NOT NULL,
+                                   status TEXT NOT NULL DEFAULT 'open') WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS moves (table_id TEXT NOT NULL, seq INTEGER NOT NULL, kind TEXT NOT NULL,
+                                  seat INTEGER NOT NULL, value TEXT NOT NULL,
+                                  PRIMARY KEY (table_id, seq)) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS hands (table_id TEXT NOT NULL, hand INTEGER NOT NULL, points TEXT NOT NULL,
+                                  PRIMARY KEY (table_id, hand)) WITHOUT ROWID;
+"""
+
+
+# Keeps tables, moves and hands in a SQLite database. A backend writes a batch of records, each a tuple of its kind
+# ("table", "move", "hand" or "status") and its fields, in one transaction, and returns the open tables as (id, rules,
+# seed, [(kind, seat, value)]) with moves in order. Any object with write, unfinished and close can stand in for it.
+class SQLiteBackend:
+    statements = {
+        'table': "INSERT INTO tables (id, rules, seed, created) VALUES (?, ?, ?, ?)",
+        'move': "INSERT INTO moves (table_id, seq, kind, seat, value) VALUES (?, ?, ?, ?, ?)",
+        'hand': "INSERT OR REPLACE INTO hands (table_id, hand, points) VALUES (?, ?, ?)",
+        'status': "UPDATE tables SET status = ? WHERE id = ?",
+    }
+
+    def __init__(self, path=":memory:"):
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.lock = threading.Lock()
+        # The write-ahead journal lets a commit append to one file, synced at checkpoints rather than every commit.
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        self.connection.executescript(schema)
+
+    # Statements run grouped by kind. A batch is atomic, so the order of its records does not matter.
+    def write(self, records):
+        rows = {kind: [] for kind in self.statements}
+        for record in records:
+            kind = record[0]
+            if kind == "table":
+                _, table_id, rules, seed, created = record
+                rows[kind].append((table_id, json.dumps(rules), json.dumps(seed), created))
+            elif kind == "move":
+                _, table_id, seq, move_kind, seat, value = record
+                rows[kind].append((table_id, seq, move_kind, seat, json.dumps(value, separators=(",", ":"))))
+            elif kind == "hand":
+                _, table_id, hand, points = record
+                rows[kind].append((table_id, hand, json.dumps(points)))
+            elif kind == "status":
+                _, table_id, status = record
+                rows[kind].append((status, table_id))
+            else:
+                raise ValueError(f"Unknown record kind: {kind}")
+        with self.lock:
+            self.connection.execute("BEGIN")
+            try:
+                [self.connection.executemany(self.statements[kind], kind_rows) for kind, kind_rows in rows.items() if
+                 kind_rows]
+            except BaseException:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.connection.execute("COMMIT")
+
+    def unfinished(self):
+        with self.lock:
+            tables = self.connection.execute(
+                "SELECT id, rules, seed FROM tables WHERE status = 'open' ORDER BY created").fetchall()
+            unfinished = []
+            for table_id, rules, seed in tables:
+                moves = self.connection.execute("SELECT kind, seat, value FROM moves WHERE table_id = ? ORDER BY seq",
+                                                (table_id,))
+                unfinished.append((table_id, json.loads(rules), json.loads(seed),
+                                   [(kind, seat, json.loads(value)) for kind, seat, value in moves]))
+            return unfinished
+
+    # Every seat's points for each hand of the table, in order.
+    def hands(self, table_id):
+        with self.lock:
+            return [json.loads(points) for points, in self.connection.execute(
+                "SELECT points FROM hands WHERE table_id = ? ORDER BY hand", (table_id,))]
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+
+# Writes records to a backend through a write-ahead queue, so a request only appends to a deque and never waits on the
+# database. A writer thread commits what is queued in batches of up to max_batch records, waiting up to interval seconds
+# for a batch to fill, so there are at most 1 / interval transactions a second however many moves are made. Batches are
+# committed in the order they were queued, so a crash loses at most the last interval of records and leaves every
+# table's moves a prefix of the moves made. A batch that fails is retried after interval seconds, and add blocks while
+# max_queued records are waiting. Once the store is closed, a failed batch is given up along with what is queued.
+class GameStore:
+
+    def __init__(self, backend, max_batch=4096, interval=0.05, max_queued=1 << 16):
+        self.backend = backend
+        self.max_batch = max_batch
+        self.interval = interval
+        self.max_queued = max_queued
+        self.queue = deque()
+        self.writing = 0
+        self.written = 0
+        self.batches = 0
+        self.failures = 0
+        self.flushing = 0
+        self.condition = threading.Condition()
+        self.closed = False
+        self.thread = threading.Thread(target=self.run, name="store", daemon=True)
+        self.thread.start()
+
+    def add(self, *record):
+        with self.condition:
+            if self.closed:
+                raise ValueError("The store is closed")
+            while len(self.queue) >= self.max_queued:
+                self.condition.wait()
+            self.queue.append(record)
+            if len(self.queue) == 1 or len(self.queue) == self.max_batch:
+                self.condition.notify_all()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.queue and not self.closed:
+                    self.condition.wait()
+                if not self.queue:
+                    return
+                deadline = time.monotonic() + self.interval
+                while len(self.queue) < self.max_batch and not self.closed and not self.flushing and (
+                        left := deadline - time.monotonic()) > 0:
+                    self.condition.wait(left)
+                batch = [self.queue.popleft() for _ in range(min(self.max_batch, len(self.queue)))]
+                self.writing = len(batch)
+                self.condition.notify_all()
+            started = time.perf_counter()
+            try:
+                self.backend.write(batch)
+            except Exception:
+                with self.condition:
+                    self.writing = 0
+                    self.failures += 1
+                    closed = self.closed
+                    self.queue.clear() if closed else self.queue.extendleft(reversed(batch))
+                    self.condition.notify_all()
+                metrics.count("store_batches", status="failed")
+                if closed:
+                    return
+                time.sleep(self.interval)
+                continue
+            metrics.observe("store_write", time.perf_counter() - started)
+            metrics.count("store_batches", status="written")
+            metrics.count("store_records", len(batch))
+            with self.condition:
+                self.writing = 0
+                self.written += len(batch)
+                self.batches += 1
+                self.condition.notify_all()
+
+    def queue_depth(self):
+        return len(self.queue)
+
+    # Writes what is queued without waiting for batches to fill, and waits until everything added so far is written or
+    # until timeout seconds have passed. Returns whether it was written.
+    def flush(self, timeout=None):
+        target = None if timeout is None else time.monotonic() + timeout
+        with self.condition:
+            self.flushing += 1
+            self.condition.notify_all()
+            try:
+                while self.queue or self.writing:
+                    left = None if target is None else target - time.monotonic()
+                    if left is not None and left <= 0:
+                        return False
+                    self.condition.wait(left)
+                return True
+            finally:
+                self.flushing -= 1
+
+    def unfinished(self):
+        return self.backend.unfinished()
+
+    # Writes what is queued and closes the backend.
+    def close(self):
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.backend.close()
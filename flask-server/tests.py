@@ -1,7 +1,34 @@
+import asyncio
+import io
+import json
+import os
+import pickle
+import random
+import socket
+import tempfile
+import time
 import unittest
+import ai
+import beliefs
+import benchmarks
+import cache
+import events
+import handstate
 import hearts
+import metrics
+import montecarlo
+import records
+import rollouts
+import server
+import simulation
+import solver
+import storage
+import tournament
 from unittest.mock import patch
 
+# Table events started by test requests listen on any free port rather than the server's.
+os.environ.setdefault("HEARTS_EVENTS_PORT", "0")
+
 test_player_names = ["Test Player 1", "Test Player 2", "Test Player 3", "Test Player 4"]
 test_card_suits = ["Suit A", "Suit B", "Suit C"]
 test_card_ranks = ["Rank 1", "Rank 2", "Rank 3", "Rank 4"]
@@ -51,6 +78,49 @@ class TestCard(unittest.TestCase):
         self.assertEqual(c1, c4)
         self.assertEqual(c4, c1)
 
+    def test_interned(self):
+        c1 = hearts.Card("Rank 2", "Suit A", test_card_suits, test_card_ranks)
+        c2 = hearts.Card("Rank 2", "Suit A", list(test_card_suits), list(test_card_ranks))
+        self.assertIs(c1, c2)
+        self.assertEqual(1, len({c1, c2}))
+        self.assertEqual("x", {c1: "x"}[c2])
+
+    def test_immutable(self):
+        c = hearts.Card("Rank 2", "Suit A", test_card_suits, test_card_ranks)
+        with self.assertRaises(AttributeError):
+            c.rank = "Rank 3"
+        with self.assertRaises(AttributeError):
+            c.color = "red"
+
+    def test_pickle(self):
+        c = hearts.Card("Rank 3", "Suit C", test_card_suits, test_card_ranks)
+        self.assertIs(c, pickle.loads(pickle.dumps(c)))
+
+
+class TestCardEngine(unittest.TestCase):
+    def test_of(self):
+        self.assertIs(hearts.CardEngine.of(test_card_suits, test_card_ranks),
+                      hearts.CardEngine.of(list(test_card_suits), list(test_card_ranks)))
+
+    def test_index(self):
+        e = hearts.CardEngine.of(test_card_suits, test_card_ranks)
+        self.assertEqual(0, e.index("Rank 1", "Suit A"))
+        self.assertEqual(len(test_card_ranks) + 2, e.index("Rank 3", "Suit B"))
+
+    def test_suit_mask(self):
+        e = hearts.CardEngine.of(test_card_suits, test_card_ranks)
+        self.assertEqual(0b1111 << len(test_card_ranks), e.suit_mask("Suit B"))
+        self.assertEqual(0, e.suit_mask("Suit F"))
+
+    def test_indices(self):
+        self.assertEqual([0, 3, 5], list(hearts.CardEngine.indices(0b101001)))
+
+    def test_points(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        mask = e.bit("Q", hearts.spades_suit) | e.bit("2", hearts.hearts_suit) | e.bit("A", hearts.hearts_suit)
+        self.assertEqual(15, e.points(mask | e.bit("Q", hearts.clubs_suit)))
+        self.assertEqual(0, hearts.CardEngine.of(test_card_suits, test_card_ranks).points(0b1111))
+
 
 class TestDeck(unittest.TestCase):
     def test_init_1(self):
@@ -66,6 +136,11 @@ class TestDeck(unittest.TestCase):
         deck = hearts.Deck(test_card_suits, test_card_ranks)
         self.assertEqual(test_card_count, deck.count())
 
+    def test_shared_cards(self):
+        d1 = hearts.Deck(test_card_suits, test_card_ranks)
+        d2 = hearts.Deck(test_card_suits, test_card_ranks)
+        self.assertTrue(all(c1 is c2 for c1, c2 in zip(d1.cards, d2.cards)))
+
     def test_shuffle(self):
         deck = hearts.Deck(test_card_suits, test_card_ranks)
         deck.shuffle()
@@ -79,6 +154,116 @@ class TestDeck(unittest.TestCase):
         self.assertEqual(test_card_count - 1, deck.count())
         self.assertTrue(sum(c1.rank == c2.rank and c1.suit == c2.suit for c2 in deck.cards) == 0)
 
+    def test_mask(self):
+        e = hearts.CardEngine.of(test_card_suits, test_card_ranks)
+        deck = hearts.Deck(test_card_suits, test_card_ranks, e.full_mask & ~1)
+        self.assertEqual(test_card_count - 1, deck.count())
+        self.assertNotIn(e.cards[0], deck.cards)
+
+
+class TestRules(unittest.TestCase):
+    def setUp(self):
+        self.e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+
+    def test_standard(self):
+        rules = hearts.Rules.of()
+        self.assertIs(rules, hearts.Rules.of(hearts.card_suits, hearts.card_ranks, 4, pass_schedule=[1, -1, 2, 0]))
+        self.assertEqual(self.e.card_points, rules.card_points)
+        self.assertEqual(26, rules.moon_points)
+        self.assertEqual(self.e.full_mask, rules.deck_mask)
+        self.assertIs(hearts.Card("2", hearts.clubs_suit, hearts.card_suits, hearts.card_ranks), rules.starting_card)
+        self.assertEqual(["Left / Clockwise", "Right / Counter-Clockwise", "Across", "None / Keep"],
+                         [rules.pass_description(hand) for hand in range(1, 5)])
+        self.assertEqual(((0, 1), (3, 2), (3, 1)), (rules.passes(1)[0], rules.passes(2)[1], rules.passes(7)[3]))
+        self.assertEqual((), rules.passes(8))
+        self.assertIs(rules, pickle.loads(pickle.dumps(rules)))
+        self.assertIs(rules, hearts.Rules.parse(rules.encode()))
+
+    def test_player_counts(self):
+        e = self.e
+        removed = {3: [("2", hearts.diamonds_suit)], 4: [], 5: [("2", hearts.diamonds_suit), ("2", hearts.clubs_suit)],
+                   6: [("2", hearts.diamonds_suit), ("2", hearts.clubs_suit), ("3", hearts.diamonds_suit),
+                       ("3", hearts.clubs_suit)]}
+        for count, cards in removed.items():
+            rules = hearts.Rules.of(player_count=count)
+            self.assertEqual(sum(e.bit(r, s) for r, s in cards), rules.removed_mask)
+            self.assertEqual(52 - len(cards), rules.hand_size * count)
+            self.assertEqual(count, len(rules.player_names))
+            self.assertEqual(0, rules.removed_mask & e.point_mask)
+        self.assertEqual("3", hearts.Rules.of(player_count=5).starting_card.rank)
+        self.assertEqual("4", hearts.Rules.of(player_count=6).starting_card.rank)
+        self.assertEqual(["Left / Clockwise", "Right / Counter-Clockwise", "2 Seats Left / Clockwise",
+                          "2 Seats Right / Counter-Clockwise", "None / Keep"],
+                         list(hearts.Rules.of(player_count=5).pass_descriptions))
+
+    def test_invalid(self):
+        for config in ({'player_count': 2}, {'player_count': 7}, {'moon': "sideways"}, {'end_score': 0},
+                       {'pass_schedule': [4]}, {'pass_schedule': []}, {'end_score': 10 ** 6},
+                       {'queen_of_spades': -1000}, {'queen_of_spades': -13, 'jack_of_diamonds': -13}):
+            self.assertRaises(ValueError, hearts.Rules.of, **config)
+        for config in ({'players': 4}, {'player_count': "4"}, {'pass_schedule': 1}, {'pass_schedule': [1.5]},
+                       {'end_score': True}, {'moon': ["add"]}, [4]):
+            self.assertRaises(ValueError, hearts.Rules.parse, config)
+
+    def test_parse_does_not_intern(self):
+        compiled = len(hearts.Rules.compiled)
+        rules = hearts.Rules.parse({'end_score': 517})
+        self.assertIsNot(rules, hearts.Rules.parse({'end_score': 517}))
+        self.assertEqual(517, rules.end_score)
+        self.assertEqual(compiled, len(hearts.Rules.compiled))
+
+    def test_max_hands(self):
+        game = hearts.Game.of(hearts.Rules.of(queen_of_spades=-12, moon="none"), 1)
+        game.add_players(game.rules.player_names)
+        game.hand = hearts.Rules.max_hands + 1
+        self.assertTrue(game.is_over())
+
+    def test_score(self):
+        points = [26, 0, 0, 0]
+        self.assertIsNone(hearts.Rules.of(moon="none").shooter(points))
+        rules = hearts.Rules.of()
+        self.assertEqual(0, rules.shooter(points))
+        self.assertIsNone(rules.shooter([25, 1, 0, 0]))
+        self.assertEqual([0, 26, 26, 26], rules.score(points, 0))
+        self.assertEqual([-26, 0, 0, 0], hearts.Rules.of(moon="subtract").score(points, 0))
+        choose = hearts.Rules.of(moon="choose")
+        self.assertEqual([0, 26, 26, 26], choose.score(points, 0, [50, 10, 20, 30]))
+        self.assertEqual([-26, 0, 0, 0], choose.score(points, 0, [50, 10, 20, 80]))
+        self.assertEqual([0, 26, 26, 26], choose.score(points, 0, [10, 50, 60, 80]))
+
+    def test_jack_of_diamonds(self):
+        e = self.e
+        rules = hearts.Rules.of(jack_of_diamonds=-10)
+        jack = e.bit("J", hearts.diamonds_suit)
+        self.assertEqual(jack, rules.bonus_mask)
+        self.assertEqual(26, rules.moon_points)
+        self.assertEqual(16, rules.points(e.full_mask))
+        self.assertFalse(rules.standard_points)
+        trick = hearts.Trick(2, rules.starting_card, hearts.card_suits, hearts.card_ranks, rules=rules)
+        trick.add(hearts.Player("Test Player 1"), e.cards[e.index("A", hearts.diamonds_suit)])
+        trick.add(hearts.Player("Test Player 2"), e.cards[e.index("J", hearts.diamonds_suit)])
+        self.assertEqual(-10, trick.points())
+        self.assertEqual([e.cards[hearts.CardEngine.highest(jack)]], trick.point_cards())
+
+    def test_variant_games(self):
+        for count in range(3, 7):
+            rules = hearts.Rules.of(player_count=count, jack_of_diamonds=-10, end_score=50, moon="subtract")
+            game = hearts.Game.of(rules, count)
+            game.play(rules.player_names, [hearts.PassingStrategy()] * count)
+            self.assertTrue(any(p.total_points() >= 50 for p in game.players))
+            for record in game.history:
+                self.assertEqual([rules.hand_size] * count, [m.bit_count() for m in record.dealt])
+                self.assertEqual(rules.hand_size * count, len(record.plays))
+                self.assertEqual(0, sum(record.dealt) & rules.removed_mask)
+            shot = {hand for hand, _ in game.moon_shots}
+            self.assertTrue(all(sum(p.points(hand) for p in game.players) == 16 - 52 * (hand in shot) for hand in
+                                range(1, game.hand)))
+        self.assertRaises(ValueError, hearts.Game, "2", hearts.clubs_suit, hearts.card_suits, hearts.card_ranks, None,
+                          hearts.Rules.of(player_count=5))
+        game = hearts.Game.of(hearts.Rules.of(player_count=3))
+        game.add_players(hearts.player_names)
+        self.assertRaises(ValueError, game.play_seated)
+
 
 class TestTrick(unittest.TestCase):
     def test_init_1(self):
@@ -113,6 +298,75 @@ class TestTrick(unittest.TestCase):
         t.add(p, c)
         self.assertFalse(t.empty())
 
+    def test_winning_player(self):
+        t = hearts.Trick(1, test_starting_card, test_card_suits, test_card_ranks)
+        p1 = hearts.Player("Test Player 1")
+        p2 = hearts.Player("Test Player 2")
+        p3 = hearts.Player("Test Player 3")
+        c1 = hearts.Card("Rank 2", "Suit B", test_card_suits, test_card_ranks)
+        c2 = hearts.Card("Rank 4", "Suit C", test_card_suits, test_card_ranks)
+        c3 = hearts.Card("Rank 3", "Suit B", test_card_suits, test_card_ranks)
+        t.add(p1, c1).add(p2, c2).add(p3, c3)
+        self.assertEqual(c3, t.winning_card())
+        self.assertEqual(p3, t.winning_player())
+
+    def test_points(self):
+        t = hearts.Trick(2, test_starting_card, hearts.card_suits, hearts.card_ranks)
+        c1 = hearts.Card("5", hearts.hearts_suit, hearts.card_suits, hearts.card_ranks)
+        c2 = hearts.Card("Q", hearts.spades_suit, hearts.card_suits, hearts.card_ranks)
+        c3 = hearts.Card("K", hearts.hearts_suit, hearts.card_suits, hearts.card_ranks)
+        c4 = hearts.Card("A", hearts.clubs_suit, hearts.card_suits, hearts.card_ranks)
+        t.add(hearts.Player("Test Player 1"), c1).add(hearts.Player("Test Player 2"), c2)
+        t.add(hearts.Player("Test Player 3"), c3).add(hearts.Player("Test Player 4"), c4)
+        self.assertEqual(15, t.points())
+        self.assertEqual([c2, c3, c1], t.point_cards())
+        self.assertEqual(c3, t.winning_card())
+
+    def test_legal_mask_first_trick(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        starting_card = hearts.Card(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                                    hearts.card_ranks)
+        t = hearts.Trick(1, starting_card, hearts.card_suits, hearts.card_ranks)
+        hand = starting_card.bit | e.bit("3", hearts.clubs_suit) | e.bit("5", hearts.hearts_suit)
+        self.assertEqual(starting_card.bit, t.legal_mask(hand))
+        t.add(hearts.Player("Test Player 1"), starting_card)
+        p = hearts.Player("Test Player 2")
+        self.assertEqual(e.bit("3", hearts.clubs_suit), t.legal_mask(hand ^ starting_card.bit))
+        void = e.bit("Q", hearts.spades_suit) | e.bit("5", hearts.hearts_suit) | e.bit("2", hearts.diamonds_suit)
+        self.assertEqual(e.bit("2", hearts.diamonds_suit), t.legal_mask(void))
+        only_points = e.bit("Q", hearts.spades_suit) | e.bit("5", hearts.hearts_suit)
+        self.assertEqual(only_points, t.legal_mask(only_points))
+        t.add(p, e.cards[e.index("2", hearts.diamonds_suit)])
+        self.assertEqual(e.suit_mask(hearts.clubs_suit), p.excluded)
+        self.assertFalse(t.hearts_broken)
+
+    def test_legal_mask_hearts_broken(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        hand = e.bit("5", hearts.hearts_suit) | e.bit("2", hearts.diamonds_suit)
+        t = hearts.Trick(2, test_starting_card, hearts.card_suits, hearts.card_ranks)
+        self.assertEqual(e.bit("2", hearts.diamonds_suit), t.legal_mask(hand))
+        self.assertEqual(e.bit("5", hearts.hearts_suit), t.legal_mask(e.bit("5", hearts.hearts_suit)))
+        t.add(hearts.Player("Test Player 1"), e.cards[e.index("3", hearts.spades_suit)])
+        t.add(hearts.Player("Test Player 2"), e.cards[e.index("4", hearts.hearts_suit)])
+        self.assertTrue(t.hearts_broken)
+        self.assertEqual(hand, hearts.Trick(3, test_starting_card, hearts.card_suits, hearts.card_ranks,
+                                            t.hearts_broken).legal_mask(hand))
+
+    def test_winning_card_incremental(self):
+        t = hearts.Trick(1, test_starting_card, test_card_suits, test_card_ranks)
+        p1 = hearts.Player("Test Player 1")
+        p2 = hearts.Player("Test Player 2")
+        self.assertIsNone(t.winning_card())
+        self.assertIsNone(t.winning_player())
+        t.add(p1, hearts.Card("Rank 2", "Suit B", test_card_suits, test_card_ranks))
+        self.assertEqual(p1, t.winning_player())
+        t.add(p2, hearts.Card("Rank 1", "Suit B", test_card_suits, test_card_ranks))
+        self.assertEqual(p1, t.winning_player())
+        t.add(hearts.Player("Test Player 3"), hearts.Card("Rank 4", "Suit A", test_card_suits, test_card_ranks))
+        self.assertEqual(p1, t.winning_player())
+        self.assertEqual(0, t.points())
+        self.assertEqual([], t.point_cards())
+
 
 class TestPlayer(unittest.TestCase):
     def test_init(self):
@@ -131,6 +385,8 @@ class TestPlayer(unittest.TestCase):
         self.assertTrue(len(p.cards) == 1)
         self.assertTrue(sum(c1.rank == c2.rank and c1.suit == c2.suit for c2 in p.cards) == 1)
         self.assertTrue(sum(c1.rank != c2.rank or c1.suit != c2.suit for c2 in p.cards) == 0)
+        with self.assertRaises(TypeError):
+            p.cards[0] = c1
 
     def test_receive_cards(self):
         p = hearts.Player("Test Player 1")
@@ -242,6 +498,19 @@ class TestPlayer(unittest.TestCase):
         self.assertFalse(p1.has_card(trick.cards_by_player[(1, p1)]))
         self.assertEqual(1, len(trick.cards_by_player))
 
+    def test_play_illegal(self):
+        p1 = hearts.Player("Test Player 1")
+        c1 = hearts.Card("Rank 2", "Suit B", test_card_suits, test_card_ranks)
+        c2 = hearts.Card("Rank 4", "Suit C", test_card_suits, test_card_ranks)
+        p1.receive_cards([c1, c2])
+        trick = hearts.Trick(2, test_starting_card, test_card_suits, test_card_ranks)
+        trick.add(hearts.Player("Test Player 2"), hearts.Card("Rank 1", "Suit B", test_card_suits, test_card_ranks))
+        self.assertEqual([c1], p1.legal_cards(trick))
+        self.assertEqual(1, p1.suit_count("Suit C"))
+        with self.assertRaises(ValueError):
+            p1.play(trick, c2)
+        self.assertTrue(p1.has_card(c2))
+
 
 class TestUtils(unittest.TestCase):
     def test_sort_player_cards(self):
@@ -257,8 +526,8 @@ class TestUtils(unittest.TestCase):
         p2.receive_cards([c4, c5, c6])
         players = [p1, p2]
         hearts.Utils.sort_player_cards(players, test_card_suits, test_card_ranks)
-        self.assertEqual([c3, c1, c2], p1.cards)
-        self.assertEqual([c6, c4, c5], p2.cards)
+        self.assertEqual((c3, c1, c2), p1.cards)
+        self.assertEqual((c6, c4, c5), p2.cards)
 
     def test_card_sort_by_suit(self):
         c = hearts.Card("Rank 2", "Suit C", test_card_suits, test_card_ranks)
@@ -268,15 +537,26 @@ class TestUtils(unittest.TestCase):
         c = hearts.Card("Rank 1", "Suit B", test_card_suits, test_card_ranks)
         self.assertEqual(0, hearts.Utils.card_sort_by_rank(c, test_card_ranks))
 
+    def test_standard_rules(self):
+        self.assertEqual(["Left / Clockwise", "Right / Counter-Clockwise", "Across", "None / Keep"],
+                         [hearts.Utils.get_three_card_pass_type_description(h) for h in range(1, 5)])
+        self.assertEqual((0, 26), (hearts.Utils.get_points_for([], False), hearts.Utils.get_points_for([], True)))
+        self.assertFalse(hearts.Utils.shot_the_moon({}))
+        players = [hearts.Player(n) for n in test_player_names]
+        [p.add_points(points, 1) for p, points in zip(players, [26, 0, 26, 26])]
+        self.assertIs(players[1], hearts.Utils.get_hand_winner(players, 1, True))
+        self.assertEqual(hearts.Rules.of().end_score, hearts.max_points)
+
     def test_ordinal_1(self):
         self.assertEqual("1st", hearts.Utils.ordinal(1))
         self.assertEqual("2nd", hearts.Utils.ordinal(2))
         self.assertEqual("3rd", hearts.Utils.ordinal(3))
         self.assertEqual("4th", hearts.Utils.ordinal(4))
+        self.assertEqual("6th", hearts.Utils.ordinal(6))
 
     def test_ordinal_2(self):
         with self.assertRaises(ValueError):
-            hearts.Utils.ordinal(5)
+            hearts.Utils.ordinal(7)
 
     def test_ordinal_3(self):
         with self.assertRaises(ValueError):
@@ -343,3 +623,1053 @@ class TestGame(unittest.TestCase):
         self.assertEqual(4, len([k for k in card_passes.keys() for p in g.players if p == k[1]]))
         self.assertTrue(all(len(cards) == 3 for (_, __), cards in card_passes.items()))
         self.assertEqual(player_count, len(card_passes))
+
+    def test_seeded_replay(self):
+        def play(seed):
+            game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                               hearts.card_ranks, seed)
+            random.seed(seed)
+            winner = game.play(hearts.player_names)
+            random.random()
+            return winner.name, game.history
+
+        self.assertEqual(play(5), play(5))
+        self.assertNotEqual(play(5)[1], play(6)[1])
+
+    def test_sinks(self):
+        def play(sink):
+            game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                               hearts.card_ranks, 3)
+            return game.play(hearts.player_names, sink=sink).name, game.history
+
+        class CountingStream(io.StringIO):
+            writes = 0
+
+            def write(self, text):
+                self.writes += 1
+                return super().write(text)
+
+        stream = CountingStream()
+        log = io.StringIO()
+        winner, history = play(None)
+        self.assertEqual((winner, history), play(hearts.ConsoleSink(stream)))
+        self.assertEqual((winner, history), play(hearts.JsonLinesSink(log)))
+        text = stream.getvalue()
+        self.assertTrue(text.startswith("\nWelcome to Hearts!\n\nHand 1\n"))
+        self.assertTrue(text.endswith(f"\n{winner} won the game!\n"))
+        self.assertEqual(len(history) + 1, stream.writes)
+        events = [json.loads(line) for line in log.getvalue().splitlines()]
+        self.assertEqual('game_started', events[0]['event'])
+        self.assertEqual({'event': 'game_over', 'hand': len(history) + 1, 'winner': winner}, events[-1])
+        self.assertEqual(13 * len(history), sum(e['event'] == 'trick_played' for e in events))
+        self.assertEqual(13, len(next(e for e in events if e['event'] == 'hand_dealt')['hands'][winner]))
+
+    def test_steps(self):
+        def new_game():
+            game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                               hearts.card_ranks, 4)
+            game.add_players(hearts.player_names)
+            return game
+
+        played = new_game()
+        winner = played.play_seated()
+        game = new_game()
+        steps = game.steps()
+        kinds = []
+        with self.assertRaises(StopIteration) as stop:
+            decision = next(steps)
+            while True:
+                kinds.append(decision.kind)
+                self.assertTrue(decision.legal_mask())
+                decision = steps.send(decision.choose())
+        self.assertEqual(winner.name, stop.exception.value.name)
+        self.assertEqual(played.history, game.history)
+        hands = len(game.history)
+        self.assertEqual((4 * (hands - hands // 4), 51 * hands), (kinds.count("pass"), kinds.count("play")))
+        self.assertEqual("over", game.phase)
+
+    def test_decision_check(self):
+        game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                           hearts.card_ranks, 4)
+        game.add_players(hearts.player_names)
+        steps = game.steps()
+        decision = next(steps)
+        self.assertEqual("pass", decision.kind)
+        cards = decision.player.cards
+        [self.assertRaises(ValueError, decision.check, move) for move in
+         (cards[:2], [cards[0]] * 3, game.players[1].cards[:3])]
+        decision = steps.send(decision.check(cards[:3]))
+        while decision.kind == "pass":
+            decision = steps.send(decision.choose())
+        engine = decision.player.engine
+        illegal = decision.player.mask & ~decision.legal_mask() or engine.full_mask & ~decision.player.mask
+        self.assertRaises(ValueError, decision.check, engine.cards[hearts.CardEngine.highest(illegal)])
+
+    def test_snapshot_restore(self):
+        game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                           hearts.card_ranks, 6)
+        game.add_players(hearts.player_names)
+        steps = game.steps()
+        decision = next(steps)
+        while game.hand < 2 or game.phase != "play" or len(game.tricks_by_player) < 2 or not game.trick.mask:
+            decision = steps.send(decision.choose())
+        snapshot = game.snapshot()
+
+        def finish(steps, decision):
+            try:
+                while True:
+                    decision = steps.send(decision.choose())
+            except StopIteration as stop:
+                return stop.value.name, game.history, [p.total_points() for p in game.players]
+
+        result = finish(steps, decision)
+        game.restore(snapshot)
+        self.assertEqual(snapshot, game.snapshot())
+        steps = game.steps()
+        decision = next(steps)
+        self.assertEqual(game.trick.mask, sum(c.bit for c in game.trick.cards_by_player.values()))
+        self.assertEqual(result, finish(steps, decision))
+
+    def test_interleaved_steps(self):
+        games = [hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                             hearts.card_ranks, seed) for seed in range(3)]
+        [game.add_players(hearts.player_names) for game in games]
+        running = {game: game.steps() for game in games}
+        decisions = {game: next(steps) for game, steps in running.items()}
+        while decisions:
+            for game in list(decisions):
+                try:
+                    decisions[game] = running[game].send(decisions[game].choose())
+                except StopIteration:
+                    del decisions[game]
+        for seed, game in enumerate(games):
+            alone = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                                hearts.card_ranks, seed)
+            alone.add_players(hearts.player_names)
+            alone.play_seated()
+            self.assertEqual(alone.history, game.history)
+
+
+class TestSimulation(unittest.TestCase):
+    def test_simulate(self):
+        stats = simulation.simulate(4, seed=1, workers=1)
+        self.assertEqual(4, stats.games)
+        self.assertEqual(4, sum(stats.wins.values()))
+        self.assertTrue(all(name in hearts.player_names for name in stats.points))
+        self.assertTrue(stats.hands >= 4 * 4)
+
+    def test_simulate_deterministic(self):
+        self.assertEqual(simulation.simulate(6, seed=7, workers=1).encode(),
+                         simulation.simulate(6, seed=7, workers=2).encode())
+
+    def test_chunk(self):
+        self.assertEqual([(0, 3), (3, 3), (6, 2), (8, 2)], list(simulation.chunk(10, 4)))
+        self.assertEqual([(0, 1), (1, 1)], list(simulation.chunk(2, 4)))
+
+
+class TestTournament(unittest.TestCase):
+    def test_parse_entrant(self):
+        self.assertEqual(("ismcts", {'iterations': 50, 'time_limit': None}),
+                         tournament.parse_entrant("ismcts:iterations=50,time_limit=null"))
+        self.assertEqual(("random", {}), tournament.parse_entrant("random"))
+        self.assertRaises(ValueError, tournament.parse_entrant, "perfect")
+        self.assertRaises(ValueError, tournament.parse_entrant, "ismcts:iterations")
+
+    def test_duplicate_deals(self):
+        lineup = tournament.lineup_of(["passing", "random"])
+        self.assertEqual(["passing", "random", "passing", "random"], lineup)
+        games = [tournament.seat_game(3, "0", lineup[r:] + lineup[:r], r) for r in range(2)]
+        for game in games:
+            game.hand = 1
+            game.deal_hand()
+        self.assertEqual(games[0].dealt, games[1].dealt)
+
+    def test_strategies_closed(self):
+        with patch.object(hearts.Strategy, "close") as close:
+            tournament.play_deal(0, "0", tournament.lineup_of(["random"]))
+        self.assertEqual(16, close.call_count)
+
+    def test_run_and_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "results.jsonl")
+            results = tournament.run(path, ["passing", "random"], 3, seed=1, workers=1, chunk_size=2)
+            self.assertEqual([0, 1, 2], sorted(r['deal'] for r in results))
+            self.assertTrue(all(len(r['games']) == 4 for r in results))
+            with open(path, "a") as file:
+                file.write('{"deal": 3, "ga')
+            resumed = tournament.run(path, ["passing", "random"], 5, seed=1, workers=2, chunk_size=1)
+            self.assertEqual([0, 1, 2, 3, 4], sorted(r['deal'] for r in resumed))
+            self.assertEqual(results[:3], resumed[:3])
+            self.assertEqual(resumed, tournament.read_results(path)[1])
+            self.assertEqual(tournament.play_deal(4, "1", tournament.lineup_of(["passing", "random"])),
+                             next(r for r in resumed if r['deal'] == 4))
+            self.assertRaises(ValueError, tournament.run, path, ["random"], 5, seed=1, workers=1)
+
+    def test_ratings(self):
+        results = [{'deal': d, 'games': [{'lineup': ["a", "b", "c", "d"], 'points': [10, 35 if d % 4 else 20, 30, 40]}]}
+                   for d in range(40)]
+        table = tournament.ratings(results, groups=10)
+        self.assertEqual(["a", "c", "b", "d"], sorted(table, key=lambda e: -table[e]['rating']))
+        self.assertAlmostEqual(1500, sum(r['rating'] for r in table.values()) / 4)
+        self.assertTrue(all(r['low'] < r['rating'] < r['high'] for r in (table["b"], table["c"])))
+        self.assertEqual((40, 31.25), (table["b"]['games'], table["b"]['average_points']))
+
+
+@unittest.skipIf(montecarlo.np is None, "numpy is not installed")
+class TestHandBatch(unittest.TestCase):
+    def test_deal(self):
+        b = montecarlo.HandBatch(50, hand=4, seed=1)
+        self.assertEqual((50, 52), b.permutations.shape)
+        self.assertTrue((b.dealt_hands.sum(axis=1) == 1).all())
+        self.assertTrue((b.dealt_hands.sum(axis=2) == 13).all())
+        self.assertTrue((b.dealt_hands == b.hands).all())
+
+    def test_pass_three_cards(self):
+        b = montecarlo.HandBatch(50, hand=1, seed=2)
+        self.assertTrue((b.hands.sum(axis=2) == 13).all())
+        self.assertTrue((b.hands.sum(axis=1) == 1).all())
+        self.assertTrue(((b.dealt_hands & ~b.hands).sum(axis=2) == 3).all())
+        received = b.hands & ~b.dealt_hands
+        self.assertTrue((received[:, 1] == (b.dealt_hands[:, 0] & ~b.hands[:, 0])).all())
+
+    def test_first_players(self):
+        b = montecarlo.HandBatch(50, hand=2, seed=3)
+        self.assertTrue(b.hands[b.rows, b.first_players, b.starting_index].all())
+
+    def test_play(self):
+        b = montecarlo.HandBatch(200, hand=3, seed=4)
+        totals = b.play().sum(axis=1)
+        self.assertTrue(((totals == 26) | (totals == 78)).all())
+        self.assertTrue(0.0 <= b.queen_of_spades_holder_rate() <= 1.0)
+
+    def test_rules(self):
+        rules = hearts.Rules.of(player_count=3)
+        b = montecarlo.HandBatch(100, hand=2, seed=5, rules=rules)
+        self.assertTrue((b.dealt_hands.sum(axis=2) == 17).all())
+        self.assertFalse(b.dealt_hands[:, :, hearts.CardEngine.highest(rules.removed_mask)].any())
+        received = b.hands & ~b.dealt_hands
+        self.assertTrue((received[:, 2] == (b.dealt_hands[:, 0] & ~b.hands[:, 0])).all())
+        self.assertTrue(b.hands[b.rows, b.first_players, rules.starting_card.index].all())
+        totals = b.play().sum(axis=1)
+        self.assertTrue(((totals == 26) | (totals == 52)).all())
+
+    def test_spawn_generators(self):
+        first, second = montecarlo.spawn_generators(7, 2)
+        batch = montecarlo.shuffle_batch(10, 52, first)
+        self.assertTrue((montecarlo.shuffle_batch(10, 52, montecarlo.spawn_generators(7, 2)[0]) == batch).all())
+        self.assertFalse((montecarlo.shuffle_batch(10, 52, second) == batch).all())
+        self.assertTrue((montecarlo.np.sort(batch, axis=1) == montecarlo.np.arange(52)).all())
+
+
+class TestResultCache(unittest.TestCase):
+    def test_get(self):
+        results = cache.ResultCache(max_entries=2)
+        self.assertEqual(1, results.get("a", 1, lambda: 1))
+        self.assertEqual(1, results.get("a", 1, lambda: 2))
+        results.get("b", 1, lambda: 3)
+        results.get("b", 2, lambda: 4)
+        self.assertEqual(5, results.get("a", 1, lambda: 5))
+        self.assertEqual(2, len(results.entries))
+        self.assertEqual({'a': {'hits': 1, 'misses': 2}, 'b': {'hits': 0, 'misses': 2}}, results.stats())
+        results.clear()
+        self.assertEqual({}, results.stats())
+
+    def test_canonical(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        clubs, diamonds = e.suit_mask(hearts.clubs_suit), e.suit_mask(hearts.diamonds_suit)
+        rng = random.Random(4)
+        cards = rng.sample(range(52), 20)
+        hands = [sum(1 << i for i in cards[s::4]) for s in range(4)]
+        swapped = [(m & clubs) << 13 | (m & diamonds) >> 13 | m & ~clubs & ~diamonds for m in hands]
+        canonical, mapping = e.canonical(hands)
+        self.assertEqual(canonical, e.canonical(swapped)[0])
+        self.assertEqual(hands, [e.permute(m, e.inverse(mapping)) for m in canonical])
+        self.assertEqual((canonical, None), e.canonical(canonical))
+        ace, five = e.index("A", hearts.spades_suit), e.index("5", hearts.clubs_suit)
+        self.assertEqual(ace, e.permute_index(ace, [1, 0, 2, 3]))
+        self.assertEqual(e.index("5", hearts.diamonds_suit), e.permute_index(five, [1, 0, 2, 3]))
+
+    def test_shared_solves(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        clubs, diamonds = e.suit_mask(hearts.clubs_suit), e.suit_mask(hearts.diamonds_suit)
+        rng = random.Random(5)
+        cards = rng.sample(range(52), 16)
+        hands = [sum(1 << i for i in cards[s::4]) for s in range(4)]
+        swapped = [(m & clubs) << 13 | (m & diamonds) >> 13 | m & ~clubs & ~diamonds for m in hands]
+        results = cache.ResultCache()
+        values = solver.Solver(results=results).move_values(hands, 0)
+        swapped_values = solver.Solver(results=results).move_values(swapped, 0)
+        self.assertEqual(solver.Solver(results=None).move_values(swapped, 0), swapped_values)
+        self.assertEqual(sorted(values.values()), sorted(swapped_values.values()))
+        self.assertEqual({'move_values': {'hits': 1, 'misses': 1}}, results.stats())
+        self.assertEqual(solver.Solver(results=results).solve(hands, 1),
+                         solver.Solver(results=results).solve(swapped, 1))
+        self.assertEqual({'hits': 1, 'misses': 1}, results.stats()['solve'])
+
+
+class TestPassEvaluator(unittest.TestCase):
+    def setUp(self):
+        self.e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+
+    def hand(self, clubs, diamonds, spades, hearts_ranks):
+        return sum(self.e.bit(r, s) for ranks, s in ((clubs, hearts.clubs_suit), (diamonds, hearts.diamonds_suit),
+                                                     (spades, hearts.spades_suit), (hearts_ranks, hearts.hearts_suit))
+                   for r in ranks)
+
+    def test_choose(self):
+        evaluator = hearts.PassEvaluator(self.e)
+        hand = self.hand(["2", "3", "4", "5"], ["2", "3", "4", "6"], ["Q", "3"], ["2", "3", "4"])
+        passed = evaluator.choose(hand)
+        self.assertEqual(3, passed.bit_count())
+        self.assertEqual(passed, passed & hand)
+        self.assertTrue(passed & self.e.queen_of_spades_mask)
+
+    def test_isomorphic_hands(self):
+        results = cache.ResultCache()
+        evaluator = hearts.PassEvaluator(self.e, results)
+        hand = self.hand(["2", "K", "A"], ["3", "4", "5", "6", "7"], ["2", "3"], ["4", "J", "Q"])
+        swapped = self.hand(["3", "4", "5", "6", "7"], ["2", "K", "A"], ["2", "3"], ["4", "J", "Q"])
+        passed = evaluator.choose(hand)
+        clubs, diamonds = self.e.suit_mask(hearts.clubs_suit), self.e.suit_mask(hearts.diamonds_suit)
+        self.assertEqual((passed & clubs) << 13 | (passed & diamonds) >> 13 | passed & ~clubs & ~diamonds,
+                         evaluator.choose(swapped))
+        self.assertEqual({'pass': {'hits': 1, 'misses': 1}}, results.stats())
+
+    def test_play(self):
+        game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks,
+                           1)
+        game.play(hearts.player_names, [hearts.PassingStrategy() for _ in hearts.player_names])
+        self.assertTrue(game.is_over())
+
+
+class TestBeliefState(unittest.TestCase):
+    def test_sample(self):
+        game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks,
+                           4)
+        game.add_players(hearts.player_names)
+        game.hand = 1
+        game.deal_hand()
+        game.pass_hand()
+        rng = random.Random(1)
+        for trick in game.play_tricks():
+            for player in game.players:
+                beliefs = player.beliefs
+                sizes, known, unseen, excluded = beliefs.constraints()
+                actual = [p.mask for p in game.players]
+                self.assertEqual([m.bit_count() for m in actual], sizes)
+                self.assertTrue(all(not m & e for m, e in zip(actual, excluded)))
+                self.assertTrue(all(k & ~m == 0 for m, k in zip(actual, known)))
+                for hands in (beliefs.sample(rng) for _ in range(5)):
+                    self.assertEqual(player.mask, hands[beliefs.seat])
+                    self.assertEqual(sizes, [h.bit_count() for h in hands])
+                    self.assertTrue(all(not h & e for h, e in zip(hands, excluded)))
+                    self.assertEqual(unseen | sum(known) | player.mask, sum(hands))
+            if trick.index == 8:
+                break
+
+    def test_probabilities(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        clubs, spades = e.suit_mask(hearts.clubs_suit), e.suit_mask(hearts.spades_suit)
+        sampler = beliefs.DealSampler([clubs, 0, 0, 0], [0, 13, 13, 13], e.full_mask & ~clubs, [0, 0, spades, 0])
+        table = sampler.probabilities(e.card_count)
+        for i in hearts.CardEngine.indices(e.full_mask & ~clubs):
+            self.assertAlmostEqual(1.0, sum(seat[i] for seat in table))
+        self.assertEqual(0.0, table[2][e.index("A", hearts.spades_suit)])
+        self.assertAlmostEqual(0.5, table[1][e.index("A", hearts.spades_suit)])
+        self.assertEqual([13.0, 13.0, 13.0, 13.0], [round(sum(seat), 9) for seat in table])
+        counts = [0] * 4
+        rng = random.Random(3)
+        for _ in range(2000):
+            hands = sampler.sample(rng)
+            counts[next(s for s in range(4) if hands[s] & e.bit("A", hearts.hearts_suit))] += 1
+        self.assertAlmostEqual(table[1][e.index("A", hearts.hearts_suit)], counts[1] / 2000, delta=0.04)
+
+    def test_no_deal(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        spades = e.suit_mask(hearts.spades_suit)
+        self.assertEqual(0, beliefs.DealSampler([0, 0], [0, 13], spades, [0, spades]).total)
+        with self.assertRaises(ValueError):
+            beliefs.DealSampler.fitting([0, 0], [0, 13], spades, [0, spades])
+
+
+class TestHandState(unittest.TestCase):
+    def setUp(self):
+        self.game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                                hearts.card_ranks, 8)
+        self.game.add_players(hearts.player_names)
+        self.steps = self.game.steps()
+        self.decision = next(self.steps)
+        while self.decision.kind != "play":
+            self.decision = self.steps.send(self.decision.choose())
+
+    @staticmethod
+    def fields(state):
+        return (list(state.hands), list(state.trick), state.leader, state.seat, list(state.points), state.hearts_broken,
+                state.tricks, state.lead_mask, state.winning, state.winner, state.trick_points)
+
+    def test_follows_game(self):
+        game = self.game
+        state = handstate.HandState.of(game)
+        hand = game.hand
+        while game.hand == hand:
+            self.assertEqual(game.players.index(self.decision.player), state.seat)
+            self.assertEqual(self.decision.legal_mask(), state.legal())
+            card = self.decision.choose()
+            state.apply_move(card.index)
+            self.decision = self.steps.send(card)
+        self.assertTrue(state.over())
+        self.assertEqual([p.points(hand) for p in game.players], state.final_points())
+
+    def test_undo(self):
+        state = handstate.HandState.of(self.game)
+        state.apply_move(self.decision.choose().index)
+        start = self.fields(state)
+        rng = random.Random(1)
+        visited = []
+        while not state.over():
+            visited.append(self.fields(state))
+            legal = state.legal()
+            state.apply_move(hearts.CardEngine.nth(legal, rng.randrange(legal.bit_count())))
+        self.assertEqual(26, sum(state.points))
+        while visited:
+            state.undo_move()
+            self.assertEqual(visited.pop(), self.fields(state))
+        self.assertEqual(start, self.fields(state))
+
+    def test_resume(self):
+        game = self.game
+        for _ in range(6):
+            self.decision = self.steps.send(self.decision.choose())
+        state = handstate.HandState.of(game)
+        rng = random.Random(2)
+        for _ in range(7):
+            legal = state.legal()
+            state.apply_move(hearts.CardEngine.nth(legal, rng.randrange(legal.bit_count())))
+        steps, decision = state.resume(game)
+        self.assertEqual(state.hands, [p.mask for p in game.players])
+        self.assertEqual(state.trick, [c.index for c in game.trick.cards_by_player.values()])
+        self.assertEqual(state.seat, game.players.index(decision.player))
+        self.assertEqual(self.fields(state), self.fields(handstate.HandState.of(game)))
+        self.assertRaises(ValueError, handstate.HandState(state.engine, state.hands, 0).resume, game)
+
+    def test_follows_variant_game(self):
+        rules = hearts.Rules.of(player_count=5, jack_of_diamonds=-10, moon="subtract")
+        for seed in range(3):
+            game = hearts.Game.of(rules, seed)
+            game.add_players(rules.player_names)
+            steps = game.steps()
+            decision = next(steps)
+            while decision.kind != "play":
+                decision = steps.send(decision.choose())
+            state = handstate.HandState.of(game)
+            while game.hand == 1:
+                card = decision.choose()
+                state.apply_move(card.index)
+                decision = steps.send(card)
+            self.assertEqual([p.points(1) for p in game.players], state.final_points())
+
+    def test_moon_with_bonus(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        rules = hearts.Rules.of(jack_of_diamonds=-10)
+        jack = e.bit("J", hearts.diamonds_suit)
+        hands = [e.bit(r, hearts.diamonds_suit) for r in ("A", "J", "2", "3")]
+        state = handstate.HandState(e, hands, 0, (), [26, 0, 0, 0], True, 12, 0, rules)
+        [state.apply_move(hearts.CardEngine.highest(hand)) for hand in hands]
+        self.assertEqual([16, 0, 0, 0], state.points)
+        self.assertEqual([-10, 26, 26, 26], state.final_points())
+        [state.undo_move() for _ in hands]
+        self.assertEqual(([26, 0, 0, 0], hands), (state.points, state.hands))
+        hands = [e.bit(r, hearts.clubs_suit) for r in ("A", "2", "3", "4")]
+        for bonuses, points in (([jack, 0, 0, 0], [-10, 26, 26, 26]), (None, [16, 0, 0, 0])):
+            state = handstate.HandState(e, hands, 0, (), [16, 0, 0, 0], True, 12, 0, rules, bonuses)
+            [state.apply_move(hearts.CardEngine.highest(hand)) for hand in hands]
+            self.assertEqual(points, state.final_points())
+
+
+class TestISMCTS(unittest.TestCase):
+    def test_sample(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        hand = e.suit_mask(hearts.clubs_suit)
+        known = [0, e.bit("A", hearts.hearts_suit), 0, 0]
+        voids = [0, 0, e.suit_mask(hearts.spades_suit), 0]
+        unseen = e.full_mask & ~hand & ~known[1]
+        position = ai.Position(hearts.card_suits, hearts.card_ranks, 0, hand, [13, 13, 13, 13], voids, known,
+                               unseen, [0, 0, 0, 0], [])
+        for seed in range(10):
+            hands = position.sample(random.Random(seed))
+            self.assertEqual(hand, hands[0])
+            self.assertTrue(hands[1] & known[1])
+            self.assertFalse(hands[2] & voids[2])
+            self.assertEqual([13, 13, 13, 13], [h.bit_count() for h in hands])
+            self.assertEqual(e.full_mask, hands[0] | hands[1] | hands[2] | hands[3])
+
+    def test_search(self):
+        e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        hand = e.bit("2", hearts.hearts_suit) | e.bit("A", hearts.hearts_suit)
+        trick = [(1, e.index("K", hearts.hearts_suit))]
+        unseen = sum(e.bit(r, hearts.hearts_suit) for r in ["3", "4", "5", "6", "7"])
+        position = ai.Position(hearts.card_suits, hearts.card_ranks, 2, hand, [2, 1, 2, 2], [0, 0, 0, 0],
+                               [0, 0, 0, 0], unseen, [0, 0, 0, 0], trick)
+        stats = ai.search(position, iterations=50, seed=1)
+        self.assertEqual({e.index("2", hearts.hearts_suit), e.index("A", hearts.hearts_suit)}, set(stats))
+
+    def test_play(self):
+        game = hearts.Game.of(hearts.Rules.of(), 1)
+        game.add_players(hearts.player_names, [ai.ISMCTSStrategy(iterations=5, time_limit=None, seed=1)])
+        game.hand = 1
+        game.deal_hand()
+        game.pass_hand()
+        tricks = list(game.play_tricks())
+        self.assertEqual(13, len(tricks))
+        self.assertEqual(26, sum(t.points() for t in tricks))
+        self.assertTrue(all(not p.has_cards() for p in game.players))
+
+    def test_workers(self):
+        game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks,
+                           3)
+        strategy = ai.ISMCTSStrategy(iterations=5, time_limit=None, workers=2, seed=1)
+        game.add_players(hearts.player_names, [strategy])
+        game.hand = 1
+        game.deal_hand()
+        pool = strategy.pool
+        self.assertEqual(1, pool.workers)
+        game.pass_hand()
+        self.assertEqual(13, len(list(game.play_tricks())))
+        self.assertGreater(pool.stats()['completed'], 0)
+        strategy.close()
+        self.assertIsNone(strategy.pool)
+        self.assertTrue(pool.closed)
+
+    def test_endgame(self):
+        game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks,
+                           2)
+        strategy = ai.ISMCTSStrategy(iterations=5, time_limit=None, seed=1, endgame=3, samples=3)
+        game.add_players(hearts.player_names, [strategy])
+        game.hand = 1
+        game.deal_hand()
+        game.pass_hand()
+        self.assertEqual(13, len(list(game.play_tricks())))
+        self.assertIsNotNone(strategy.solver)
+
+
+class TestRollouts(unittest.TestCase):
+    def setUp(self):
+        e = self.e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+        hand = e.bit("2", hearts.hearts_suit) | e.bit("A", hearts.hearts_suit)
+        trick = [(1, e.index("K", hearts.hearts_suit))]
+        unseen = sum(e.bit(r, hearts.hearts_suit) for r in ["3", "4", "5", "6"])
+        self.position = ai.Position(hearts.card_suits, hearts.card_ranks, 2, hand, [2, 1, 2, 2], [0, 0, 1, 0],
+                                    [0, 0, 0, e.bit("8", hearts.hearts_suit)], unseen, [0, 13, 0, 5], trick)
+
+    def test_slots(self):
+        states = rollouts.multiprocessing.RawArray('q', 3 * rollouts.slot_width)
+        rollouts.write_position(states, 1, self.position)
+        read = rollouts.read_position(states, 1, hearts.Rules.of())
+
+        def fields(position):
+            return {k: tuple(v) if isinstance(v, (list, tuple)) else v for k, v in position.__dict__.items()}
+
+        self.assertEqual(fields(self.position), fields(read))
+        self.assertEqual([0] * rollouts.slot_width, list(states[:rollouts.slot_width]))
+
+    def test_cheap_move(self):
+        self.assertEqual(self.e.index("2", hearts.hearts_suit), ai.cheap_move(self.position))
+        lead = ai.Position(hearts.card_suits, hearts.card_ranks, 0, self.e.bit("5", hearts.clubs_suit) |
+                           self.e.bit("3", hearts.spades_suit), [2, 2, 2, 2], [0] * 4, [0] * 4, 0, [0] * 4, [])
+        self.assertEqual(self.e.index("3", hearts.spades_suit), ai.cheap_move(lead))
+
+    def test_executor(self):
+        executor = rollouts.RolloutExecutor(1, max_pending=2)
+        try:
+            stats = executor.submit(self.position, iterations=50, seed=1).result()
+            self.assertEqual(stats, ai.search(self.position, iterations=50, seed=1))
+            running = executor.submit(self.position, iterations=10 ** 9)
+            queued = executor.submit(self.position, iterations=10 ** 9)
+            self.assertEqual("degraded", executor.submit(self.position, iterations=1).status)
+            queued.cancel()
+            while executor.stats()['running'] == 0: time.sleep(0.01)
+            running.cancel()
+            self.assertEqual((None, None), (running.result(5), queued.result()))
+            self.assertEqual(("cancelled", "cancelled"), (running.status, queued.status))
+            stats = executor.stats()
+            self.assertEqual((1, 2, 1, 0),
+                             (stats['completed'], stats['cancelled'], stats['degraded'], stats['queue_depth']))
+            self.assertGreater(stats['utilization'], 0)
+            strategies = [ai.ISMCTSStrategy(iterations=5, time_limit=None, seed=i, rollouts=executor) for i in range(4)]
+            game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                               hearts.card_ranks, 1)
+            game.add_players(hearts.player_names, strategies)
+            steps = game.steps()
+            decision = next(steps)
+            while game.hand == 1:
+                decision = steps.send(decision.choose())
+            self.assertEqual(26, sum(p.points(1) for p in game.players) % 52)
+        finally:
+            executor.close()
+        self.assertEqual("degraded", executor.submit(self.position, iterations=1).status)
+
+
+class TestSolver(unittest.TestCase):
+    def setUp(self):
+        self.e = hearts.CardEngine.of(hearts.card_suits, hearts.card_ranks)
+
+    def cards(self, *cards):
+        return sum(self.e.bit(rank, suit) for rank, suit in cards)
+
+    def test_solve(self):
+        h = hearts.hearts_suit
+        hands = [self.cards(("2", h), ("A", h)), self.cards(("3", h), ("4", h)), self.cards(("5", h), ("6", h)),
+                 self.cards(("7", h), ("8", h))]
+        self.assertEqual(4, solver.Solver().solve(hands, 0))
+        self.assertEqual(0, solver.Solver().solve(hands, 0, target=1))
+        self.assertEqual(4, solver.Solver().solve(hands, 1, target=3))
+
+    def test_best_move(self):
+        s = hearts.spades_suit
+        hands = [self.cards(("K", s), ("2", s)), self.cards(("Q", s), ("3", s)), self.cards(("4", s), ("5", s)),
+                 self.cards(("6", s), ("7", s))]
+        trick = [(1, self.e.index("Q", s))]
+        hands[1] ^= self.e.bit("Q", s)
+        values = solver.Solver().move_values(hands, 2, trick)
+        self.assertEqual({self.e.index("4", s), self.e.index("5", s)}, set(values))
+        move, points = solver.Solver().best_move(hands, 0, trick + [(2, self.e.index("4", s)),
+                                                                   (3, self.e.index("6", s))])
+        self.assertEqual((self.e.index("2", s), 0), (move, points))
+
+    def test_transposition_table_bound(self):
+        rng = random.Random(1)
+        cards = list(range(self.e.card_count))
+        rng.shuffle(cards)
+        hands = [sum(1 << i for i in cards[s * 5:(s + 1) * 5]) for s in range(4)]
+        bounded = solver.Solver(max_entries=16, results=None)
+        self.assertEqual(solver.Solver().solve(hands, 0), bounded.solve(hands, 0))
+        self.assertLessEqual(len(bounded.table), 16)
+
+    def test_six_card_endgame(self):
+        rng = random.Random(2)
+        cards = list(range(self.e.card_count))
+        rng.shuffle(cards)
+        hands = [sum(1 << i for i in cards[s * 6:(s + 1) * 6]) for s in range(4)]
+        started = time.perf_counter()
+        points = solver.Solver().solve(hands, 0)
+        self.assertLess(time.perf_counter() - started, 2)
+        self.assertLessEqual(points, self.e.points(sum(hands)))
+
+    def test_endgame_analysis(self):
+        game = hearts.Game.of(hearts.Rules.of(), 1)
+        game.play(hearts.player_names)
+        record = records.GameRecord.decode(records.encode_game(game)[records.length_format.size:])
+        rows = list(solver.endgame_analysis(record, tricks=3))
+        self.assertEqual(4 * len(record.hands), len(rows))
+        self.assertTrue(all(0 <= optimal <= 26 and 0 <= actual <= 26 for _, _, optimal, actual in rows))
+
+
+class TestTables(unittest.TestCase):
+    def setUp(self):
+        server.app.testing = True
+        self.client = server.app.test_client()
+
+    def test_play_hand(self):
+        table = self.client.post('/tables', json={'bots': 3}).get_json()
+        self.assertEqual('waiting', table['phase'])
+        state = self.client.post(f"/tables/{table['id']}/join", json={'name': 'Test Player 1'}).get_json()
+        self.assertEqual('passing', state['phase'])
+        self.assertEqual(13, len(state['cards']))
+        cards = [c['index'] for c in state['cards'][:3]]
+        state = self.client.post(f"/tables/{table['id']}/pass",
+                                 json={'name': 'Test Player 1', 'cards': cards}).get_json()
+        self.assertEqual('playing', state['phase'])
+        while state['hand'] == 1:
+            self.assertEqual('Test Player 1', state['next_player'])
+            illegal = next((c['index'] for c in state['cards'] if c['index'] not in state['legal']), None)
+            if illegal is not None:
+                response = self.client.post(f"/tables/{table['id']}/play",
+                                            json={'name': 'Test Player 1', 'card': illegal})
+                self.assertEqual(400, response.status_code)
+            state = self.client.post(f"/tables/{table['id']}/play",
+                                     json={'name': 'Test Player 1', 'card': state['legal'][0]}).get_json()
+        self.assertEqual(26, sum(p['total_points'] for p in state['players']) % 52)
+        self.assertEqual(state, self.client.get(f"/tables/{table['id']}?name=Test Player 1").get_json())
+
+    def test_variant_rules(self):
+        rules = {'player_count': 3, 'moon': "subtract"}
+        table = self.client.post('/tables', json={'bots': 2, 'rules': rules}).get_json()
+        self.assertEqual(3, table['rules']['player_count'])
+        self.assertEqual("subtract", table['rules']['moon'])
+        state = self.client.post(f"/tables/{table['id']}/join", json={'name': 'Test Player 1'}).get_json()
+        self.assertEqual(17, len(state['cards']))
+        self.assertEqual(3, len(state['players']))
+        for body in ({'rules': {'player_count': 8}}, {'rules': {'moon': 1}}, {'bots': 3, 'rules': {'player_count': 3}},
+                     {'bots': 4}):
+            self.assertEqual(400, self.client.post('/tables', json=body).status_code)
+
+    def test_passes_in_any_order(self):
+        table = server.Table("table-1", seed=2)
+        [table.join(name) for name in ("Test Player 1", "Test Player 2")]
+        [table.join(name, hearts.PassingStrategy()) for name in ("Bot 1", "Bot 2")]
+        self.assertEqual(["Test Player 1", "Test Player 2"], [p.name for p in table.pending_passes()])
+        second = table.player("Test Player 2")
+        table.pass_cards("Test Player 2", [c.index for c in second.cards[:3]])
+        self.assertRaises(ValueError, table.pass_cards, "Test Player 2", [c.index for c in second.cards[3:6]])
+        self.assertEqual("passing", table.phase)
+        first = table.player("Test Player 1")
+        table.pass_cards("Test Player 1", [c.index for c in first.cards[-3:]])
+        self.assertEqual("playing", table.phase)
+        self.assertEqual(13, second.mask.bit_count())
+        self.assertIn(table.next_player().name, ("Test Player 1", "Test Player 2"))
+
+    def test_errors(self):
+        self.assertEqual(404, self.client.get('/tables/missing').status_code)
+        table = self.client.post('/tables', json={'bots': 3}).get_json()
+        self.client.post(f"/tables/{table['id']}/join", json={'name': 'Test Player 1'})
+        response = self.client.post(f"/tables/{table['id']}/play", json={'name': 'Test Player 1', 'card': 0})
+        self.assertEqual(400, response.status_code)
+        response = self.client.post(f"/tables/{table['id']}/join", json={'name': 'Test Player 2'})
+        self.assertEqual(400, response.status_code)
+
+    def test_malformed_bodies(self):
+        table = self.client.post('/tables', json={'bots': 3}).get_json()
+        self.assertEqual(201, self.client.post('/tables').status_code)
+        for path, body in (('/tables', [1]), ('/tables', {'bots': "3"}), (f"/tables/{table['id']}/join", []),
+                           (f"/tables/{table['id']}/join", {'name': [1]}),
+                           (f"/tables/{table['id']}/pass", {'name': 'Test Player 1', 'cards': 5}),
+                           (f"/tables/{table['id']}/pass", {'name': 'Test Player 1', 'cards': [[1]]}),
+                           (f"/tables/{table['id']}/play", {'name': 'Test Player 1', 'card': "1"}),
+                           (f"/tables/{table['id']}/play", "card")):
+            response = self.client.post(path, json=body)
+            self.assertEqual(400, response.status_code)
+            self.assertIn('error', response.get_json())
+
+
+class TestTableStore(unittest.TestCase):
+    def test_evict_idle(self):
+        store = server.TableStore(idle_timeout=10)
+        table = store.create()
+        self.assertIs(table, store.get(table.id))
+        table.last_access -= 20
+        self.assertIsNone(store.get(table.id))
+
+    def test_max_tables(self):
+        store = server.TableStore(max_tables=1)
+        store.create()
+        with self.assertRaises(server.StoreFullError):
+            store.create()
+
+    # Passes and plays the highest legal card for every person at the table, the last to pass first, until done(table).
+    def play_people(self, table, done):
+        while table.phase != "over" and not done(table):
+            if table.phase == "passing":
+                player = table.pending_passes()[-1]
+                table.pass_cards(player.name, [c.index for c in player.cards[:3]])
+            else:
+                table.play_card(table.next_player().name, hearts.CardEngine.highest(table.decision.legal_mask()))
+
+    def test_restore(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hearts.db")
+            game_store = storage.GameStore(storage.SQLiteBackend(path), interval=0.001)
+            table = server.TableStore(store=game_store).create(seed=3)
+            [table.join(name, hearts.PassingStrategy()) for name in ("Bot 1", "Bot 2")]
+            [table.join(name) for name in ("Test Player 1", "Test Player 2")]
+            self.play_people(table, lambda t: t.game.hand == 2 and t.phase == "playing" and t.game.trick.index == 4)
+            game_store.flush()
+            store = server.TableStore(store=storage.GameStore(storage.SQLiteBackend(path), interval=0.001))
+            self.assertEqual(1, store.restore())
+            restored = store.get(table.id)
+            [self.assertEqual(table.encode(name), restored.encode(name)) for name in ("Test Player 1", "Test Player 2")]
+            self.assertEqual(table.moves, restored.moves)
+            self.assertEqual([[p.points(1) for p in table.game.players]], game_store.backend.hands(table.id))
+            self.play_people(restored, lambda t: False)
+            store.store.close()
+            game_store.close()
+            store = server.TableStore(store=storage.GameStore(storage.SQLiteBackend(path)))
+            self.assertEqual(0, store.restore())
+            self.assertEqual(restored.game.hand - 1, len(store.store.backend.hands(table.id)))
+            store.store.close()
+
+    def test_restore_passes_held(self):
+        game_store = storage.GameStore(storage.SQLiteBackend(), interval=0.001)
+        table = server.TableStore(store=game_store).create(seed=4)
+        [table.join(name) for name in ("Test Player 1", "Test Player 2")]
+        [table.join(name, hearts.RandomStrategy()) for name in ("Bot 1", "Bot 2")]
+        second = table.player("Test Player 2")
+        table.pass_cards(second.name, [c.index for c in second.cards[:3]])
+        game_store.flush()
+        store = server.TableStore(store=game_store)
+        self.assertEqual(1, store.restore())
+        restored = store.get(table.id)
+        self.assertEqual(["Test Player 1"], [p.name for p in restored.pending_passes()])
+        self.assertEqual(table.encode(second.name), restored.encode(second.name))
+        self.assertIsInstance(restored.player("Bot 1").strategy, hearts.RandomStrategy)
+        game_store.backend.write([("move", table.id, table.moves + 1, "move", 3, [0])])
+        self.assertEqual(0, server.TableStore(store=game_store).restore())
+        game_store.close()
+
+    def test_evicted_tables_are_not_restored(self):
+        game_store = storage.GameStore(storage.SQLiteBackend(), interval=0.001)
+        store = server.TableStore(idle_timeout=10, store=game_store)
+        table = store.create()
+        table.last_access -= 20
+        self.assertIsNone(store.get(table.id))
+        game_store.flush()
+        self.assertEqual(0, server.TableStore(store=game_store).restore())
+        game_store.close()
+
+
+class TestGameStore(unittest.TestCase):
+    def test_batches(self):
+        store = storage.GameStore(storage.SQLiteBackend(), max_batch=100, interval=0.01)
+        store.add("table", "table-1", {'player_count': 4}, 2 ** 63, 0.0)
+        [store.add("move", "table-1", seq, "move", seq % 4, [seq % 52]) for seq in range(1, 1000)]
+        self.assertTrue(store.flush(5))
+        self.assertEqual(1000, store.written)
+        self.assertLessEqual(store.batches, 20)
+        (table_id, rules, seed, moves), = store.unfinished()
+        self.assertEqual(("table-1", {'player_count': 4}, 2 ** 63), (table_id, rules, seed))
+        self.assertEqual([("move", seq % 4, [seq % 52]) for seq in range(1, 1000)], moves)
+        store.close()
+        self.assertRaises(ValueError, store.add, "status", "table-1", "over")
+
+    def test_close_writes_queued(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "hearts.db")
+            store = storage.GameStore(storage.SQLiteBackend(path), interval=10)
+            store.add("table", "table-1", {}, 1, 0.0)
+            store.add("hand", "table-1", 1, [26, 0, 0, 0])
+            store.close()
+            backend = storage.SQLiteBackend(path)
+            self.assertEqual([("table-1", {}, 1, [])], backend.unfinished())
+            self.assertEqual([[26, 0, 0, 0]], backend.hands("table-1"))
+            backend.close()
+
+    def test_failed_batch_is_retried(self):
+        backend = storage.SQLiteBackend()
+        write = backend.write
+        failures = []
+
+        def fail_once(records):
+            if not failures:
+                failures.append(records)
+                raise OSError("disk full")
+            write(records)
+
+        backend.write = fail_once
+        store = storage.GameStore(backend, interval=0.001)
+        store.add("table", "table-1", {}, 1, 0.0)
+        self.assertTrue(store.flush(5))
+        self.assertEqual((1, 1), (store.failures, store.written))
+        self.assertEqual(1, len(store.unfinished()))
+        self.assertRaises(ValueError, backend.write, [("unknown",)])
+        store.close()
+
+
+class TestHomePage(unittest.TestCase):
+    def setUp(self):
+        server.app.testing = True
+        self.client = server.app.test_client()
+
+    def test_redirects_to_seed(self):
+        response = self.client.get('/')
+        self.assertEqual(302, response.status_code)
+        self.assertIn('seed=', response.location)
+
+    def test_same_seed_same_page(self):
+        first = self.client.get('/?seed=7')
+        server.pages.pages.clear()
+        second = self.client.get('/?seed=7')
+        self.assertEqual(200, first.status_code)
+        self.assertEqual(first.data, second.data)
+        self.assertEqual(first.headers['ETag'], second.headers['ETag'])
+        self.assertNotEqual(first.data, self.client.get('/?seed=8').data)
+
+    def test_not_modified(self):
+        etag = self.client.get('/?seed=7').headers['ETag']
+        response = self.client.get('/?seed=7', headers={'If-None-Match': etag})
+        self.assertEqual(304, response.status_code)
+        self.assertEqual(b'', response.data)
+
+    def test_cards_html(self):
+        cards = hearts.Deck(test_card_suits, test_card_ranks).cards
+        self.assertIs(hearts.Utils.card_html(cards[0]), hearts.Utils.card_html(cards[0]))
+        self.assertEqual(3, hearts.Utils.cards_html(cards, len(test_card_ranks)).count('<li></li>'))
+        self.assertNotIn('<li></li>', hearts.Utils.cards_html(cards))
+
+
+class TestEventChannel(unittest.TestCase):
+    def test_backpressure(self):
+        async def scenario():
+            channel = events.EventChannel(queue_size=2)
+            subscription = channel.subscribe("table")
+            [channel.fan_out("table", str(i)) for i in range(5)]
+            received = [await subscription.get(), await subscription.get()]
+            subscription.close()
+            return channel, received
+
+        channel, received = asyncio.run(scenario())
+        self.assertEqual([events.resync_event, "4"], received)
+        self.assertEqual(5, channel.published)
+        self.assertEqual(0, channel.spectator_count())
+
+    def test_stream(self):
+        channel = events.EventChannel()
+        port = channel.start(port=0)
+        table = server.Table("table-1", publish=channel.publish)
+        with socket.create_connection(("127.0.0.1", port), timeout=5) as connection:
+            connection.sendall(b"GET /tables/table-1/events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+            stream = connection.makefile("rb")
+            self.assertIn(b"200", stream.readline())
+            while stream.readline() != b"\r\n": pass
+            while channel.spectator_count() == 0: time.sleep(0.01)
+            table.join("Test Player 1")
+            self.assertEqual({'type': 'joined', 'table': 'table-1', 'hand': 0, 'version': 1, 'player': 'Test Player 1'},
+                             json.loads(stream.readline()[len(b"data: "):]))
+        channel.stop()
+        self.assertEqual(0, channel.spectator_count())
+
+    def test_start_failure(self):
+        channel = events.EventChannel()
+        port = channel.start(port=0)
+        with self.assertRaises(OSError):
+            events.EventChannel().start(port=port)
+        channel.stop()
+
+    def test_started_by_requests(self):
+        server.app.test_client().get('/metrics')
+        self.assertIsNotNone(server.table_events.loop)
+
+
+class TestRecords(unittest.TestCase):
+    def test_round_trip(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "games.hrts")
+            games = []
+            with records.GameRecordWriter(path) as writer:
+                for seed in range(3):
+                    game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                                       hearts.card_ranks, seed)
+                    game.play(hearts.player_names)
+                    writer.write(game, seed)
+                    games.append(game)
+            recorded = list(records.read_records(path))
+            self.assertEqual(3, len(recorded))
+            for game, record in zip(games, recorded):
+                self.assertEqual([p.name for p in game.players], record.names)
+                self.assertEqual(game.history, record.hands)
+                self.assertEqual({p.name: p.total_points() for p in game.players}, record.scores())
+            self.assertEqual(["0", "1", "2"], [seed for seed, _ in records.rescore(path)])
+
+    def test_replay_from_seed(self):
+        stats, encoded = simulation.run_games(0, 2, seed=3, record=True)
+        record = records.GameRecord.decode(encoded[records.length_format.size:])
+        game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks,
+                           record.seed)
+        game.play(hearts.player_names)
+        self.assertEqual(record.names, [p.name for p in game.players])
+        self.assertEqual(record.hands, game.history)
+
+    def test_size(self):
+        game = hearts.Game.of(hearts.Rules.of(), 1)
+        game.play(hearts.player_names)
+        passing_hands = sum(1 for r in game.history if r.hand % 4)
+        self.assertTrue(len(records.encode_game(game)) < 40 + 104 * len(game.history) + 12 * passing_hands)
+
+    def test_standard_rules_only(self):
+        for rules in (hearts.Rules.of(player_count=3), hearts.Rules.of(jack_of_diamonds=-10)):
+            game = hearts.Game.of(rules, 1)
+            game.play(rules.player_names)
+            self.assertRaises(ValueError, records.encode_game, game)
+        self.assertEqual([1, -1, 2, 0, 1], [records.pass_offset(hand) for hand in range(1, 6)])
+
+    def test_simulate(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "games.hrts")
+            stats = simulation.simulate(3, seed=2, workers=1, record_path=path)
+            scores = [record.scores() for record in records.read_records(path)]
+            self.assertEqual(3, len(scores))
+            self.assertEqual(stats.points, {name: sum(s[name] for s in scores) for name in stats.points})
+
+
+class TestMetrics(unittest.TestCase):
+    def test_disabled(self):
+        m = metrics.Metrics()
+        m.count("games")
+        m.observe("phase", 1.0, phase="deal")
+        self.assertEqual("\n", m.render())
+
+    def test_render(self):
+        m = metrics.Metrics()
+        m.enable()
+        m.count("games", 2)
+        m.observe("phase", 0.5, phase="deal")
+        m.observe("phase", 1.5, phase="deal")
+        m.count("responses", status='a"b')
+        m.gauge("tables", lambda: 3)
+        lines = m.render().splitlines()
+        self.assertIn('# TYPE hearts_phase_seconds summary', lines)
+        self.assertIn('hearts_phase_seconds_count{phase="deal"} 2', lines)
+        self.assertIn('hearts_phase_seconds_sum{phase="deal"} 2.000000000', lines)
+        self.assertIn('hearts_phase_seconds_max{phase="deal"} 1.500000000', lines)
+        self.assertIn('hearts_games_total 2', lines)
+        self.assertIn('hearts_responses_total{status="a\\"b"} 1', lines)
+        self.assertIn('hearts_tables 3', lines)
+
+    def test_game_phases(self):
+        metrics.metrics.enable()
+        try:
+            metrics.metrics.reset()
+            game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                               hearts.card_ranks, 1)
+            game.play(hearts.player_names)
+            client = server.app.test_client()
+            client.get('/?seed=1')
+            text = client.get('/metrics').get_data(as_text=True)
+        finally:
+            metrics.metrics.disable()
+            metrics.metrics.reset()
+        hands = len(game.history)
+        self.assertIn(f'hearts_phase_seconds_count{{phase="deal"}} {hands}', text)
+        self.assertIn(f'hearts_phase_seconds_count{{phase="trick"}} {13 * hands}', text)
+        self.assertIn(f'hearts_decision_seconds_count{{kind="play",strategy="RandomStrategy"}} {51 * hands}', text)
+        self.assertIn('hearts_games_total 1', text)
+        self.assertIn('hearts_request_seconds_count{endpoint="home_page"} 1', text)
+
+    def test_phases_exclude_waiting(self):
+        metrics.metrics.enable()
+        try:
+            metrics.metrics.reset()
+            game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits,
+                               hearts.card_ranks, 1)
+            game.add_players(hearts.player_names)
+            steps = game.steps()
+            decision = next(steps)
+            while len(game.tricks_by_player) == 0:
+                time.sleep(0.005)
+                decision = steps.send(decision.choose())
+            timers = dict(metrics.metrics.timers)
+        finally:
+            metrics.metrics.disable()
+            metrics.metrics.reset()
+        [self.assertLess(timers[("phase", (("phase", phase),))][1], 0.005) for phase in ("pass", "trick")]
+
+    def test_profile(self):
+        result, report = metrics.profile(sum, [1, 2, 3])
+        self.assertEqual(6, result)
+        self.assertIn("function calls", report)
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_measure(self):
+        result = benchmarks.benchmarks["deck_init"].measure(min_time=0.001, rounds=2)
+        self.assertEqual("micro", result['level'])
+        self.assertEqual(2, result['rounds'])
+        self.assertTrue(0 < result['min'] <= result['median'])
+
+    def test_run(self):
+        results = benchmarks.run(["trick_winning_player"], min_time=0.001, rounds=1)
+        self.assertEqual(["trick_winning_player"], list(results['benchmarks']))
+
+    def test_compare(self):
+        baseline = {'benchmarks': {'a': {'median': 1.0}, 'b': {'median': 1.0}, 'c': {'median': 1.0}}}
+        current = {'benchmarks': {'a': {'median': 1.05}, 'b': {'median': 1.5}, 'd': {'median': 1.0}}}
+        self.assertEqual([('a', 1.0, 1.05, 1.05, False), ('b', 1.0, 1.5, 1.5, True)],
+                         benchmarks.compare(baseline, current, threshold=0.1))
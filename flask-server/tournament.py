@@ -0,0 +1,219 @@
+import argparse
+import json
+import math
+import os
+import random
+import sys
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import ai
+import hearts
+
+# Strategies a tournament can seat, by name. An entrant is a name with optional factory arguments, given as
+# name:key=value,... with JSON values, e.g. ismcts:iterations=50,endgame=5.
+strategies = {
+    'random': hearts.RandomStrategy,
+    'passing': hearts.PassingStrategy,
+    'ismcts': ai.ISMCTSStrategy,
+}
+
+
+def parse_value(text):
+    try:
+        return json.loads(text)
+    except ValueError:
+        return text
+
+
+def parse_entrant(spec):
+    name, _, options = spec.partition(":")
+    if name not in strategies:
+        raise ValueError(f"Unknown strategy {name}; choose from {', '.join(strategies)}")
+    pairs = [option.partition("=") for option in options.split(",") if option]
+    if any(not separator for _, separator, _ in pairs):
+        raise ValueError(f"Strategy options must be key=value: {spec}")
+    return name, {key: parse_value(value) for key, _, value in pairs}
+
+
+def make_strategy(spec):
+    name, options = parse_entrant(spec)
+    return strategies[name](**options)
+
+
+# Fewer entrants than seats are repeated around the table.
+def lineup_of(entrants):
+    return [entrants[i % len(entrants)] for i in range(len(hearts.player_names))]
+
+
+# Seats are fixed and every player draws from a generator of its own, so the game's generator only shuffles the deck
+# and every rotation of a deal is dealt the same cards hand after hand.
+def seat_game(deal, seed, seated, rotation=0):
+    game = hearts.Game(hearts.starting_card_rank, hearts.starting_card_suit, hearts.card_suits, hearts.card_ranks,
+                       f"{seed}:{deal}")
+    game.players.extend(hearts.Player(f"{seat}:{spec}", make_strategy(spec),
+                                      random.Random(f"{seed}:{deal}:{rotation}:{seat}"))
+                        for seat, spec in enumerate(seated))
+    return game
+
+
+# A deal is one game seed played once per rotation of the lineup, so every entrant plays every seat's cards.
+def play_deal(deal, seed, lineup):
+    games = []
+    for rotation in range(len(lineup)):
+        seated = lineup[rotation:] + lineup[:rotation]
+        game = seat_game(deal, seed, seated, rotation)
+        try:
+            game.play_seated()
+        finally:
+            [p.strategy.close() for p in game.players]
+        games.append({'lineup': seated, 'points': [p.total_points() for p in game.players]})
+    return {'deal': deal, 'games': games}
+
+
+def play_deals(deals, seed, lineup):
+    return [play_deal(deal, seed, lineup) for deal in deals]
+
+
+# Yields the results of deals in chunks as they finish, keeping a few chunks per worker in flight so a run of any length
+# holds little in memory.
+def run_chunks(deals, seed, lineup, workers, chunk_size):
+    chunks = [deals[i:i + chunk_size] for i in range(0, len(deals), chunk_size)]
+    if workers == 1:
+        yield from (play_deals(c, seed, lineup) for c in chunks)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        chunks = iter(chunks)
+        while True:
+            pending |= {executor.submit(play_deals, c, seed, lineup) for c in
+                        (next(chunks, None) for _ in range(workers * 2 - len(pending))) if c is not None}
+            if not pending:
+                return
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            yield from (future.result() for future in done)
+
+
+# Reads a results file: a header line describing the tournament, then one line per finished deal in the order deals
+# finished. A last line cut short by a crash is cut from the file so its deal is played again.
+def read_results(path):
+    if not os.path.exists(path):
+        return None, []
+    header, results = None, []
+    complete = 0
+    with open(path, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                break
+            entry = json.loads(line)
+            if 'tournament' in entry:
+                header = entry['tournament']
+            else:
+                results.append(entry)
+            complete += len(line)
+    if complete < os.path.getsize(path):
+        os.truncate(path, complete)
+    return header, results
+
+
+# Plays deals 0 to deals - 1, skipping those already in the results file at path, and appends each finished deal to it.
+# Returns the results of every deal in the file.
+def run(path, entrants, deals, seed=0, workers=None, chunk_size=10):
+    [parse_entrant(spec) for spec in entrants]
+    lineup = lineup_of(entrants)
+    config = {'entrants': list(entrants), 'lineup': lineup, 'seed': str(seed)}
+    header, results = read_results(path)
+    if header is not None and header != config:
+        raise ValueError(f"{path} holds a different tournament: {header}")
+    finished = {result['deal'] for result in results}
+    remaining = [deal for deal in range(deals) if deal not in finished]
+    with open(path, "a") as file:
+        if header is None:
+            file.write(json.dumps({'tournament': config}) + "\n")
+        for chunk_results in run_chunks(remaining, str(seed), lineup, workers or os.cpu_count() or 1, chunk_size):
+            [file.write(json.dumps(result) + "\n") for result in chunk_results]
+            file.flush()
+            results.extend(chunk_results)
+    return results
+
+
+# Every pair of different entrants in a game scores 1 for the one that finished with fewer points and 0.5 each for a
+# tie. Returns ({(a, b): score of a against b}, {(a, b): games between a and b}) with both orders of every pair.
+def pairwise(results):
+    scores, games = {}, {}
+    for result in results:
+        for game in result['games']:
+            seats = list(zip(game['lineup'], game['points']))
+            for a, a_points in seats:
+                for b, b_points in seats:
+                    if a != b:
+                        scores[(a, b)] = scores.get((a, b), 0) + (1 if a_points < b_points else
+                                                                   0.5 if a_points == b_points else 0)
+                        games[(a, b)] = games.get((a, b), 0) + 1
+    return scores, games
+
+
+# Bradley-Terry strengths fitted to the pairwise scores by minorization-maximization and put on the Elo scale around
+# 1500. Every pair also gets prior drawn games so an entrant that never wins keeps a finite rating.
+def fit(entrants, scores, games, prior=1.0, iterations=1000, tolerance=1e-9):
+    strengths = {e: 1.0 for e in entrants}
+    for _ in range(iterations):
+        updated = {}
+        for a in entrants:
+            others = [b for b in entrants if b != a]
+            won = sum(scores.get((a, b), 0) + prior / 2 for b in others)
+            updated[a] = won / sum((games.get((a, b), 0) + prior) / (strengths[a] + strengths[b]) for b in others) \
+                if others else 1.0
+        scale = math.exp(sum(math.log(s) for s in updated.values()) / len(updated))
+        updated = {e: s / scale for e, s in updated.items()}
+        converged = all(abs(updated[e] - strengths[e]) < tolerance for e in entrants)
+        strengths = updated
+        if converged:
+            break
+    return {e: 1500 + 400 * math.log10(s) for e, s in strengths.items()}
+
+
+# Ratings with 95% confidence intervals from a grouped jackknife: deals are split into groups by number and the
+# ratings refitted with each group left out. Grouping whole deals keeps the rotations of a deal, which are not
+# independent, together.
+def ratings(results, groups=20):
+    entrants = sorted({spec for result in results for game in result['games'] for spec in game['lineup']})
+    fitted = fit(entrants, *pairwise(results))
+    grouped = {}
+    [grouped.setdefault(result['deal'] % groups, []).append(result) for result in results]
+    leave_outs = [fit(entrants, *pairwise([r for g, rs in grouped.items() if g != left_out for r in rs])) for left_out
+                  in grouped] if len(grouped) > 1 else []
+    table = {}
+    for e in entrants:
+        if leave_outs:
+            mean = sum(r[e] for r in leave_outs) / len(leave_outs)
+            error = math.sqrt((len(leave_outs) - 1) / len(leave_outs) * sum((r[e] - mean) ** 2 for r in leave_outs))
+        else:
+            error = math.inf
+        seats = [points for result in results for game in result['games'] for spec, points in
+                 zip(game['lineup'], game['points']) if spec == e]
+        table[e] = {'rating': fitted[e], 'low': fitted[e] - 1.96 * error, 'high': fitted[e] + 1.96 * error,
+                    'games': len(seats), 'average_points': sum(seats) / len(seats)}
+    return table
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Rate Hearts strategies against each other over duplicate deals")
+    parser.add_argument("path", help="results file, resumed if it exists")
+    parser.add_argument("entrants", nargs="+", help=f"strategies to seat: {', '.join(strategies)}, with options as "
+                                                    f"name:key=value,...")
+    parser.add_argument("--deals", type=int, default=100, help="deals to play; each is played once per rotation")
+    parser.add_argument("--seed", default=0)
+    parser.add_argument("--workers", type=int)
+    parser.add_argument("--chunk-size", type=int, default=10, help="deals sent to a worker at a time")
+    args = parser.parse_args(argv)
+    results = run(args.path, args.entrants, args.deals, args.seed, args.workers, args.chunk_size)
+    table = ratings(results)
+    [print(f"{spec:32} {r['rating']:7.1f} [{r['low']:7.1f}, {r['high']:7.1f}] {r['games']:8} games "
+           f"{r['average_points']:6.2f} points", file=sys.stderr) for spec, r in
+     sorted(table.items(), key=lambda item: -item[1]['rating'])]
+    print(json.dumps({'deals': len(results), 'ratings': table}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())